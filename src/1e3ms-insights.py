@@ -29,6 +29,7 @@ from starlette.responses import Response
 from starlette.types import Scope
 
 from insights.api import github as github_api
+from insights.api import installations as installations_api
 from insights.error import InsightsError
 from insights.logging import get_uvicorn_logging_config, setup_logging
 from insights.state import GlobalState
@@ -70,6 +71,7 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, Any]:
     yield
 
     logger.info("Stopping 1e3ms-insights")
+    await gstate.shutdown()
 
 
 def get_frontend_data_path() -> str:
@@ -84,7 +86,10 @@ def get_frontend_data_path() -> str:
 def insights_factory(
     static_dir: str | None = None,
 ) -> FastAPI:
-    api_tags_meta = [{"name": "github", "description": "GitHub webhook operations"}]
+    api_tags_meta = [
+        {"name": "github", "description": "GitHub webhook operations"},
+        {"name": "installations", "description": "Installation data"},
+    ]
 
     insights_app = FastAPI(
         docs_url=None,
@@ -102,6 +107,7 @@ def insights_factory(
     insights_api.state.gstate = gstate
 
     insights_api.include_router(github_api.router)
+    insights_api.include_router(installations_api.router)
 
     insights_app.mount("/api/v1", insights_api, name="API")
 
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import argparse
+import errno
+import math
+import statistics
+import sys
+import time
+from datetime import datetime as dt
+from typing import Any
+
+from insights.engine.analytics import (
+    COMMENT_COLUMNS,
+    ISSUE_COLUMNS,
+    AnalyticsError,
+    Columns,
+    Distribution,
+    distributions,
+    first_response_seconds,
+    load_numpy,
+    repo_names,
+    to_columns,
+)
+from insights.engine.db_types import InstallationCommentEntry, InstallationIssueEntry
+
+_START = "2023-01-01T00:00:00"
+_YEAR_MS = 365 * 86400 * 1000
+_PERCENTILES = (50, 90, 99)
+
+
+def _user(login: str, id: int) -> dict[str, Any]:
+    url = f"https://api.github.com/users/{login}"
+    return {
+        "login": login,
+        "id": id,
+        "node_id": f"U_{id}",
+        "avatar_url": f"https://avatars.githubusercontent.com/u/{id}",
+        "gravatar_id": "",
+        "url": url,
+        "html_url": f"https://github.com/{login}",
+        "followers_url": f"{url}/followers",
+        "following_url": f"{url}/following{{/other_user}}",
+        "gists_url": f"{url}/gists{{/gist_id}}",
+        "starred_url": f"{url}/starred{{/owner}}{{/repo}}",
+        "subscriptions_url": f"{url}/subscriptions",
+        "organizations_url": f"{url}/orgs",
+        "repos_url": f"{url}/repos",
+        "events_url": f"{url}/events{{/privacy}}",
+        "received_events_url": f"{url}/received_events",
+        "type": "User",
+        "site_admin": False,
+    }
+
+
+def generate(
+    np: Any, issues: int, comments: int, repos: int, seed: int
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """Synthetic issues and comments, as stored in compact mode."""
+    rng = np.random.default_rng(seed)
+    users = issues // 10 + 1
+    user_docs = [_user(f"user-{i}", i) for i in range(users)]
+
+    authors = rng.integers(0, users, issues).tolist()
+    start = np.datetime64(_START, "ms")
+    created = start + rng.integers(0, _YEAR_MS, issues)
+    # a third of issues are still open.
+    lifetime = rng.exponential(14 * 86400 * 1000, issues).astype(np.int64)
+    closed: list[dt | None] = (created + lifetime).tolist()
+    is_open = (rng.random(issues) < 1 / 3).tolist()
+    repo = rng.integers(0, repos, issues).tolist()
+    labels = rng.integers(0, 20, (issues, 2)).tolist()
+
+    issue_docs: list[dict[str, Any]] = []
+    for i, created_at in enumerate(created.tolist()):
+        closed_at = None if is_open[i] else closed[i]
+        state = "open" if closed_at is None else "closed"
+        name = f"repo-{repo[i]}"
+        url = f"https://api.github.com/repos/org/{name}/issues/{i}"
+        issue_docs.append(
+            {
+                "issue_id": f"I_{i}",
+                "repo_owner": "org",
+                "repo_name": name,
+                "issue_number": i,
+                "fetched_at": created_at,
+                "labels": [f"label-{n}" for n in labels[i][: i % 3]],
+                "milestone": None,
+                "state": state,
+                "instance": {
+                    "id": i,
+                    "node_id": f"I_{i}",
+                    "url": url,
+                    "repository_url": f"https://api.github.com/repos/org/{name}",
+                    "labels_url": f"{url}/labels{{/name}}",
+                    "comments_url": f"{url}/comments",
+                    "events_url": f"{url}/events",
+                    "html_url": f"https://github.com/org/{name}/issues/{i}",
+                    "number": i,
+                    "state": state,
+                    "title": f"Issue {i}",
+                    "user": user_docs[authors[i]],
+                    "labels": [],
+                    "assignee": None,
+                    "milestone": None,
+                    "locked": False,
+                    "comments": 0,
+                    "closed_at": closed_at,
+                    "created_at": created_at,
+                    "updated_at": closed_at or created_at,
+                    "author_association": "MEMBER",
+                },
+            }
+        )
+
+    # comments arrive with exponential delays, a third by the issue's author.
+    of_issue = rng.integers(0, issues, comments)
+    delay = rng.exponential(2 * 86400 * 1000, comments).astype(np.int64)
+    by_author = rng.random(comments) < 1 / 3
+    commenters = np.where(
+        by_author, np.asarray(authors)[of_issue], rng.integers(0, users, comments)
+    ).tolist()
+    comment_created = (created[of_issue] + delay).tolist()
+
+    comment_docs: list[dict[str, Any]] = [
+        {
+            "issue_id": f"I_{issue}",
+            "comment_id": f"IC_{i}",
+            "updated_at": created_at,
+            "by_login": f"user-{commenters[i]}",
+            "created_at": created_at,
+        }
+        for i, (issue, created_at) in enumerate(zip(of_issue.tolist(), comment_created))
+    ]
+    return issue_docs, comment_docs
+
+
+def read_columns(
+    np: Any, docs: list[dict[str, Any]], columns: Columns, batch_size: int
+) -> dict[str, Any]:
+    """Convert documents to columns in batches, as read from a cursor."""
+    chunks = [
+        to_columns(np, docs[i : i + batch_size], columns)
+        for i in range(0, len(docs), batch_size)
+    ]
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def vectorized(
+    np: Any, issues: dict[str, Any], comments: dict[str, Any]
+) -> dict[str, Distribution]:
+    """Time to first response by repo, from columns."""
+    values = first_response_seconds(
+        np,
+        issues["issue_id"],
+        issues["created_at"],
+        issues["author"],
+        comments["issue_id"],
+        comments["created_at"],
+        comments["by_login"],
+    )
+    return distributions(np, values, repo_names(np, issues))
+
+
+def with_models(
+    issue_docs: list[dict[str, Any]], comment_docs: list[dict[str, Any]]
+) -> dict[str, list[float]]:
+    """The same, looping over the entries' models."""
+    issues = {
+        e.issue_id: e
+        for e in (InstallationIssueEntry.model_validate(d) for d in issue_docs)
+    }
+    first: dict[str, dt] = {}
+    for doc in comment_docs:
+        comment = InstallationCommentEntry.model_validate(doc)
+        issue = issues.get(comment.issue_id)
+        if issue is None or comment.created_at is None:
+            continue
+        if issue.instance.user is not None:
+            if issue.instance.user.login == comment.by_login:
+                continue
+        seen = first.get(comment.issue_id)
+        if seen is None or comment.created_at < seen:
+            first[comment.issue_id] = comment.created_at
+
+    by_repo: dict[str, list[float]] = {}
+    for issue_id, created_at in first.items():
+        issue = issues[issue_id]
+        repo = f"{issue.repo_owner}/{issue.repo_name}"
+        by_repo.setdefault(repo, []).append(
+            (created_at - issue.instance.created_at).total_seconds()
+        )
+    return {
+        repo: statistics.quantiles(values, n=100, method="inclusive")
+        for repo, values in by_repo.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark time to first response over synthetic comments."
+    )
+    parser.add_argument("-c", "--comments", type=int, default=1_000_000)
+    parser.add_argument("-i", "--issues", type=int, default=100_000)
+    parser.add_argument("-r", "--repos", type=int, default=50)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=10000, help="documents per batch"
+    )
+    parser.add_argument(
+        "--no-models", action="store_true", help="skip the run over models"
+    )
+    args = parser.parse_args()
+
+    try:
+        np = load_numpy()
+    except AnalyticsError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(errno.EINVAL)
+
+    start = time.perf_counter()
+    issue_docs, comment_docs = generate(
+        np, args.issues, args.comments, args.repos, args.seed
+    )
+    print(
+        f"generated {len(issue_docs)} issues, {len(comment_docs)} comments "
+        + f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    start = time.perf_counter()
+    issues = read_columns(np, issue_docs, ISSUE_COLUMNS, args.batch_size)
+    comments = read_columns(np, comment_docs, COMMENT_COLUMNS, args.batch_size)
+    read_took = time.perf_counter() - start
+    start = time.perf_counter()
+    groups = vectorized(np, issues, comments)
+    compute_took = time.perf_counter() - start
+    took = read_took + compute_took
+    print(
+        f"vectorized: {len(groups)} repos in {took:.3f}s "
+        + f"({read_took:.3f}s to columns, {compute_took:.3f}s to compute)"
+    )
+
+    if args.no_models:
+        return
+
+    start = time.perf_counter()
+    expected = with_models(issue_docs, comment_docs)
+    models_took = time.perf_counter() - start
+    print(f"models: {len(expected)} repos in {models_took:.3f}s")
+    print(f"speedup: {models_took / took:.1f}x")
+
+    for repo, quantiles in expected.items():
+        for p in _PERCENTILES:
+            got = groups[repo].percentiles[f"p{p}"]
+            if not math.isclose(got, quantiles[p - 1], rel_tol=1e-9, abs_tol=1e-3):
+                print(f"mismatch: {repo} p{p} {got} != {quantiles[p - 1]}")
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import argparse
+import asyncio
+import errno
+import sys
+from datetime import datetime as dt
+from typing import BinaryIO, get_args
+
+from insights.config import Config, ConfigError
+from insights.engine.db_client import DBClient
+from insights.engine.export import ExportCollection, Exporter, ExportError, ExportFormat
+
+_DB_INSTALLATION_BY_ID = "installation-{id}"
+
+
+async def export(
+    config: Config,
+    installation_id: int,
+    collection: ExportCollection,
+    format: ExportFormat,
+    updated_since: dt | None,
+    batch_size: int,
+    out: BinaryIO,
+) -> int:
+    client = DBClient(config.db).client
+    db = client[_DB_INSTALLATION_BY_ID.format(id=installation_id)]
+
+    written = 0
+    exporter = Exporter(db, batch_size=batch_size)
+    async for chunk in exporter.stream(collection, format, updated_since=updated_since):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export an installation's issues or comments."
+    )
+    parser.add_argument("config", help="path to the insights config file")
+    parser.add_argument("installation", type=int, help="installation to export")
+    parser.add_argument("collection", choices=get_args(ExportCollection))
+    parser.add_argument(
+        "-f", "--format", choices=get_args(ExportFormat), default="ndjson"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="file to write to, stdout by default"
+    )
+    parser.add_argument(
+        "-s",
+        "--updated-since",
+        type=dt.fromisoformat,
+        help="only export what was updated since this ISO 8601 time",
+    )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=5000, help="documents per batch"
+    )
+    args = parser.parse_args()
+
+    try:
+        config = Config(args.config)
+    except ConfigError as e:
+        print(f"Unable to obtain config: {str(e)}", file=sys.stderr)
+        sys.exit(errno.EINVAL)
+
+    out: BinaryIO = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        written = asyncio.run(
+            export(
+                config,
+                args.installation,
+                args.collection,
+                args.format,
+                args.updated_since,
+                args.batch_size,
+                out,
+            )
+        )
+    except ExportError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(errno.EINVAL)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    print(f"Exported {written} bytes of {args.collection}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,10 @@
 # (at your option) any later version.
 
 import errno
+import hashlib
+import hmac
 import json
+import os
 import sys
 from pathlib import Path
 from typing import Any
@@ -61,7 +64,16 @@ def replay_event_file(addr: str, event_file: Path) -> None:
 
     uri = f"http://{addr}/api/v1/github/hooks" if not addr.startswith("http") else addr
 
-    res = httpx.post(uri, headers=headers, json=event)
+    body = json.dumps(event).encode("utf-8")
+    headers.append(("Content-Type", "application/json"))
+
+    # sign the event if we know the webhook secret, or it will be rejected.
+    secret = os.getenv("INSIGHTS_WEBHOOK_SECRET")
+    if secret is not None:
+        digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers.append(("X-Hub-Signature-256", f"sha256={digest}"))
+
+    res = httpx.post(uri, headers=headers, content=body)
     if not res.is_success:
         print(f"Error replaying event '{event_file}'")
     else:
@@ -6,16 +6,17 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
-from fastapi import APIRouter, HTTPException, Request, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from fastapi.logger import logger
-from githubkit.webhooks import parse
 from githubkit.webhooks.models import InstallationLite
 from githubkit.webhooks.types import WebhookEvent
 from pydantic import ValidationError
 
 from insights.api import GlobalStateDep, InsightsDep
-from insights.engine.handlers import handle_webhook
-from insights.eventdb import EventDB
+from insights.engine.handlers import dispatch_webhook, is_handled
+from insights.engine.ingest import IngestQueueClosedError, IngestQueueFullError
+from insights.state import GlobalState
+from insights.webhook import WebhookEnvelope
 
 router = APIRouter(prefix="/github", tags=["github"])
 
@@ -34,27 +35,92 @@ def get_installation_id(event: WebhookEvent) -> int:
 async def receive_webhook(
     request: Request, gstate: GlobalStateDep, insights: InsightsDep
 ):
-    event_name: str | None = request.headers.get("X-GitHub-Event")
-    if event_name is None:
+    envelope = await WebhookEnvelope.from_request(request)
+    if envelope is None:
         # not a github webhook event
         return
 
     assert gstate.inited
     assert gstate.config is not None
+    assert gstate.verifier is not None
 
-    eventdb = EventDB(gstate.config)
+    if not gstate.verifier.verify(envelope):
+        logger.debug(
+            f"Rejected event '{envelope.event_name}' "
+            f"(delivery {envelope.delivery_id}): bad signature"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid signature",
+        )
+
+    eventdb = insights.eventdb
+    event_name = envelope.event_name
 
     try:
-        event: WebhookEvent = parse(event_name, await request.body())
+        summary = envelope.summary()
+        if not is_handled(event_name, summary.action):
+            # nothing to act on, just archive it.
+            await eventdb.webhook(envelope)
+            logger.debug(
+                f"Event received: {event_name}, action: {summary.action}, "
+                f"installation: {summary.installation_id}, "
+                f"delivery: {envelope.delivery_id}, not handled"
+            )
+            return
+
+        delivery_id = envelope.delivery_id
+        if delivery_id is not None and not await insights.deliveries.claim(delivery_id):
+            logger.debug(f"Event '{event_name}' delivery {delivery_id} duplicated")
+            return
+
+        event = envelope.parse()
         logger.debug(f"Event received: {event_name}, type: {type(event)}")
     except ValidationError as e:
         logger.error(f"Unable to parse incoming event '{event_name}': {str(e)}")
-        await eventdb.webhook_error(request, msg=str(e))
+        await eventdb.webhook_error(envelope, msg=str(e))
+        if envelope.delivery_id is not None:
+            await insights.deliveries.release(envelope.delivery_id)
         return
 
-    await eventdb.webhook(request)
+    try:
+        await eventdb.webhook(envelope)
+        installation_id = get_installation_id(event)
+
+        if gstate.ingest is not None:
+            enqueue_webhook(gstate, envelope, installation_id, event)
+            return Response(status_code=status.HTTP_202_ACCEPTED)
 
-    installation_id = get_installation_id(event)
-    installation = await insights.get_installation(installation_id)
+        await dispatch_webhook(event, event_name, insights, installation_id)
+    except Exception:
+        # let a redelivery have another go at it.
+        if delivery_id is not None:
+            await insights.deliveries.release(delivery_id)
+        raise
 
-    await handle_webhook(event, event_name, insights, installation)
+
+def enqueue_webhook(
+    gstate: GlobalState,
+    envelope: WebhookEnvelope,
+    installation_id: int,
+    event: WebhookEvent,
+) -> None:
+    assert gstate.ingest is not None
+
+    event_name = envelope.event_name
+    try:
+        gstate.ingest.put(event_name, installation_id, event, envelope.delivery_id)
+    except IngestQueueFullError:
+        logger.warning(
+            f"Ingest queue full ({gstate.ingest.depth}), rejecting '{event_name}'"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Ingest queue full",
+            headers={"Retry-After": "1"},
+        )
+    except IngestQueueClosedError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Not accepting events",
+        )
@@ -0,0 +1,383 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from datetime import datetime as dt
+from typing import Awaitable, Callable
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from insights.api import InsightsDep
+from insights.engine.analytics import (
+    Analytics,
+    AnalyticsError,
+    AnalyticsMetric,
+    AnalyticsReport,
+    Grouping,
+)
+from insights.engine.cursor import InvalidCursorError
+from insights.engine.db_types import InstallationIssueEventEntry
+from insights.engine.export import (
+    EXPORT_MEDIA_TYPES,
+    ExportCollection,
+    Exporter,
+    ExportError,
+    ExportFormat,
+)
+from insights.engine.insights import Insights
+from insights.engine.installation import Installation
+from insights.engine.reads import (
+    AuthorStats,
+    CommentSummary,
+    InstallationSummary,
+    IssueDetails,
+    IssueSummary,
+    Page,
+    RepositorySummary,
+)
+from insights.engine.rollups import BUCKET_WIDTH, Resolution, RollupBucket, naive_utc
+
+router = APIRouter(prefix="/installations", tags=["installations"])
+
+_MAX_BUCKETS = 10000
+
+_REPO_PATTERN = r"^[^/]+/[^/]+$"
+
+_EXPORT_SUFFIXES: dict[ExportFormat, str] = {
+    "ndjson": "ndjson",
+    "arrow": "arrows",
+    "parquet": "parquet",
+}
+
+
+class TimelinePage(BaseModel):
+    events: list[InstallationIssueEventEntry]
+    next_cursor: str | None
+
+
+class BackfillStarted(BaseModel):
+    installation_id: int
+    restart: bool
+
+
+class ActivityPage(BaseModel):
+    resolution: Resolution
+    start: dt
+    end: dt
+    buckets: list[RollupBucket]
+
+
+def get_installation(insights: Insights, installation_id: int) -> Installation:
+    installation = insights.find_installation(installation_id)
+    if installation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Installation not found",
+        )
+    return installation
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def cached_response(
+    request: Request,
+    insights: Insights,
+    scope: Installation | None,
+    read: Callable[[], Awaitable[BaseModel]],
+) -> Response:
+    """Respond with what's read, cached until the data read from changes.
+
+    Requests with a matching 'If-None-Match' get a 304, without a body.
+    """
+    # obtained before reading, so a concurrent write makes the entry stale.
+    if scope is None:
+        key = (None, insights.generation, request.url.path, request.url.query)
+    else:
+        key = (scope.id, scope.generation, request.url.path, request.url.query)
+
+    cache = insights.read_cache
+    entry = cache.get(key)
+    if entry is None:
+        try:
+            res = await read()
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor",
+            )
+        entry = cache.put(key, res.model_dump_json().encode("utf-8"))
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+@router.get("", response_model=Page[InstallationSummary])
+async def list_installations(
+    request: Request,
+    insights: InsightsDep,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    return await cached_response(
+        request,
+        insights,
+        None,
+        lambda: insights.list_installations(cursor=cursor, limit=limit),
+    )
+
+
+@router.get("/{installation_id}/repositories", response_model=Page[RepositorySummary])
+async def list_repositories(
+    installation_id: int,
+    request: Request,
+    insights: InsightsDep,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    installation = get_installation(insights, installation_id)
+    return await cached_response(
+        request,
+        insights,
+        installation,
+        lambda: installation.reads.repositories(cursor=cursor, limit=limit),
+    )
+
+
+@router.get("/{installation_id}/issues", response_model=Page[IssueSummary])
+async def list_issues(
+    installation_id: int,
+    request: Request,
+    insights: InsightsDep,
+    repo: str | None = Query(default=None, pattern=_REPO_PATTERN),
+    state: str | None = Query(default=None, pattern=r"^(open|closed)$"),
+    label: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    installation = get_installation(insights, installation_id)
+    repo_owner, repo_name = repo.split("/") if repo is not None else (None, None)
+    return await cached_response(
+        request,
+        insights,
+        installation,
+        lambda: installation.reads.issues(
+            repo_owner=repo_owner,
+            repo_name=repo_name,
+            state=state,
+            label=label,
+            cursor=cursor,
+            limit=limit,
+        ),
+    )
+
+
+@router.get("/{installation_id}/issues/{issue_id}", response_model=IssueDetails)
+async def get_issue(
+    installation_id: int,
+    issue_id: str,
+    request: Request,
+    insights: InsightsDep,
+) -> Response:
+    installation = get_installation(insights, installation_id)
+
+    async def read() -> IssueDetails:
+        issue = await installation.reads.issue(issue_id)
+        if issue is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Issue not found",
+            )
+        return issue
+
+    return await cached_response(request, insights, installation, read)
+
+
+@router.get(
+    "/{installation_id}/issues/{issue_id}/comments",
+    response_model=Page[CommentSummary],
+)
+async def list_issue_comments(
+    installation_id: int,
+    issue_id: str,
+    request: Request,
+    insights: InsightsDep,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    installation = get_installation(insights, installation_id)
+    return await cached_response(
+        request,
+        insights,
+        installation,
+        lambda: installation.reads.comments(issue_id, cursor=cursor, limit=limit),
+    )
+
+
+@router.get(
+    "/{installation_id}/issues/{issue_id}/timeline", response_model=TimelinePage
+)
+async def get_issue_timeline(
+    installation_id: int,
+    issue_id: str,
+    request: Request,
+    insights: InsightsDep,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    installation = get_installation(insights, installation_id)
+
+    async def read() -> TimelinePage:
+        events, next_cursor = await installation.get_issue_timeline(
+            issue_id, cursor=cursor, limit=limit
+        )
+        return TimelinePage(events=events, next_cursor=next_cursor)
+
+    return await cached_response(request, insights, installation, read)
+
+
+@router.get("/{installation_id}/comments/stats", response_model=Page[AuthorStats])
+async def get_comment_stats(
+    installation_id: int,
+    request: Request,
+    insights: InsightsDep,
+    cursor: str | None = None,
+    limit: int = Query(default=50, gt=0, le=100),
+) -> Response:
+    """Comments by each author, excluding deleted comments."""
+    installation = get_installation(insights, installation_id)
+    return await cached_response(
+        request,
+        insights,
+        installation,
+        lambda: installation.reads.comment_stats(cursor=cursor, limit=limit),
+    )
+
+
+@router.post(
+    "/{installation_id}/backfill",
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def start_backfill(
+    installation_id: int,
+    insights: InsightsDep,
+    restart: bool = False,
+) -> BackfillStarted:
+    """Backfill an installation in the background, from scratch if 'restart'.
+
+    Otherwise the backfill resumes from its checkpoints.
+    """
+    installation = get_installation(insights, installation_id)
+    if not insights.backfill(
+        installation_id, installation=installation, restart=restart
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Backfill already in progress",
+        )
+    return BackfillStarted(installation_id=installation_id, restart=restart)
+
+
+@router.get("/{installation_id}/activity")
+async def get_activity(
+    installation_id: int,
+    insights: InsightsDep,
+    start: dt,
+    end: dt | None = None,
+    resolution: Resolution = "hour",
+    repo: str | None = Query(default=None, pattern=_REPO_PATTERN),
+) -> ActivityPage:
+    """Activity counters over '[start, end)', for a repository if 'repo' is set."""
+    installation = get_installation(insights, installation_id)
+    start = naive_utc(start)
+    end = naive_utc(end) if end is not None else dt.utcnow()
+    if end <= start or (end - start) / BUCKET_WIDTH[resolution] > _MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range must be positive, and at most {_MAX_BUCKETS} buckets",
+        )
+
+    repo_owner, repo_name = repo.split("/") if repo is not None else (None, None)
+    buckets = await installation.rollups.query(
+        resolution, start, end, repo_owner=repo_owner, repo_name=repo_name
+    )
+    return ActivityPage(resolution=resolution, start=start, end=end, buckets=buckets)
+
+
+@router.get("/{installation_id}/analytics/{metric}", response_model=AnalyticsReport)
+async def get_analytics(
+    installation_id: int,
+    metric: AnalyticsMetric,
+    request: Request,
+    insights: InsightsDep,
+    group_by: Grouping | None = None,
+) -> Response:
+    """Distribution of response times, in seconds, by repo or label if grouped.
+
+    Without 'group_by', label dwell times are by label, and the others aren't
+    grouped.
+    """
+    installation = get_installation(insights, installation_id)
+    try:
+        analytics = Analytics(installation.db)
+    except AnalyticsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=str(e),
+        )
+
+    async def read() -> AnalyticsReport:
+        match metric:
+            case "first_response":
+                return await analytics.first_response(group_by=group_by)
+            case "lifetime":
+                return await analytics.lifetime(group_by=group_by)
+            case "label_dwell":
+                if group_by is None:
+                    return await analytics.label_dwell()
+                return await analytics.label_dwell(group_by=group_by)
+
+    return await cached_response(request, insights, installation, read)
+
+
+@router.get("/{installation_id}/export/{collection}")
+async def export_collection(
+    installation_id: int,
+    collection: ExportCollection,
+    insights: InsightsDep,
+    format: ExportFormat = "ndjson",
+    updated_since: dt | None = None,
+) -> StreamingResponse:
+    """Stream an installation's issues or comments, updated since a time if set."""
+    installation = get_installation(insights, installation_id)
+    try:
+        stream = Exporter(installation.db).stream(
+            collection, format, updated_since=updated_since
+        )
+    except ExportError as e:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=str(e),
+        )
+
+    filename = f"installation-{installation_id}-{collection}.{_EXPORT_SUFFIXES[format]}"
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -9,9 +9,13 @@
 
 import json
 from pathlib import Path
+from typing import Literal
 
 from pydantic import BaseModel, Field, ValidationError, field_validator
 
+from insights.logwriter import Durability
+from insights.segmentlog import Compression
+
 
 class ConfigError(Exception):
     _msg: str | None
@@ -77,6 +81,17 @@ class GitHubConfigModel(BaseModel):
     app_id: int
     private_key_path: Path
     webhook_secret: str
+    # accepted alongside 'webhook_secret' while rotating secrets
+    webhook_secret_previous: str | None = Field(default=None)
+    max_connections: int = Field(default=20, gt=0)
+    client_cache_size: int = Field(default=1000, gt=0)
+    token_refresh_margin: int = Field(default=300, ge=0)
+    max_concurrency: int = Field(default=8, gt=0)
+    max_retries: int = Field(default=3, ge=0)
+    backfill_reserve: int = Field(default=500, ge=0)
+    # 'nodes(ids:)' accepts at most 100 ids per query
+    graphql_batch_size: int = Field(default=100, gt=0, le=100)
+    graphql_batch_delay: float = Field(default=0.01, ge=0)
 
     @field_validator("private_key_path")
     @classmethod
@@ -99,18 +114,104 @@ class EventDBConfigModel(BaseModel):
     log_webhook_errors: bool = Field(default=False)
     log_rest: bool = Field(default=False)
     log_rest_errors: bool = Field(default=False)
+    segment_max_bytes: int = Field(default=64 * 1024 * 1024, gt=0)
+    compression: Compression = Field(default="none")
+    durability: Durability = Field(default="batch")
+    flush_batch: int = Field(default=100, gt=0)
+    flush_interval: float = Field(default=1.0, gt=0)
+    max_queue_size: int = Field(default=10000, gt=0)
+
+
+class IngestConfigModel(BaseModel):
+    mode: Literal["inline", "queue"] = Field(default="inline")
+    workers: int = Field(default=4, gt=0)
+    max_queue_size: int = Field(default=1000, gt=0)
+    drain_timeout: float = Field(default=30.0, ge=0)
+
+
+class DeliveriesConfigModel(BaseModel):
+    max_recent: int = Field(default=10000, gt=0)
+    ttl_seconds: int = Field(default=7 * 24 * 3600, gt=0)
+
+
+class BackfillConfigModel(BaseModel):
+    enabled: bool = Field(default=True)
+    concurrency: int = Field(default=4, gt=0)
+    per_page: int = Field(default=100, gt=0, le=100)
+
+
+class ResyncConfigModel(BaseModel):
+    enabled: bool = Field(default=True)
+    interval: float = Field(default=900.0, gt=0)
+    # fraction of the interval by which each run is randomly moved
+    jitter: float = Field(default=0.2, ge=0, lt=1)
+    per_page: int = Field(default=100, gt=0, le=100)
+    # stored issues not fetched for this many seconds are refreshed, none if 0
+    refresh_after: float = Field(default=86400.0, ge=0)
+    # most stale issues refreshed per run
+    refresh_limit: int = Field(default=100, gt=0)
+
+
+class StorageConfigModel(BaseModel):
+    # 'compact' keeps only the analyzed comment fields, with repositories and
+    # users stored once each.
+    comments: Literal["full", "compact"] = Field(default="full")
+    keep_comment_body: bool = Field(default=True)
+    # previous versions kept per edited comment, none if 0
+    comment_history: int = Field(default=0, ge=0)
+
+
+class WritesConfigModel(BaseModel):
+    # pending writes per collection, flushed at whichever comes first
+    max_batch: int = Field(default=500, gt=0)
+    max_delay: float = Field(default=0.005, ge=0)
+    # write concern for batched writes
+    w: int | Literal["majority"] = Field(default=1)
+    journal: bool | None = Field(default=None)
+
+
+class RollupsConfigModel(BaseModel):
+    enabled: bool = Field(default=True)
+    # how often buckets are downsampled, in seconds
+    interval: float = Field(default=600.0, gt=0)
+    # how long each resolution is kept, in seconds; days forever if not set
+    minute_retention: float = Field(default=2 * 24 * 3600, gt=0)
+    hour_retention: float = Field(default=90 * 24 * 3600, gt=0)
+    day_retention: float | None = Field(default=None, gt=0)
+
+
+class ApiConfigModel(BaseModel):
+    # how long read responses are cached, in seconds; 0 disables caching
+    cache_ttl: float = Field(default=30.0, ge=0)
+    cache_max_entries: int = Field(default=1000, gt=0)
 
 
 class ConfigModel(BaseModel):
     github: GitHubConfigModel
     mongodb: MongoDBConfigModel
     events: EventDBConfigModel | None = Field(default=None)
+    ingest: IngestConfigModel = Field(default_factory=IngestConfigModel)
+    deliveries: DeliveriesConfigModel = Field(default_factory=DeliveriesConfigModel)
+    backfill: BackfillConfigModel = Field(default_factory=BackfillConfigModel)
+    resync: ResyncConfigModel = Field(default_factory=ResyncConfigModel)
+    storage: StorageConfigModel = Field(default_factory=StorageConfigModel)
+    writes: WritesConfigModel = Field(default_factory=WritesConfigModel)
+    rollups: RollupsConfigModel = Field(default_factory=RollupsConfigModel)
+    api: ApiConfigModel = Field(default_factory=ApiConfigModel)
 
 
 class Config:
     _github: GitHubConfigModel
     _db: MongoDBConfigModel
     _eventdb: EventDBConfigModel | None
+    _ingest: IngestConfigModel
+    _deliveries: DeliveriesConfigModel
+    _backfill: BackfillConfigModel
+    _resync: ResyncConfigModel
+    _storage: StorageConfigModel
+    _writes: WritesConfigModel
+    _rollups: RollupsConfigModel
+    _api: ApiConfigModel
 
     def __init__(self, path: str) -> None:
         p = Path(path)
@@ -132,6 +233,14 @@ class Config:
             self._github = cfg.github
             self._db = cfg.mongodb
             self._eventdb = cfg.events
+            self._ingest = cfg.ingest
+            self._deliveries = cfg.deliveries
+            self._backfill = cfg.backfill
+            self._resync = cfg.resync
+            self._storage = cfg.storage
+            self._writes = cfg.writes
+            self._rollups = cfg.rollups
+            self._api = cfg.api
 
     @property
     def github(self) -> GitHubConfigModel:
@@ -147,3 +256,35 @@ class Config:
     @property
     def eventdb(self) -> EventDBConfigModel | None:
         return self._eventdb
+
+    @property
+    def ingest(self) -> IngestConfigModel:
+        return self._ingest
+
+    @property
+    def deliveries(self) -> DeliveriesConfigModel:
+        return self._deliveries
+
+    @property
+    def backfill(self) -> BackfillConfigModel:
+        return self._backfill
+
+    @property
+    def resync(self) -> ResyncConfigModel:
+        return self._resync
+
+    @property
+    def storage(self) -> StorageConfigModel:
+        return self._storage
+
+    @property
+    def writes(self) -> WritesConfigModel:
+        return self._writes
+
+    @property
+    def rollups(self) -> RollupsConfigModel:
+        return self._rollups
+
+    @property
+    def api(self) -> ApiConfigModel:
+        return self._api
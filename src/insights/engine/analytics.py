@@ -0,0 +1,488 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from datetime import datetime as dt
+from datetime import timedelta as td
+from typing import Any, Callable, Literal, cast
+
+import motor.motor_asyncio
+from pydantic import BaseModel
+
+from insights.error import InsightsError
+
+AnalyticsMetric = Literal["first_response", "lifetime", "label_dwell"]
+Grouping = Literal["repo", "label"]
+
+ColumnKind = Literal["string", "time", "strings"]
+# fields read into arrays, as (path, kind) by column name
+Columns = dict[str, tuple[str, ColumnKind]]
+
+DEFAULT_PERCENTILES: list[float] = [50, 75, 90, 95, 99]
+
+# histogram bin edges, in seconds, the same for every group so they compare.
+DEFAULT_EDGES: list[float] = [
+    0,
+    60,
+    5 * 60,
+    15 * 60,
+    3600,
+    4 * 3600,
+    12 * 3600,
+    86400,
+    3 * 86400,
+    7 * 86400,
+    14 * 86400,
+    30 * 86400,
+    90 * 86400,
+    365 * 86400,
+]
+
+_DEFAULT_BATCH_SIZE = 10000
+
+_EPOCH = dt(1970, 1, 1)
+_MILLISECOND = td(milliseconds=1)
+# NumPy's not-a-time, as an int64
+_NAT = -(2**63)
+
+_COLL_ISSUES = "issues"
+_COLL_COMMENTS = "comments"
+_COLL_ISSUE_EVENTS = "issue_events"
+
+ISSUE_COLUMNS: Columns = {
+    "issue_id": ("issue_id", "string"),
+    "repo_owner": ("repo_owner", "string"),
+    "repo_name": ("repo_name", "string"),
+    "labels": ("labels", "strings"),
+    "author": ("instance.user.login", "string"),
+    "created_at": ("instance.created_at", "time"),
+    "closed_at": ("instance.closed_at", "time"),
+}
+
+COMMENT_COLUMNS: Columns = {
+    "issue_id": ("issue_id", "string"),
+    "by_login": ("by_login", "string"),
+    "created_at": ("created_at", "time"),
+}
+
+# comments stored before compaction only have their full model.
+_LEGACY_COMMENT_COLUMNS: Columns = {
+    **COMMENT_COLUMNS,
+    "created_at": ("comment.created_at", "time"),
+}
+
+_REPO_COLUMNS: Columns = {
+    "issue_id": ("issue_id", "string"),
+    "repo_owner": ("repo_owner", "string"),
+    "repo_name": ("repo_name", "string"),
+}
+
+_LABEL_EVENT_COLUMNS: Columns = {
+    "issue_id": ("issue_id", "string"),
+    "event": ("event", "string"),
+    "label": ("data.label", "string"),
+    "created_at": ("created_at", "time"),
+}
+
+
+class AnalyticsError(InsightsError):
+    def __init__(self, msg: str | None = None) -> None:
+        super().__init__(f"Analytics Error: {msg}")
+
+
+def load_numpy() -> Any:
+    """Obtain the 'numpy' module, raising 'AnalyticsError' if not installed."""
+    try:
+        import numpy  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        raise AnalyticsError("Analytics require the 'numpy' package")
+    return numpy  # pyright: ignore[reportUnknownVariableType]
+
+
+class Histogram(BaseModel):
+    # in seconds, 'counts[i]' is of values in '[edges[i], edges[i + 1])'
+    edges: list[float]
+    counts: list[int]
+    # values at or above the last edge
+    over: int
+
+
+class Distribution(BaseModel):
+    """Summary of a set of durations, in seconds."""
+
+    count: int
+    mean: float
+    min: float
+    max: float
+    # by name, e.g. 'p90'
+    percentiles: dict[str, float]
+    histogram: Histogram
+
+
+class AnalyticsReport(BaseModel):
+    metric: AnalyticsMetric
+    group_by: Grouping | None
+    # by repository 'owner/name', label, or 'all' when not grouped
+    groups: dict[str, Distribution]
+
+
+def _getter(path: str) -> Callable[[dict[str, Any]], Any]:
+    parts = path.split(".")
+    if len(parts) == 1:
+        return lambda doc: doc.get(path)
+
+    def get(doc: dict[str, Any]) -> Any:
+        value: Any = doc
+        for part in parts:
+            if not isinstance(value, dict):
+                return None
+            value = cast(dict[str, Any], value).get(part)
+        return value
+
+    return get
+
+
+def _epoch_ms(value: dt | None) -> int:
+    """Milliseconds since the epoch of a stored, naive UTC, time; NaT if None."""
+    if value is None:
+        return _NAT
+    return (value - _EPOCH) // _MILLISECOND
+
+
+def to_columns(np: Any, docs: list[dict[str, Any]], columns: Columns) -> dict[str, Any]:
+    """Convert documents to arrays of their fields, by column name.
+
+    A 'strings' column is flattened, with its lengths in '<name>_counts'.
+    """
+    arrays: dict[str, Any] = {}
+    for name, (path, kind) in columns.items():
+        values = list(map(_getter(path), docs))
+        if kind == "time":
+            # much faster than having NumPy convert datetimes.
+            ms = np.array([_epoch_ms(v) for v in values], dtype=np.int64)
+            arrays[name] = ms.view("datetime64[ms]")
+        elif kind == "string":
+            arrays[name] = np.array(["" if v is None else v for v in values], dtype=str)
+        else:
+            lists: list[list[str]] = [v or [] for v in values]
+            arrays[name] = np.array([s for v in lists for s in v], dtype=str)
+            arrays[f"{name}_counts"] = np.array([len(v) for v in lists], dtype=np.int64)
+    return arrays
+
+
+def repo_names(np: Any, columns: dict[str, Any]) -> Any:
+    """Obtain 'owner/name' of the repositories in 'repo_owner' and 'repo_name'."""
+    return np.char.add(np.char.add(columns["repo_owner"], "/"), columns["repo_name"])
+
+
+def _percentile_name(p: float) -> str:
+    return f"p{p:g}".replace(".", "_")
+
+
+def _distribution(
+    np: Any, values: Any, percentiles: list[float], edges: Any
+) -> Distribution:
+    counts, _ = np.histogram(values, np.append(edges, np.inf))
+    return Distribution(
+        count=len(values),
+        mean=float(values.mean()),
+        min=float(values[0]),
+        max=float(values[-1]),
+        percentiles={
+            _percentile_name(p): float(v)
+            for p, v in zip(percentiles, np.percentile(values, percentiles))
+        },
+        histogram=Histogram(
+            edges=[float(e) for e in edges],
+            counts=counts[:-1].tolist(),
+            over=int(counts[-1]),
+        ),
+    )
+
+
+def distributions(
+    np: Any,
+    values: Any,
+    groups: Any | None = None,
+    *,
+    percentiles: list[float] = DEFAULT_PERCENTILES,
+    edges: list[float] = DEFAULT_EDGES,
+) -> dict[str, Distribution]:
+    """Summarize durations, by group if each value's group is given.
+
+    Values are sorted once, by group and value, so each group is a sorted
+    slice; NaN values, i.e., durations that did not end, are skipped.
+    """
+    bins = np.asarray(edges, dtype=np.float64)
+    valid = ~np.isnan(values)
+    values = values[valid]
+    if groups is None:
+        if len(values) == 0:
+            return {}
+        return {"all": _distribution(np, np.sort(values), percentiles, bins)}
+
+    keys, inverse = np.unique(groups[valid], return_inverse=True)
+    order = np.lexsort((values, inverse))
+    values = values[order]
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+    return {
+        str(key): _distribution(
+            np, values[bounds[i] : bounds[i + 1]], percentiles, bins
+        )
+        for i, key in enumerate(keys)
+    }
+
+
+def _seconds(np: Any, delta: Any) -> Any:
+    """Convert time deltas to seconds, as floats, with NaT as NaN."""
+    return delta / np.timedelta64(1, "s")
+
+
+def _match(np: Any, ids: Any, keys: Any) -> tuple[Any, Any]:
+    """Find the index in 'ids' of each key, by binary search on sorted ids.
+
+    Returns the indexes, and whether each key was found; the index of a key
+    not found is arbitrary, but valid if 'ids' isn't empty.
+    """
+    if len(ids) == 0:
+        return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    order = np.argsort(ids)
+    pos = np.minimum(np.searchsorted(ids[order], keys), len(ids) - 1)
+    idx = order[pos]
+    return idx, ids[idx] == keys
+
+
+def first_response_seconds(
+    np: Any,
+    issue_ids: Any,
+    issue_created: Any,
+    issue_authors: Any,
+    comment_issue_ids: Any,
+    comment_created: Any,
+    comment_authors: Any,
+) -> Any:
+    """Time from each issue's creation to its first comment by someone else.
+
+    Issues without such a comment are NaN.
+    """
+    if len(issue_ids) == 0:
+        return np.zeros(0, dtype=np.float64)
+    idx, found = _match(np, issue_ids, comment_issue_ids)
+    keep = found & (comment_authors != issue_authors[idx]) & ~np.isnat(comment_created)
+
+    # earliest comment of each issue, in ms, with no comment as the maximum.
+    never = np.iinfo(np.int64).max
+    first = np.full(len(issue_ids), never, dtype=np.int64)
+    np.minimum.at(first, idx[keep], comment_created[keep].view(np.int64))
+    first = np.where(first == never, np.iinfo(np.int64).min, first).view(
+        "datetime64[ms]"
+    )
+    return _seconds(np, first - issue_created)
+
+
+def lifetime_seconds(np: Any, issue_created: Any, issue_closed: Any) -> Any:
+    """Time from each issue's creation to it being closed, NaN if still open."""
+    return _seconds(np, issue_closed - issue_created)
+
+
+def label_dwell_seconds(
+    np: Any, issue_ids: Any, labels: Any, events: Any, created: Any
+) -> tuple[Any, Any, Any]:
+    """Time each label stayed on an issue, from being added to being removed.
+
+    Returns the durations, with their labels and issue ids; labels still on
+    an issue have no duration yet, and are skipped.
+    """
+    order = np.lexsort((created, labels, issue_ids))
+    issue_ids = issue_ids[order]
+    labels = labels[order]
+    events = events[order]
+    created = created[order]
+
+    # an addition directly followed by the removal of the same label.
+    pairs = (
+        (events[:-1] == "labeled")
+        & (events[1:] == "unlabeled")
+        & (issue_ids[:-1] == issue_ids[1:])
+        & (labels[:-1] == labels[1:])
+    )
+    dwell = _seconds(np, created[1:][pairs] - created[:-1][pairs])
+    return dwell, labels[:-1][pairs], issue_ids[:-1][pairs]
+
+
+class Analytics:
+    """Distributions of response times, over an installation's stored data.
+
+    Only the fields needed are read, projected and in batches, into NumPy
+    arrays; the distributions are computed on whole columns at once, in a
+    worker thread so that the event loop isn't held up meanwhile.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _batch_size: int
+    _np: Any
+
+    def __init__(
+        self,
+        db: motor.motor_asyncio.AsyncIOMotorDatabase,
+        *,
+        batch_size: int = _DEFAULT_BATCH_SIZE,
+    ) -> None:
+        """Raises 'AnalyticsError' if NumPy is not available."""
+        self._db = db
+        self._batch_size = batch_size
+        self._np = load_numpy()
+
+    async def _columns(
+        self, collection: str, query: dict[str, Any], columns: Columns
+    ) -> dict[str, Any]:
+        """Read fields, by column name, into arrays; see 'to_columns'."""
+        np = self._np
+        projection: dict[str, Any] = {"_id": 0}
+        projection.update({path: 1 for path, _ in columns.values()})
+
+        chunks: list[dict[str, Any]] = []
+        cursor = self._db.get_collection(collection).find(
+            query, projection, batch_size=self._batch_size
+        )
+        batch: list[dict[str, Any]] = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= self._batch_size:
+                chunks.append(await asyncio.to_thread(to_columns, np, batch, columns))
+                batch = []
+        # even if empty, so that every column is there.
+        chunks.append(await asyncio.to_thread(to_columns, np, batch, columns))
+        return await asyncio.to_thread(
+            lambda: {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+        )
+
+    def _report(
+        self,
+        metric: AnalyticsMetric,
+        group_by: Grouping | None,
+        values: Any,
+        issues: dict[str, Any],
+        percentiles: list[float],
+        edges: list[float],
+    ) -> AnalyticsReport:
+        """Report per-issue values, grouped by the issue's repo or labels."""
+        np = self._np
+        groups: Any | None = None
+        if group_by == "repo":
+            groups = repo_names(np, issues)
+        elif group_by == "label":
+            # once for each of the issue's labels.
+            values = np.repeat(values, issues["labels_counts"])
+            groups = issues["labels"]
+        return AnalyticsReport(
+            metric=metric,
+            group_by=group_by,
+            groups=distributions(
+                np, values, groups, percentiles=percentiles, edges=edges
+            ),
+        )
+
+    async def first_response(
+        self,
+        *,
+        group_by: Grouping | None = None,
+        percentiles: list[float] = DEFAULT_PERCENTILES,
+        edges: list[float] = DEFAULT_EDGES,
+    ) -> AnalyticsReport:
+        """Time to an issue's first comment by someone other than its author."""
+        issues = await self._columns(_COLL_ISSUES, {}, ISSUE_COLUMNS)
+        comments = await self._columns(
+            _COLL_COMMENTS, {"created_at": {"$exists": True}}, COMMENT_COLUMNS
+        )
+        legacy = await self._columns(
+            _COLL_COMMENTS, {"created_at": {"$exists": False}}, _LEGACY_COMMENT_COLUMNS
+        )
+
+        def report() -> AnalyticsReport:
+            np = self._np
+            values = first_response_seconds(
+                np,
+                issues["issue_id"],
+                issues["created_at"],
+                issues["author"],
+                np.concatenate([comments["issue_id"], legacy["issue_id"]]),
+                np.concatenate([comments["created_at"], legacy["created_at"]]),
+                np.concatenate([comments["by_login"], legacy["by_login"]]),
+            )
+            return self._report(
+                "first_response", group_by, values, issues, percentiles, edges
+            )
+
+        return await asyncio.to_thread(report)
+
+    async def lifetime(
+        self,
+        *,
+        group_by: Grouping | None = None,
+        percentiles: list[float] = DEFAULT_PERCENTILES,
+        edges: list[float] = DEFAULT_EDGES,
+    ) -> AnalyticsReport:
+        """Time from an issue's creation to it being closed, for closed issues."""
+        issues = await self._columns(_COLL_ISSUES, {}, ISSUE_COLUMNS)
+
+        def report() -> AnalyticsReport:
+            values = lifetime_seconds(
+                self._np, issues["created_at"], issues["closed_at"]
+            )
+            return self._report(
+                "lifetime", group_by, values, issues, percentiles, edges
+            )
+
+        return await asyncio.to_thread(report)
+
+    async def label_dwell(
+        self,
+        *,
+        group_by: Grouping | None = "label",
+        percentiles: list[float] = DEFAULT_PERCENTILES,
+        edges: list[float] = DEFAULT_EDGES,
+    ) -> AnalyticsReport:
+        """Time labels stayed on issues, by label unless grouped otherwise."""
+        events = await self._columns(
+            _COLL_ISSUE_EVENTS,
+            {"event": {"$in": ["labeled", "unlabeled"]}, "data.label": {"$ne": None}},
+            _LABEL_EVENT_COLUMNS,
+        )
+        issues: dict[str, Any] | None = None
+        if group_by == "repo":
+            issues = await self._columns(_COLL_ISSUES, {}, _REPO_COLUMNS)
+
+        def report() -> AnalyticsReport:
+            np = self._np
+            values, labels, issue_ids = label_dwell_seconds(
+                np,
+                events["issue_id"],
+                events["label"],
+                events["event"],
+                events["created_at"],
+            )
+
+            groups: Any | None = None
+            if group_by == "label":
+                groups = labels
+            elif issues is not None:
+                idx, found = _match(np, issues["issue_id"], issue_ids)
+                # events of issues no longer stored are skipped.
+                values = values[found]
+                groups = repo_names(np, issues)[idx[found]]
+
+            return AnalyticsReport(
+                metric="label_dwell",
+                group_by=group_by,
+                groups=distributions(
+                    np, values, groups, percentiles=percentiles, edges=edges
+                ),
+            )
+
+        return await asyncio.to_thread(report)
@@ -0,0 +1,158 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from typing import Literal
+
+import githubkit.rest.models as ghk_rest_models
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
+
+from insights.config import BackfillConfigModel
+from insights.engine.github import Github
+from insights.engine.installation import Installation
+from insights.engine.pagination import InstallationPaginator
+
+_DB_COLLECTION_BACKFILL = "backfill"
+
+Phase = Literal["issues", "comments", "done"]
+
+
+class BackfillCheckpoint(BaseModel):
+    """Backfill progress for a repository, keyed by its full name."""
+
+    id: str = Field(alias="_id")
+    phase: Phase = Field(default="issues")
+    # next page to fetch in the current phase
+    page: int = Field(default=1)
+
+
+class Backfill:
+    """Import every issue and comment of an installation's repositories.
+
+    Repositories are imported concurrently, up to 'concurrency' at a time, and
+    each is streamed page by page, issues first, then comments, with every page
+    written through a single bulk upsert. A checkpoint is kept per repository
+    after each page, so an interrupted backfill picks up where it stopped.
+    """
+
+    _config: BackfillConfigModel
+    _installation: Installation
+    _paginator: InstallationPaginator
+    _checkpoints: motor.motor_asyncio.AsyncIOMotorCollection
+
+    def __init__(
+        self, config: BackfillConfigModel, github: Github, installation: Installation
+    ) -> None:
+        self._config = config
+        self._installation = installation
+        self._paginator = InstallationPaginator(
+            github, installation.id, per_page=config.per_page
+        )
+        self._checkpoints = installation.db.get_collection(_DB_COLLECTION_BACKFILL)
+
+    async def reset(self) -> None:
+        """Drop all checkpoints, so the next run starts over."""
+        await self._checkpoints.delete_many({})
+
+    async def run(self) -> bool:
+        """Backfill all repositories, returning True if all of them completed."""
+        sem = asyncio.Semaphore(self._config.concurrency)
+
+        async def _bounded(repo: ghk_rest_models.Repository) -> bool:
+            async with sem:
+                return await self._backfill_repo(repo)
+
+        tasks: list[asyncio.Task[bool]] = []
+        async for repo in self._paginator.repositories():
+            tasks.append(asyncio.create_task(_bounded(repo)))
+
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        return all(results)
+
+    async def _checkpoint(self, checkpoint: BackfillCheckpoint) -> None:
+        await self._checkpoints.replace_one(
+            {"_id": checkpoint.id},
+            checkpoint.model_dump(by_alias=True),
+            upsert=True,
+        )
+
+    async def _backfill_repo(self, repo: ghk_rest_models.Repository) -> bool:
+        raw = await self._checkpoints.find_one({"_id": repo.full_name})
+        checkpoint = (
+            BackfillCheckpoint(_id=repo.full_name)
+            if raw is None
+            else BackfillCheckpoint.model_validate(raw)
+        )
+        if checkpoint.phase == "done":
+            return True
+
+        owner = repo.owner.login
+        name = repo.name
+        per_page = self._config.per_page
+        logger.info(
+            f"Backfilling '{repo.full_name}' for installation "
+            f"{self._installation.id}, from {checkpoint.phase} page {checkpoint.page}"
+        )
+
+        try:
+            if checkpoint.phase == "issues":
+                async for page, issues in self._paginator.pages(
+                    lambda gh, page: gh.rest.issues.async_list_for_repo(
+                        owner,
+                        name,
+                        state="all",
+                        sort="created",
+                        direction="asc",
+                        per_page=per_page,
+                        page=page,
+                    ),
+                    checkpoint.page,
+                ):
+                    await self._installation.bulk_upsert_issues(owner, name, issues)
+                    checkpoint.page = page + 1
+                    await self._checkpoint(checkpoint)
+
+                checkpoint.phase = "comments"
+                checkpoint.page = 1
+                await self._checkpoint(checkpoint)
+
+            issue_ids = await self._installation.get_issue_ids(owner, name)
+            async for page, comments in self._paginator.pages(
+                lambda gh, page: gh.rest.issues.async_list_comments_for_repo(
+                    owner,
+                    name,
+                    sort="created",
+                    direction="asc",
+                    per_page=per_page,
+                    page=page,
+                ),
+                checkpoint.page,
+            ):
+                await self._installation.bulk_upsert_comments(repo, comments, issue_ids)
+                checkpoint.page = page + 1
+                await self._checkpoint(checkpoint)
+
+        except Exception as e:
+            logger.error(
+                f"Unable to backfill '{repo.full_name}' for installation "
+                f"{self._installation.id}: {str(e)}"
+            )
+            return False
+
+        checkpoint.phase = "done"
+        await self._checkpoint(checkpoint)
+        logger.info(f"Backfilled '{repo.full_name}'")
+        return True
@@ -0,0 +1,90 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from insights.engine.scheduler import Priority
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchFn = Callable[[list[K], Priority], Awaitable[dict[K, V | None]]]
+
+
+class Batcher(Generic[K, V]):
+    """Collect lookups for a short while, and resolve them in a single call.
+
+    Keys are gathered until 'max_batch' are pending, or 'max_delay' seconds
+    pass since the first of them, and then resolved together. A batch runs at
+    the highest priority of the lookups it contains. Lookups for a key already
+    pending share its result.
+    """
+
+    _fn: BatchFn[K, V]
+    _max_batch: int
+    _max_delay: float
+    _pending: dict[K, asyncio.Future[V | None]]
+    _priority: Priority
+    _timer: asyncio.TimerHandle | None
+    _batches: set[asyncio.Task[None]]
+
+    def __init__(self, fn: BatchFn[K, V], *, max_batch: int, max_delay: float) -> None:
+        self._fn = fn
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._pending = {}
+        self._priority = Priority.BACKFILL
+        self._timer = None
+        self._batches = set()
+
+    async def get(self, key: K, *, priority: Priority = Priority.LIVE) -> V | None:
+        """Resolve a key, or None if the batch call did not return it."""
+        fut = self._pending.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[key] = fut
+
+        self._priority = min(self._priority, priority)
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self._max_delay, self._flush
+            )
+
+        return await asyncio.shield(fut)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, priority = self._pending, self._priority
+        self._pending = {}
+        self._priority = Priority.BACKFILL
+
+        # keep a reference, so the task isn't collected while running.
+        task = asyncio.create_task(self._resolve(batch, priority))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _resolve(
+        self, batch: dict[K, asyncio.Future[V | None]], priority: Priority
+    ) -> None:
+        try:
+            results = await self._fn(list(batch.keys()), priority)
+        except Exception as e:
+            for fut in batch.values():
+                fut.set_exception(e)
+                # avoid warnings about an unretrieved exception if nobody waited.
+                fut.exception()
+            return
+
+        for key, fut in batch.items():
+            fut.set_result(results.get(key))
@@ -0,0 +1,189 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from typing import Any, Iterable
+
+import bson
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+COLL_REPOSITORIES = "repositories"
+COLL_USERS = "users"
+
+_COLL_COMMENTS = "comments"
+
+_REACTIONS = ("+1", "-1", "laugh", "confused", "heart", "hooray", "eyes", "rocket")
+
+
+def compact_comment(
+    comment: dict[str, Any], repository: dict[str, Any], *, keep_body: bool
+) -> dict[str, Any]:
+    """Obtain the fields of a comment we analyze, from its full REST or webhook form.
+
+    The repository and author are referred to by id, and are expected to be
+    stored on their own, see 'ref_updates()'.
+    """
+    user: dict[str, Any] | None = comment.get("user")
+    body: str | None = comment.get("body")
+    reactions: dict[str, Any] = comment.get("reactions") or {}
+
+    fields: dict[str, Any] = {
+        "created_at": comment["created_at"],
+        "author_id": user["id"] if user is not None else None,
+        "author_association": comment.get("author_association"),
+        "repository_id": repository["id"],
+        "body_length": len(body) if body is not None else 0,
+        "reactions": {k: reactions[k] for k in _REACTIONS if reactions.get(k)},
+    }
+    if keep_body:
+        fields["body"] = body
+    return fields
+
+
+def ref_updates(
+    repositories: Iterable[dict[str, Any]], users: Iterable[dict[str, Any]]
+) -> tuple[list[UpdateOne], list[UpdateOne]]:
+    """Obtain the upserts storing repositories and users, keyed by their id."""
+
+    def _ops(docs: Iterable[dict[str, Any]]) -> list[UpdateOne]:
+        by_id = {d["id"]: d for d in docs}
+        return [
+            UpdateOne({"_id": id}, {"$set": doc}, upsert=True)
+            for id, doc in by_id.items()
+        ]
+
+    return _ops(repositories), _ops(users)
+
+
+class CompactionReport(BaseModel):
+    database: str
+    comments: int
+    compacted: int
+    repositories: int
+    users: int
+    # encoded document sizes, with the deduplicated repositories and users
+    # accounted for once in the compacted size.
+    bytes_before: int
+    bytes_after: int
+
+    @property
+    def reduction(self) -> float:
+        if self.bytes_before == 0:
+            return 0.0
+        return 1.0 - self.bytes_after / self.bytes_before
+
+
+class CommentCompactor:
+    """Migrate an installation's comments to the compact storage schema.
+
+    Comments still embedding their full comment and repository models have
+    their compact fields added and the embedded models removed, with the
+    repositories and authors moved to their own collections.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _keep_body: bool
+    _batch_size: int
+
+    def __init__(
+        self,
+        db: motor.motor_asyncio.AsyncIOMotorDatabase,
+        *,
+        keep_body: bool,
+        batch_size: int = 500,
+    ) -> None:
+        self._db = db
+        self._keep_body = keep_body
+        self._batch_size = batch_size
+
+    async def migrate(self, *, dry_run: bool = False) -> CompactionReport:
+        coll = self._db.get_collection(_COLL_COMMENTS)
+        report = CompactionReport(
+            database=self._db.name,
+            comments=await coll.count_documents({}),
+            compacted=0,
+            repositories=0,
+            users=0,
+            bytes_before=0,
+            bytes_after=0,
+        )
+        repositories: dict[int, int] = {}
+        users: dict[int, int] = {}
+
+        batch: list[dict[str, Any]] = []
+        async for doc in coll.find({"comment": {"$exists": True}}):
+            batch.append(doc)
+            if len(batch) >= self._batch_size:
+                await self._migrate_batch(batch, report, repositories, users, dry_run)
+                batch = []
+        if len(batch) > 0:
+            await self._migrate_batch(batch, report, repositories, users, dry_run)
+
+        report.repositories = len(repositories)
+        report.users = len(users)
+        report.bytes_after += sum(repositories.values()) + sum(users.values())
+        return report
+
+    async def _migrate_batch(
+        self,
+        docs: list[dict[str, Any]],
+        report: CompactionReport,
+        repositories: dict[int, int],
+        users: dict[int, int],
+        dry_run: bool,
+    ) -> None:
+        ops: list[UpdateOne] = []
+        repos: list[dict[str, Any]] = []
+        authors: list[dict[str, Any]] = []
+
+        for doc in docs:
+            comment: dict[str, Any] = doc["comment"]
+            repository: dict[str, Any] | None = doc.get("repository")
+            if repository is None:
+                logger.warning(f"Comment '{doc['comment_id']}' has no repository")
+                continue
+
+            fields = compact_comment(comment, repository, keep_body=self._keep_body)
+            compacted = {
+                k: v for k, v in doc.items() if k not in ("comment", "repository")
+            }
+            compacted.update(fields)
+
+            report.compacted += 1
+            report.bytes_before += len(bson.encode(doc))
+            report.bytes_after += len(bson.encode(compacted))
+
+            repos.append(repository)
+            repositories.setdefault(repository["id"], len(bson.encode(repository)))
+            user: dict[str, Any] | None = comment.get("user")
+            if user is not None:
+                authors.append(user)
+                users.setdefault(user["id"], len(bson.encode(user)))
+
+            ops.append(
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": fields, "$unset": {"comment": "", "repository": ""}},
+                )
+            )
+
+        if dry_run or len(ops) == 0:
+            return
+
+        # references first, so a comment never points to a missing document.
+        repo_ops, user_ops = ref_updates(repos, authors)
+        await self._db.get_collection(COLL_REPOSITORIES).bulk_write(
+            repo_ops, ordered=False
+        )
+        if len(user_ops) > 0:
+            await self._db.get_collection(COLL_USERS).bulk_write(
+                user_ops, ordered=False
+            )
+        await self._db.get_collection(_COLL_COMMENTS).bulk_write(ops, ordered=False)
@@ -0,0 +1,36 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import base64
+import json
+from typing import Any, cast
+
+from insights.error import InsightsError
+
+
+class InvalidCursorError(InsightsError):
+    def __init__(self) -> None:
+        super().__init__("invalid cursor")
+
+
+def encode_cursor(*keys: Any) -> str:
+    """Encode the sort keys of the last returned document into an opaque cursor."""
+    raw = json.dumps(keys, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        keys = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise InvalidCursorError()
+
+    if not isinstance(keys, list):
+        raise InvalidCursorError()
+    return cast(list[Any], keys)
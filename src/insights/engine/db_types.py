@@ -33,6 +33,14 @@ class InstallationEntry(BaseModel):
     deleted_at: dt | None = Field(default=None)
 
 
+class CommentEdit(BaseModel):
+    """A comment's body before an edit."""
+
+    edited_at: dt
+    body_length: int
+    body: str | None = Field(default=None)
+
+
 class InstallationCommentEntry(BaseModel):
     id: PyObjectId | None = Field(alias="_id", default=None)
 
@@ -40,8 +48,30 @@ class InstallationCommentEntry(BaseModel):
     comment_id: str
     updated_at: dt
     by_login: str
-    comment: ghk_wh_models.IssueComment
-    repository: ghk_wh_models.Repository
+
+    # what we analyze, with the repository and author stored on their own;
+    # missing from comments stored before these were introduced.
+    created_at: dt | None = Field(default=None)
+    author_id: int | None = Field(default=None)
+    author_association: str | None = Field(default=None)
+    repository_id: int | None = Field(default=None)
+    body_length: int | None = Field(default=None)
+    reactions: dict[str, int] = Field(default={})
+    body: str | None = Field(default=None)
+
+    # set when deleted, the entry is kept as a tombstone
+    deleted_at: dt | None = Field(default=None)
+    # the last 'storage.comment_history' edits, oldest first
+    history: list[CommentEdit] = Field(default=[])
+
+    # full models, from webhooks or from the REST API when backfilling; only
+    # kept when storing comments in full.
+    comment: ghk_wh_models.IssueComment | ghk_rest_models.IssueComment | None = Field(
+        default=None
+    )
+    repository: ghk_wh_models.Repository | ghk_rest_models.Repository | None = Field(
+        default=None
+    )
 
 
 class InstallationIssueEntry(BaseModel):
@@ -54,7 +84,10 @@ class InstallationIssueEntry(BaseModel):
 
     fetched_at: dt
 
-    events: list[Any] = Field(default=[])
+    # summary of the issue's timeline, kept in its own collection.
+    event_counts: dict[str, int] = Field(default={})
+    last_event_at: dt | None = Field(default=None)
+
     labels: list[str] = Field(default=[])
     milestone: ghk_rest_models.Milestone | None
     state: str
@@ -62,6 +95,19 @@ class InstallationIssueEntry(BaseModel):
     instance: ghk_rest_models.Issue
 
 
+class InstallationIssueEventEntry(BaseModel):
+    """An event in an issue's timeline."""
+
+    id: PyObjectId | None = Field(alias="_id", default=None)
+
+    issue_id: str
+    event: str
+    actor: str | None
+    created_at: dt
+    # event specific details, e.g., the label added
+    data: dict[str, Any] = Field(default={})
+
+
 class ProjectEntry(BaseModel):
     """Container for a single project entry."""
 
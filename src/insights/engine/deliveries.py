@@ -0,0 +1,87 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from collections import OrderedDict
+from datetime import datetime as dt
+
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from insights.config import DeliveriesConfigModel
+
+
+class DeliveryTracker:
+    """Track webhook delivery ids, so redeliveries are handled only once.
+
+    Recently seen ids are kept in a bounded LRU, avoiding a round-trip for the
+    common case of a quick redelivery. Claims are backed by a collection keyed
+    on the delivery id, expired through a TTL index, which holds across restarts
+    and multiple processes.
+    """
+
+    _config: DeliveriesConfigModel
+    _coll: motor.motor_asyncio.AsyncIOMotorCollection
+    _recent: OrderedDict[str, None]
+    _duplicates: int
+
+    def __init__(
+        self,
+        config: DeliveriesConfigModel,
+        coll: motor.motor_asyncio.AsyncIOMotorCollection,
+    ) -> None:
+        self._config = config
+        self._coll = coll
+        self._recent = OrderedDict()
+        self._duplicates = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self._duplicates
+
+    async def init(self) -> None:
+        await self._coll.create_index(
+            "received_at", expireAfterSeconds=self._config.ttl_seconds
+        )
+
+    def _remember(self, delivery_id: str) -> None:
+        self._recent[delivery_id] = None
+        self._recent.move_to_end(delivery_id)
+        while len(self._recent) > self._config.max_recent:
+            self._recent.popitem(last=False)
+
+    async def claim(self, delivery_id: str) -> bool:
+        """Claim a delivery, returning False if it has been seen before."""
+        if delivery_id in self._recent:
+            self._recent.move_to_end(delivery_id)
+            self._duplicates += 1
+            return False
+
+        try:
+            await self._coll.insert_one(
+                {"_id": delivery_id, "received_at": dt.utcnow()}
+            )
+        except DuplicateKeyError:
+            self._remember(delivery_id)
+            self._duplicates += 1
+            return False
+        except PyMongoError as e:
+            # rather handle a duplicate than drop an event.
+            logger.error(f"Unable to record delivery '{delivery_id}': {str(e)}")
+            return True
+
+        self._remember(delivery_id)
+        return True
+
+    async def release(self, delivery_id: str) -> None:
+        """Forget a claimed delivery, so it may be handled again."""
+        self._recent.pop(delivery_id, None)
+        try:
+            await self._coll.delete_one({"_id": delivery_id})
+        except PyMongoError as e:
+            logger.error(f"Unable to release delivery '{delivery_id}': {str(e)}")
@@ -0,0 +1,263 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+import io
+import json
+from datetime import datetime as dt
+from datetime import timezone
+from typing import Any, AsyncGenerator, AsyncIterator, Literal, cast
+
+import motor.motor_asyncio
+
+from insights.engine.rollups import naive_utc
+from insights.error import InsightsError
+
+ExportCollection = Literal["issues", "comments"]
+ExportFormat = Literal["ndjson", "arrow", "parquet"]
+
+ColumnType = Literal["string", "int", "timestamp", "strings"]
+
+EXPORT_MEDIA_TYPES: dict[ExportFormat, str] = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_DEFAULT_BATCH_SIZE = 5000
+
+# exported columns, with the fields they're read from in order of preference;
+# comments stored before compaction only have their full model.
+_COLUMNS: dict[ExportCollection, list[tuple[str, list[str], ColumnType]]] = {
+    "issues": [
+        ("issue_id", ["issue_id"], "string"),
+        ("repo_owner", ["repo_owner"], "string"),
+        ("repo_name", ["repo_name"], "string"),
+        ("issue_number", ["issue_number"], "int"),
+        ("state", ["state"], "string"),
+        ("labels", ["labels"], "strings"),
+        ("title", ["instance.title"], "string"),
+        ("author", ["instance.user.login"], "string"),
+        ("created_at", ["instance.created_at"], "timestamp"),
+        ("updated_at", ["instance.updated_at"], "timestamp"),
+        ("closed_at", ["instance.closed_at"], "timestamp"),
+        ("fetched_at", ["fetched_at"], "timestamp"),
+    ],
+    "comments": [
+        ("comment_id", ["comment_id"], "string"),
+        ("issue_id", ["issue_id"], "string"),
+        ("by_login", ["by_login"], "string"),
+        ("author_id", ["author_id", "comment.user.id"], "int"),
+        (
+            "author_association",
+            ["author_association", "comment.author_association"],
+            "string",
+        ),
+        ("repository_id", ["repository_id", "repository.id"], "int"),
+        ("created_at", ["created_at", "comment.created_at"], "timestamp"),
+        ("updated_at", ["updated_at"], "timestamp"),
+        ("deleted_at", ["deleted_at"], "timestamp"),
+        ("body_length", ["body_length"], "int"),
+        ("body", ["body", "comment.body"], "string"),
+    ],
+}
+
+# deleting a comment keeps its last 'updated_at', and sets 'deleted_at'.
+_UPDATED_FIELDS: dict[ExportCollection, list[str]] = {
+    "issues": ["instance.updated_at"],
+    "comments": ["updated_at", "deleted_at"],
+}
+
+
+class ExportError(InsightsError):
+    def __init__(self, msg: str | None = None) -> None:
+        super().__init__(f"Export Error: {msg}")
+
+
+def _pyarrow() -> Any:
+    try:
+        import pyarrow  # pyright: ignore[reportMissingImports]
+        import pyarrow.ipc  # pyright: ignore
+        import pyarrow.parquet  # pyright: ignore
+    except ImportError:
+        raise ExportError("Arrow and Parquet exports require the 'pyarrow' package")
+    return pyarrow  # pyright: ignore[reportUnknownVariableType]
+
+
+def _get(doc: dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = cast(dict[str, Any], value).get(part)
+    return value
+
+
+def _row(
+    doc: dict[str, Any], columns: list[tuple[str, list[str], ColumnType]]
+) -> dict[str, Any]:
+    row: dict[str, Any] = {}
+    for name, paths, _ in columns:
+        value: Any = None
+        for path in paths:
+            value = _get(doc, path)
+            if value is not None:
+                break
+        if name == "body_length" and value is None:
+            # the body isn't a row column yet, read it from the doc.
+            body = _get(doc, "body")
+            if body is None:
+                body = _get(doc, "comment.body")
+            value = len(body) if body is not None else None
+        row[name] = value
+    return row
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, dt):
+        # stored times are naive UTC.
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return str(value)
+
+
+class _Chunks(io.RawIOBase):
+    """A write-only file, handing out what's written so far when drained."""
+
+    _chunks: list[bytes]
+    _pos: int
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Any) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class Exporter:
+    """Stream an installation's issues or comments, in batches.
+
+    Documents are read from a cursor and encoded a batch at a time, so memory
+    use depends on the batch size only. Rows have the same columns whatever
+    the storage mode, and include deleted comments, with 'deleted_at' set.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _batch_size: int
+
+    def __init__(
+        self,
+        db: motor.motor_asyncio.AsyncIOMotorDatabase,
+        *,
+        batch_size: int = _DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self._db = db
+        self._batch_size = batch_size
+
+    async def batches(
+        self, collection: ExportCollection, *, updated_since: dt | None = None
+    ) -> AsyncGenerator[list[dict[str, Any]], None]:
+        """Yield batches of rows, updated at or after 'updated_since' if set.
+
+        Comments deleted since then count as updated.
+        """
+        columns = _COLUMNS[collection]
+        query: dict[str, Any] = {}
+        if updated_since is not None:
+            since = {"$gte": naive_utc(updated_since)}
+            query["$or"] = [{f: since} for f in _UPDATED_FIELDS[collection]]
+        projection: dict[str, Any] = {"_id": 0}
+        for _, paths, _ in columns:
+            projection.update({p: 1 for p in paths})
+
+        cursor = self._db.get_collection(collection).find(
+            query, projection, batch_size=self._batch_size
+        )
+        batch: list[dict[str, Any]] = []
+        async for doc in cursor:
+            batch.append(_row(doc, columns))
+            if len(batch) >= self._batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def stream(
+        self,
+        collection: ExportCollection,
+        format: ExportFormat,
+        *,
+        updated_since: dt | None = None,
+    ) -> AsyncGenerator[bytes, None]:
+        """Obtain the encoded export, in chunks of one batch each.
+
+        Raises 'ExportError' right away if the format is not available.
+        """
+        batches = self.batches(collection, updated_since=updated_since)
+        if format == "ndjson":
+            return _ndjson(batches)
+        return _arrow(_pyarrow(), batches, collection, format)
+
+
+async def _ndjson(
+    batches: AsyncIterator[list[dict[str, Any]]],
+) -> AsyncGenerator[bytes, None]:
+    async for batch in batches:
+        yield "".join(
+            json.dumps(row, default=_json_default) + "\n" for row in batch
+        ).encode("utf-8")
+
+
+async def _arrow(
+    pa: Any,
+    batches: AsyncIterator[list[dict[str, Any]]],
+    collection: ExportCollection,
+    format: ExportFormat,
+) -> AsyncGenerator[bytes, None]:
+    types: dict[ColumnType, Any] = {
+        "string": pa.string(),
+        "int": pa.int64(),
+        "timestamp": pa.timestamp("ms", tz="UTC"),
+        "strings": pa.list_(pa.string()),
+    }
+    schema = pa.schema([(name, types[t]) for name, _, t in _COLUMNS[collection]])
+
+    sink = _Chunks()
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    def write(batch: list[dict[str, Any]]) -> None:
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+    try:
+        # one row group, or record batch, per batch; encoding it is CPU bound.
+        async for batch in batches:
+            await asyncio.to_thread(write, batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -6,21 +6,107 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime as dt
+from datetime import timedelta, timezone
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, TypeVar
+
 import githubkit as ghk
+import httpx
+from fastapi.logger import logger
+from githubkit.auth.base import BaseAuthStrategy
 
 from insights.config import GitHubConfigModel
+from insights.engine.scheduler import Priority, RequestScheduler
 from insights.error import InsightsError
 
+A = TypeVar("A", bound=BaseAuthStrategy)
+T = TypeVar("T")
+
+InstallationGitHub = ghk.GitHub["InstallationTokenAuthStrategy"]
+
 
 class InvalidPrivateKeyError(InsightsError):
     def __init__(self) -> None:
         super().__init__("Invalid GitHub private key")
 
 
+class _PooledGitHub(ghk.GitHub[A]):
+    """GitHub client sending its requests through a long-lived HTTP client."""
+
+    _client: httpx.AsyncClient
+
+    def __init__(self, auth: A, transport: httpx.AsyncHTTPTransport) -> None:
+        super().__init__(auth, user_agent="1e3ms-insights")
+        defaults: dict[str, Any] = self._get_client_defaults()
+        self._client = httpx.AsyncClient(transport=transport, **defaults)
+
+    @asynccontextmanager
+    async def get_async_client(self) -> AsyncGenerator[httpx.AsyncClient, None]:
+        yield self._client
+
+
+class _InstallationToken:
+    token: str | None
+    expires_at: dt | None
+    lock: asyncio.Lock
+
+    def __init__(self) -> None:
+        self.token = None
+        self.expires_at = None
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self, margin: timedelta) -> bool:
+        if self.token is None or self.expires_at is None:
+            return False
+        return dt.now(timezone.utc) + margin < self.expires_at
+
+
+class _InstallationTokenAuth(httpx.Auth):
+    _entry: _InstallationToken
+
+    def __init__(self, entry: _InstallationToken) -> None:
+        self._entry = entry
+
+    def auth_flow(
+        self, request: httpx.Request
+    ) -> Generator[httpx.Request, httpx.Response, None]:
+        request.headers["Authorization"] = f"token {self._entry.token}"
+        yield request
+
+
+class InstallationTokenAuthStrategy(BaseAuthStrategy):
+    """Authenticate with the installation's currently cached access token."""
+
+    _entry: _InstallationToken
+
+    def __init__(self, entry: _InstallationToken) -> None:
+        self._entry = entry
+
+    def get_auth_flow(self, github: Any) -> httpx.Auth:
+        return _InstallationTokenAuth(self._entry)
+
+
+class _InstallationClient:
+    token: _InstallationToken
+    gh: InstallationGitHub
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport) -> None:
+        self.token = _InstallationToken()
+        self.gh = _PooledGitHub(InstallationTokenAuthStrategy(self.token), transport)
+
+
 class Github:
     """Manages and maintains GitHub state"""
 
+    _config: GitHubConfigModel
+    _transport: httpx.AsyncHTTPTransport
     _github: ghk.GitHub[ghk.AppAuthStrategy]
+    _clients: OrderedDict[int, _InstallationClient]
+    _refresh_margin: timedelta
+    _scheduler: RequestScheduler
 
     def __init__(self, config: GitHubConfigModel) -> None:
         pvt_key = config.private_key_path.read_text()
@@ -28,17 +114,88 @@ class Github:
         if len(pvt_key) == 0:
             raise InvalidPrivateKeyError()
 
-        self._github = ghk.GitHub(
-            ghk.AppAuthStrategy(config.app_id, pvt_key),
-            user_agent="1e3ms-insights",
+        # one connection pool, kept alive, for the app and all installations.
+        self._config = config
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_connections,
+            ),
+        )
+        self._github = _PooledGitHub(
+            ghk.AppAuthStrategy(config.app_id, pvt_key), self._transport
         )
-        pass
+        self._clients = OrderedDict()
+        self._refresh_margin = timedelta(seconds=config.token_refresh_margin)
+        self._scheduler = RequestScheduler(
+            max_concurrency=config.max_concurrency,
+            max_retries=config.max_retries,
+            backfill_reserve=config.backfill_reserve,
+        )
+
+    @property
+    def config(self) -> GitHubConfigModel:
+        return self._config
 
     @property
     def gh(self) -> ghk.GitHub[ghk.AppAuthStrategy]:
         return self._github
 
-    def get(self, installation_id: int) -> ghk.GitHub[ghk.AppInstallationAuthStrategy]:
-        return self._github.with_auth(
-            self._github.auth.as_installation(installation_id)
+    @property
+    def scheduler(self) -> RequestScheduler:
+        return self._scheduler
+
+    async def call(
+        self,
+        installation_id: int,
+        fn: Callable[[InstallationGitHub], Awaitable[T]],
+        *,
+        priority: Priority = Priority.LIVE,
+    ) -> T:
+        """Run a request for an installation through the request scheduler."""
+
+        async def _call() -> T:
+            return await fn(await self.get(installation_id))
+
+        return await self._scheduler.call(installation_id, _call, priority=priority)
+
+    async def get(self, installation_id: int) -> InstallationGitHub:
+        """Obtain a client for an installation, with a valid access token."""
+        client = self._clients.get(installation_id)
+        if client is None:
+            client = _InstallationClient(self._transport)
+            self._clients[installation_id] = client
+            while len(self._clients) > self._config.client_cache_size:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(installation_id)
+
+        if not client.token.is_fresh(self._refresh_margin):
+            async with client.token.lock:
+                # concurrent callers wait for, and share, a single refresh.
+                if not client.token.is_fresh(self._refresh_margin):
+                    await self._refresh_token(installation_id, client.token)
+
+        return client.gh
+
+    async def _refresh_token(
+        self, installation_id: int, entry: _InstallationToken
+    ) -> None:
+        response = await self._github.rest.apps.async_create_installation_access_token(
+            installation_id, data={}
+        )
+        token = response.parsed_data
+        entry.token = token.token
+        entry.expires_at = dt.strptime(token.expires_at, "%Y-%m-%dT%H:%M:%SZ").replace(
+            tzinfo=timezone.utc
+        )
+        logger.debug(
+            f"Refreshed access token for installation {installation_id}, "
+            f"expires at {entry.expires_at}"
         )
+
+    def forget(self, installation_id: int) -> None:
+        self._clients.pop(installation_id, None)
+
+    async def close(self) -> None:
+        self._clients.clear()
+        await self._transport.aclose()
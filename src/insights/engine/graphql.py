@@ -0,0 +1,205 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from typing import Any
+
+import githubkit.rest.models as ghk_rest_models
+
+# GraphQL doesn't return REST API urls, which the REST models require; these
+# are derived the same way GitHub does.
+_API_URL = "https://api.github.com"
+
+_LOCK_REASONS = {
+    "OFF_TOPIC": "off-topic",
+    "TOO_HEATED": "too heated",
+    "RESOLVED": "resolved",
+    "SPAM": "spam",
+}
+
+_ACTOR_FRAGMENT = """
+fragment actor on Actor {
+  __typename
+  login
+  avatarUrl
+  url
+  ... on User { databaseId id isSiteAdmin }
+  ... on Bot { databaseId id }
+  ... on Organization { databaseId id }
+  ... on Mannequin { databaseId id }
+}
+"""
+
+ISSUE_NODES_QUERY = (
+    """
+query($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on Issue {
+      id
+      databaseId
+      number
+      url
+      title
+      body
+      state
+      stateReason
+      locked
+      activeLockReason
+      authorAssociation
+      createdAt
+      updatedAt
+      closedAt
+      author { ...actor }
+      assignees(first: 10) { nodes { ...actor } }
+      labels(first: 100) {
+        nodes { id name description color isDefault url }
+      }
+      milestone {
+        id
+        number
+        title
+        description
+        state
+        url
+        createdAt
+        updatedAt
+        closedAt
+        dueOn
+        creator { ...actor }
+        openIssues: issues(states: OPEN) { totalCount }
+        closedIssues: issues(states: CLOSED) { totalCount }
+      }
+      comments { totalCount }
+      repository { name owner { login } }
+    }
+  }
+}
+"""
+    + _ACTOR_FRAGMENT
+)
+
+
+def _user(actor: dict[str, Any] | None) -> dict[str, Any] | None:
+    if actor is None:
+        return None
+
+    login: str = actor["login"]
+    if actor["__typename"] == "Bot":
+        # the REST API names apps by their bot user.
+        login = f"{login}[bot]"
+    url = f"{_API_URL}/users/{login}"
+
+    return {
+        "login": login,
+        "id": actor.get("databaseId") or 0,
+        "node_id": actor.get("id", ""),
+        "avatar_url": actor["avatarUrl"],
+        "gravatar_id": "",
+        "url": url,
+        "html_url": actor["url"],
+        "followers_url": f"{url}/followers",
+        "following_url": f"{url}/following{{/other_user}}",
+        "gists_url": f"{url}/gists{{/gist_id}}",
+        "starred_url": f"{url}/starred{{/owner}}{{/repo}}",
+        "subscriptions_url": f"{url}/subscriptions",
+        "organizations_url": f"{url}/orgs",
+        "repos_url": f"{url}/repos",
+        "events_url": f"{url}/events{{/privacy}}",
+        "received_events_url": f"{url}/received_events",
+        "type": "User" if actor["__typename"] == "Mannequin" else actor["__typename"],
+        "site_admin": actor.get("isSiteAdmin", False),
+    }
+
+
+def _milestone(
+    repo_url: str, milestone: dict[str, Any] | None
+) -> dict[str, Any] | None:
+    if milestone is None:
+        return None
+
+    url = f"{repo_url}/milestones/{milestone['number']}"
+    return {
+        "url": url,
+        "html_url": milestone["url"],
+        "labels_url": f"{url}/labels",
+        # not exposed over GraphQL.
+        "id": 0,
+        "node_id": milestone["id"],
+        "number": milestone["number"],
+        "state": milestone["state"].lower(),
+        "title": milestone["title"],
+        "description": milestone["description"],
+        "creator": _user(milestone["creator"]),
+        "open_issues": milestone["openIssues"]["totalCount"],
+        "closed_issues": milestone["closedIssues"]["totalCount"],
+        "created_at": milestone["createdAt"],
+        "updated_at": milestone["updatedAt"],
+        "closed_at": milestone["closedAt"],
+        "due_on": milestone["dueOn"],
+    }
+
+
+def issue_from_node(
+    node: dict[str, Any]
+) -> tuple[str, str, ghk_rest_models.Issue] | None:
+    """Map an issue node to its repository owner, name, and REST model.
+
+    Returns None if the node is not an issue, e.g., a pull request.
+    """
+    if "number" not in node:
+        return None
+
+    repo_owner: str = node["repository"]["owner"]["login"]
+    repo_name: str = node["repository"]["name"]
+    repo_url = f"{_API_URL}/repos/{repo_owner}/{repo_name}"
+    url = f"{repo_url}/issues/{node['number']}"
+
+    assignees = [_user(a) for a in node["assignees"]["nodes"]]
+    labels = [
+        {
+            "node_id": label["id"],
+            "url": f"{repo_url}/labels/{label['name']}",
+            "name": label["name"],
+            "description": label["description"],
+            "color": label["color"],
+            "default": label["isDefault"],
+        }
+        for label in node["labels"]["nodes"]
+    ]
+    state_reason: str | None = node["stateReason"]
+
+    issue = ghk_rest_models.Issue.model_validate(
+        {
+            "id": node["databaseId"],
+            "node_id": node["id"],
+            "url": url,
+            "repository_url": repo_url,
+            "labels_url": f"{url}/labels{{/name}}",
+            "comments_url": f"{url}/comments",
+            "events_url": f"{url}/events",
+            "html_url": node["url"],
+            "number": node["number"],
+            "state": node["state"].lower(),
+            "state_reason": state_reason.lower() if state_reason else None,
+            "title": node["title"],
+            "body": node["body"],
+            "user": _user(node["author"]),
+            "labels": labels,
+            "assignee": assignees[0] if len(assignees) > 0 else None,
+            "assignees": assignees,
+            "milestone": _milestone(repo_url, node["milestone"]),
+            "locked": node["locked"],
+            "active_lock_reason": _LOCK_REASONS.get(node["activeLockReason"]),
+            "comments": node["comments"]["totalCount"],
+            "closed_at": node["closedAt"],
+            "created_at": node["createdAt"],
+            "updated_at": node["updatedAt"],
+            "timeline_url": f"{url}/timeline",
+            "author_association": node["authorAssociation"],
+        }
+    )
+    return repo_owner, repo_name, issue
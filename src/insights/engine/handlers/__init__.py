@@ -6,12 +6,21 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
-from functools import singledispatch
+from functools import cache, singledispatch
+from typing import Annotated, Any, Union, get_args, get_origin
 
 from fastapi.logger import logger
-from githubkit.webhooks.types import IssueCommentEvent, WebhookEvent
+from githubkit.webhooks.models import InstallationDeleted, InstallationSuspend
+from githubkit.webhooks.types import (
+    IssueCommentEvent,
+    IssuesEvent,
+    WebhookEvent,
+    webhook_event_types,
+)
+from pydantic import BaseModel
 
-from insights.engine.handlers.hooks.issues import handle_issue_comment
+from insights.engine.handlers.hooks.installation import handle_installation_removed
+from insights.engine.handlers.hooks.issues import handle_issue_comment, handle_issues
 from insights.engine.insights import Insights
 from insights.engine.installation import Installation
 
@@ -35,3 +44,78 @@ async def _(
 ) -> None:
     logger.debug(f"got issue comment event: {event.action}")
     await handle_issue_comment(insights, installation, event)
+
+
+@handle_webhook.register
+async def _(
+    event: IssuesEvent,
+    event_name: str,
+    insights: Insights,
+    installation: Installation,
+) -> None:
+    logger.debug(f"got issues event: {event.action}")
+    await handle_issues(insights, installation, event)
+
+
+@handle_webhook.register
+async def _(
+    event: InstallationDeleted | InstallationSuspend,
+    event_name: str,
+    insights: Insights,
+    installation: Installation,
+) -> None:
+    logger.debug(f"got installation event: {event.action}")
+    await handle_installation_removed(insights, event)
+
+
+async def dispatch_webhook(
+    event: WebhookEvent,
+    event_name: str,
+    insights: Insights,
+    installation_id: int,
+) -> None:
+    """Handle an event, for its installation.
+
+    The installation is registered first, unless the event removes it: a
+    redelivered removal must not bring it back, even for a moment.
+    """
+    if isinstance(event, (InstallationDeleted, InstallationSuspend)):
+        await handle_installation_removed(insights, event)
+        return
+
+    installation = await insights.get_installation(installation_id)
+    await handle_webhook(event, event_name, insights, installation)
+
+
+def _event_models(event_type: Any) -> list[type[BaseModel]]:
+    """Unwrap an event type into the models it may be validated as."""
+    origin = get_origin(event_type)
+    if origin is Annotated:
+        return _event_models(get_args(event_type)[0])
+    elif origin is Union:
+        return [m for t in get_args(event_type) for m in _event_models(t)]
+    return [event_type]
+
+
+def _model_action(model: type[BaseModel]) -> str | None:
+    field = model.model_fields.get("action")
+    if field is None:
+        return None
+    actions = get_args(field.annotation)
+    return str(actions[0]) if len(actions) > 0 else None
+
+
+@cache
+def _handled_actions() -> dict[str, set[str | None]]:
+    registered = [t for t in handle_webhook.registry.keys() if t is not object]
+    handled: dict[str, set[str | None]] = {}
+    for name, event_type in webhook_event_types.items():
+        for model in _event_models(event_type):
+            if any(issubclass(model, t) for t in registered):
+                handled.setdefault(name, set()).add(_model_action(model))
+    return handled
+
+
+def is_handled(event_name: str, action: str | None) -> bool:
+    """Check whether an event has a registered handler, and thus must be parsed."""
+    return action in _handled_actions().get(event_name, set())
@@ -0,0 +1,23 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from fastapi.logger import logger
+from githubkit.webhooks.models import InstallationDeleted, InstallationSuspend
+
+from insights.engine.insights import Insights
+
+
+async def handle_installation_removed(
+    insights: Insights,
+    event: InstallationDeleted | InstallationSuspend,
+):
+    logger.debug(f"installation, action: '{event.action}'")
+
+    await insights.remove_installation(
+        event.installation.id, deleted=event.action == "deleted"
+    )
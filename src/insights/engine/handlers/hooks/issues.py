@@ -7,7 +7,7 @@
 # (at your option) any later version.
 
 from fastapi.logger import logger
-from githubkit.webhooks.types import IssueCommentEvent
+from githubkit.webhooks.types import IssueCommentEvent, IssuesEvent
 
 from insights.engine.insights import Insights
 from insights.engine.installation import Installation
@@ -21,3 +21,11 @@ async def handle_issue_comment(
 
     issue_id = event.issue.node_id
     await installation.handle_issue_comment(issue_id, event)
+
+
+async def handle_issues(
+    insights: Insights, installation: Installation, event: IssuesEvent
+):
+    logger.debug(f"issues, action: '{event.action}'")
+
+    await installation.handle_issue_event(event)
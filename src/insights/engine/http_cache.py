@@ -0,0 +1,65 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from datetime import datetime as dt
+from typing import Any
+
+import githubkit as ghk
+import motor.motor_asyncio
+
+
+class ConditionalCache:
+    """Persist ETag and Last-Modified validators for GitHub GET requests.
+
+    Requests carrying the stored validators are answered with '304 Not Modified'
+    when nothing changed, which GitHub does not count against the rate limit.
+    """
+
+    _coll: motor.motor_asyncio.AsyncIOMotorCollection
+
+    def __init__(self, coll: motor.motor_asyncio.AsyncIOMotorCollection) -> None:
+        self._coll = coll
+
+    async def get_headers(self, key: str) -> dict[str, str]:
+        """Obtain conditional request headers for a request, if any."""
+        entry: dict[str, Any] | None = await self._coll.find_one({"_id": key})
+        if entry is None:
+            return {}
+
+        headers: dict[str, str] = {}
+        if entry.get("etag") is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified") is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def find_cached(self, keys: list[str]) -> set[str]:
+        """Obtain which of the given requests have stored validators."""
+        if len(keys) == 0:
+            return set()
+
+        cursor = self._coll.find({"_id": {"$in": keys}}, {"_id": 1})
+        return {doc["_id"] async for doc in cursor}
+
+    async def store(self, key: str, response: ghk.Response[Any]) -> None:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+
+        await self._coll.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "updated_at": dt.utcnow(),
+                }
+            },
+            upsert=True,
+        )
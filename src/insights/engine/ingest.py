@@ -0,0 +1,123 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+
+from fastapi.logger import logger
+from githubkit.webhooks.types import WebhookEvent
+
+from insights.config import IngestConfigModel
+from insights.engine.handlers import dispatch_webhook
+from insights.engine.insights import Insights
+from insights.error import InsightsError
+
+# (event name, installation id, parsed event, delivery id)
+_QueueItem = tuple[str, int, WebhookEvent, str | None]
+
+
+class IngestQueueError(InsightsError):
+    def __init__(self, msg: str | None = None) -> None:
+        super().__init__(f"Ingest Queue Error: {msg}")
+
+
+class IngestQueueFullError(IngestQueueError):
+    def __init__(self) -> None:
+        super().__init__("queue is full")
+
+
+class IngestQueueClosedError(IngestQueueError):
+    def __init__(self) -> None:
+        super().__init__("queue is not accepting events")
+
+
+class IngestQueue:
+    """Bounded webhook queue, consumed by a pool of handler workers."""
+
+    _config: IngestConfigModel
+    _insights: Insights
+    _queue: asyncio.Queue[_QueueItem]
+    _workers: list[asyncio.Task[None]]
+    _accepting: bool
+
+    def __init__(self, config: IngestConfigModel, insights: Insights) -> None:
+        self._config = config
+        self._insights = insights
+        self._queue = asyncio.Queue(maxsize=config.max_queue_size)
+        self._workers = []
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def max_depth(self) -> int:
+        return self._queue.maxsize
+
+    def start(self) -> None:
+        assert len(self._workers) == 0
+
+        for n in range(self._config.workers):
+            task = asyncio.create_task(self._worker(n), name=f"ingest-worker-{n}")
+            self._workers.append(task)
+
+        self._accepting = True
+        logger.info(f"Started ingest queue with {len(self._workers)} workers")
+
+    def put(
+        self,
+        event_name: str,
+        installation_id: int,
+        event: WebhookEvent,
+        delivery_id: str | None,
+    ) -> None:
+        if not self._accepting:
+            raise IngestQueueClosedError()
+
+        try:
+            self._queue.put_nowait((event_name, installation_id, event, delivery_id))
+        except asyncio.QueueFull:
+            raise IngestQueueFullError()
+
+    async def drain(self) -> None:
+        """Stop accepting events, and wait for queued events to be handled."""
+        self._accepting = False
+
+        pending = self._queue.qsize()
+        if pending > 0:
+            logger.info(f"Draining {pending} queued events")
+
+        try:
+            await asyncio.wait_for(self._queue.join(), self._config.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Timed out draining ingest queue, dropping {self._queue.qsize()} "
+                "events"
+            )
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            event_name, installation_id, event, delivery_id = await self._queue.get()
+            try:
+                await dispatch_webhook(
+                    event, event_name, self._insights, installation_id
+                )
+            except Exception as e:
+                logger.error(
+                    f"Worker {n} unable to handle event '{event_name}' "
+                    f"for installation {installation_id}: {str(e)}"
+                )
+                if delivery_id is not None:
+                    await self._insights.deliveries.release(delivery_id)
+            finally:
+                self._queue.task_done()
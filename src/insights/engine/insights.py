@@ -6,20 +6,37 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
+import asyncio
+import random
+from datetime import datetime as dt
+
 import motor.motor_asyncio
 from fastapi.logger import logger
 
-from insights.config import Config
+from insights.config import (
+    BackfillConfigModel,
+    Config,
+    ResyncConfigModel,
+    RollupsConfigModel,
+    StorageConfigModel,
+    WritesConfigModel,
+)
+from insights.engine.backfill import Backfill
 from insights.engine.db_client import DBClient
 from insights.engine.db_types import InstallationEntry
+from insights.engine.deliveries import DeliveryTracker
 from insights.engine.github import Github
 from insights.engine.installation import Installation
+from insights.engine.read_cache import ReadCache
+from insights.engine.reads import InstallationSummary, Page, find_page
+from insights.engine.resync import Resync
 from insights.error import InsightsError
 from insights.eventdb import EventDB
 
 _DB_INSIGHTS = "insights"
 _DB_INSTALLATION_BY_ID = "installation-{id}"
 _COLL_INSTALLATIONS = "installations"
+_COLL_DELIVERIES = "deliveries"
 
 
 class Insights:
@@ -28,6 +45,20 @@ class Insights:
     _installations: motor.motor_asyncio.AsyncIOMotorCollection | None
     _github: Github
     _eventdb: EventDB
+    _deliveries: DeliveryTracker
+    _registry: dict[int, Installation]
+    _registry_locks: dict[int, asyncio.Lock]
+    _backfill_config: BackfillConfigModel
+    _backfills: dict[int, asyncio.Task[None]]
+    _resync_config: ResyncConfigModel
+    _resyncs: dict[int, asyncio.Task[None]]
+    _storage: StorageConfigModel
+    _writes: WritesConfigModel
+    _rollups_config: RollupsConfigModel
+    _rollups: dict[int, asyncio.Task[None]]
+    _read_cache: ReadCache
+    # bumped when installations change, to invalidate cached reads.
+    _generation: int
 
     def __init__(self, config: Config, github: Github, db_client: DBClient) -> None:
         self._client = db_client.client
@@ -35,6 +66,37 @@ class Insights:
         self._installations = None
         self._github = github
         self._eventdb = EventDB(config)
+        self._deliveries = DeliveryTracker(
+            config.deliveries, self._db.get_collection(_COLL_DELIVERIES)
+        )
+        self._registry = {}
+        self._registry_locks = {}
+        self._backfill_config = config.backfill
+        self._backfills = {}
+        self._resync_config = config.resync
+        self._resyncs = {}
+        self._storage = config.storage
+        self._writes = config.writes
+        self._rollups_config = config.rollups
+        self._rollups = {}
+        self._read_cache = ReadCache(config.api)
+        self._generation = 0
+
+    @property
+    def eventdb(self) -> EventDB:
+        return self._eventdb
+
+    @property
+    def deliveries(self) -> DeliveryTracker:
+        return self._deliveries
+
+    @property
+    def read_cache(self) -> ReadCache:
+        return self._read_cache
+
+    @property
+    def generation(self) -> int:
+        return self._generation
 
     async def init(self) -> None:
         try:
@@ -45,27 +107,262 @@ class Insights:
             raise InsightsError("Database unavailable")
 
         self._installations = self._db.get_collection(_COLL_INSTALLATIONS)
+        await self._installations.create_index("installation_id", unique=True)
+        await self._deliveries.init()
+        await self._warm_registry()
 
-    async def get_installation(self, id: int) -> Installation:
+    async def _warm_registry(self) -> None:
+        """Populate the installation registry from the installations collection."""
+        assert self._installations is not None
+
+        unprobed: list[int] = []
+        async for raw in self._installations.find({"deleted_at": None}):
+            entry = InstallationEntry.model_validate(raw)
+            self._register(self._new_installation(entry.installation_id))
+            if entry.probed_at is None:
+                unprobed.append(entry.installation_id)
+
+        logger.info(f"Loaded {len(self._registry)} installations")
+
+        # existing installations may predate some of the indexes and schema
+        await asyncio.gather(*[i.upgrade() for i in self._registry.values()])
+
+        # resume backfills interrupted by a restart
+        if self._backfill_config.enabled:
+            for id in unprobed:
+                self.backfill(id)
+
+    def _new_installation(self, id: int) -> Installation:
         db_name = _DB_INSTALLATION_BY_ID.format(id=id)
-        if db_name not in await self._client.list_database_names():
-            await self.create_installation(id)
+        return Installation(
+            id,
+            self._github,
+            self._client[db_name],
+            self._eventdb,
+            self._storage,
+            self._writes,
+            self._rollups_config,
+        )
+
+    def _register(self, installation: Installation) -> None:
+        id = installation.id
+        self._registry[id] = installation
+        if self._resync_config.enabled and id not in self._resyncs:
+            self._resyncs[id] = asyncio.create_task(
+                self._resync_loop(id), name=f"resync-{id}"
+            )
+        if self._rollups_config.enabled and id not in self._rollups:
+            self._rollups[id] = asyncio.create_task(
+                self._downsample_loop(installation), name=f"rollups-{id}"
+            )
 
-        return Installation(id, self._github, self._client[db_name], self._eventdb)
+    def find_installation(self, id: int) -> Installation | None:
+        """Obtain a registered installation, without creating it."""
+        return self._registry.get(id)
 
-    async def create_installation(self, id: int) -> None:
+    async def list_installations(
+        self, *, cursor: str | None = None, limit: int = 50
+    ) -> Page[InstallationSummary]:
+        """Read a page of the installations not deleted, by id."""
         assert self._installations is not None
 
-        db_name = _DB_INSTALLATION_BY_ID.format(id=id)
-        installation = Installation(
-            id, self._github, self._client[db_name], self._eventdb
+        docs, next_cursor = await find_page(
+            self._installations,
+            {"deleted_at": None},
+            ["installation_id"],
+            {"_id": 0, "updated_at": 1, "probed_at": 1},
+            cursor=cursor,
+            limit=limit,
+        )
+        return Page(
+            items=[InstallationSummary.model_validate(d) for d in docs],
+            next_cursor=next_cursor,
         )
+
+    async def get_installation(self, id: int) -> Installation:
+        installation = self._registry.get(id)
+        if installation is not None:
+            return installation
+
+        lock = self._registry_locks.setdefault(id, asyncio.Lock())
+        async with lock:
+            # someone else may have registered it while we waited on the lock.
+            installation = self._registry.get(id)
+            if installation is not None:
+                return installation
+
+            assert self._installations is not None
+            raw = await self._installations.find_one({"installation_id": id})
+            if raw is None:
+                installation = await self.create_installation(id)
+            else:
+                entry = InstallationEntry.model_validate(raw)
+                if entry.deleted_at is not None:
+                    await self._installations.update_one(
+                        {"installation_id": id},
+                        {"$set": {"deleted_at": None, "updated_at": dt.utcnow()}},
+                    )
+                    self._generation += 1
+                installation = self._new_installation(id)
+                # skipped when warming the registry if it was deleted then.
+                await installation.upgrade()
+
+            self._register(installation)
+            return installation
+
+    async def create_installation(self, id: int) -> Installation:
+        assert self._installations is not None
+
+        installation = self._new_installation(id)
         await installation.init()
 
         installation_entry = InstallationEntry(
             installation_id=id,
         )
         new_entry = await self._installations.insert_one(
-            installation_entry.model_dump(by_alias=True, exclude=set("id"))
+            installation_entry.model_dump(by_alias=True, exclude={"id"})
         )
         logger.debug(f"new installation entry: {str(new_entry.inserted_id)}")
+        self._generation += 1
+
+        if self._backfill_config.enabled:
+            self.backfill(id, installation=installation)
+        return installation
+
+    def backfill(
+        self,
+        id: int,
+        *,
+        installation: Installation | None = None,
+        restart: bool = False,
+    ) -> bool:
+        """Start backfilling an installation, unless already in progress.
+
+        The backfill resumes from its checkpoints, unless 'restart' is set.
+        Returns False if a backfill is already running for this installation.
+        """
+        task = self._backfills.get(id)
+        if task is not None and not task.done():
+            return False
+
+        self._backfills[id] = asyncio.create_task(
+            self._run_backfill(id, installation, restart),
+            name=f"backfill-{id}",
+        )
+        return True
+
+    async def _run_backfill(
+        self, id: int, installation: Installation | None, restart: bool
+    ) -> None:
+        assert self._installations is not None
+
+        try:
+            if installation is None:
+                installation = await self.get_installation(id)
+
+            backfill = Backfill(self._backfill_config, self._github, installation)
+            if restart:
+                await backfill.reset()
+
+            if not await backfill.run():
+                logger.warning(f"Backfill of installation {id} incomplete")
+                return
+
+            now = dt.utcnow()
+            await self._installations.update_one(
+                {"installation_id": id},
+                {"$set": {"probed_at": now, "updated_at": now}},
+            )
+            self._generation += 1
+            logger.info(f"Backfill of installation {id} complete")
+        except Exception as e:
+            logger.error(f"Unable to backfill installation {id}: {str(e)}")
+        finally:
+            self._backfills.pop(id, None)
+
+    async def _resync_loop(self, id: int) -> None:
+        cfg = self._resync_config
+        # spread installations over the interval, so they don't all sync at once.
+        await asyncio.sleep(random.uniform(0, cfg.interval))
+        while True:
+            try:
+                await self._resync(id)
+            except Exception as e:
+                logger.error(f"Unable to resync installation {id}: {str(e)}")
+
+            await asyncio.sleep(
+                cfg.interval * random.uniform(1 - cfg.jitter, 1 + cfg.jitter)
+            )
+
+    async def _resync(self, id: int) -> None:
+        assert self._installations is not None
+
+        installation = self._registry.get(id)
+        if installation is None or id in self._backfills:
+            return
+
+        # until backfilled there's nothing to bring up to date.
+        raw = await self._installations.find_one({"installation_id": id})
+        if raw is None or InstallationEntry.model_validate(raw).probed_at is None:
+            return
+
+        count = await Resync(self._resync_config, self._github, installation).run()
+        logger.info(f"Resynced installation {id}, {count} issues updated")
+
+    async def _downsample_loop(self, installation: Installation) -> None:
+        interval = self._rollups_config.interval
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            try:
+                count = await installation.rollups.downsample()
+                if count > 0:
+                    logger.info(
+                        f"Downsampled {count} buckets of installation "
+                        f"{installation.id}"
+                    )
+            except Exception as e:
+                logger.error(
+                    f"Unable to downsample rollups of installation "
+                    f"{installation.id}: {str(e)}"
+                )
+            await asyncio.sleep(interval)
+
+    async def shutdown(self) -> None:
+        """Stop running backfills, which resume from checkpoints on restart."""
+        tasks = (
+            list(self._backfills.values())
+            + list(self._resyncs.values())
+            + list(self._rollups.values())
+        )
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await asyncio.gather(*[i.close() for i in self._registry.values()])
+        self._eventdb.close()
+
+    async def remove_installation(self, id: int, *, deleted: bool) -> None:
+        """Drop an installation from the registry, marking it deleted if needed."""
+        assert self._installations is not None
+
+        installation = self._registry.pop(id, None)
+        self._github.forget(id)
+
+        for tasks in (self._backfills, self._resyncs, self._rollups):
+            task = tasks.pop(id, None)
+            if task is not None:
+                task.cancel()
+
+        if installation is not None:
+            await installation.close()
+
+        if not deleted:
+            return
+
+        now = dt.utcnow()
+        await self._installations.update_one(
+            {"installation_id": id},
+            {"$set": {"deleted_at": now, "updated_at": now}},
+        )
+        self._generation += 1
+        logger.info(f"Installation {id} marked as deleted")
@@ -6,23 +6,224 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
+import asyncio
+import itertools
+from collections import OrderedDict
 from datetime import datetime as dt
-from typing import Optional, cast
+from typing import Any, Awaitable
 
 import githubkit.rest.models as ghk_rest_models
+import githubkit.webhooks.models as ghk_wh_models
 import githubkit.webhooks.types as ghk_webhook_types
 import motor.motor_asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi.logger import logger
+from githubkit.exception import GraphQLFailed
 from githubkit.utils import exclude_unset
+from pydantic import BaseModel, ValidationError
+from pymongo import ASCENDING, DeleteMany, DeleteOne, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
-from insights.engine.db_types import InstallationCommentEntry, InstallationIssueEntry
+from insights.config import RollupsConfigModel, StorageConfigModel, WritesConfigModel
+from insights.engine.batcher import Batcher
+from insights.engine.compact import (
+    COLL_REPOSITORIES,
+    COLL_USERS,
+    compact_comment,
+    ref_updates,
+)
+from insights.engine.cursor import InvalidCursorError, decode_cursor, encode_cursor
+from insights.engine.db_types import (
+    CommentEdit,
+    InstallationCommentEntry,
+    InstallationIssueEntry,
+    InstallationIssueEventEntry,
+)
 from insights.engine.github import Github
+from insights.engine.graphql import ISSUE_NODES_QUERY, issue_from_node
+from insights.engine.http_cache import ConditionalCache
+from insights.engine.metrics import Metrics
+from insights.engine.reads import InstallationReads
+from insights.engine.rollups import Rollups
+from insights.engine.scheduler import Priority
+from insights.engine.singleflight import SingleFlight
+from insights.engine.writes import WriteOp, WritePipeline, WriteResult
 from insights.eventdb import EventDB
 
 _DB_COLLECTION_PROJECTS = "projects"
 _DB_COLLECTION_PROJECT_BY_ID = "project.{project_id}"
 _DB_COLLECTION_COMMENTS = "comments"
 _DB_COLLECTION_ISSUES = "issues"
+_DB_COLLECTION_HTTP_CACHE = "http_cache"
+_DB_COLLECTION_ISSUE_EVENTS = "issue_events"
+
+_DUPLICATE_KEY = 11000
+
+# matches comments not deleted; tombstones fail upserts with a duplicate key.
+_LIVE_COMMENT: dict[str, Any] = {"deleted_at": {"$exists": False}}
+
+# repositories and users recently stored, in compact storage mode.
+_MAX_KNOWN_REFS = 10000
+
+# generations of all installations, so one registered again doesn't reuse the
+# generations of cached reads from before.
+_generations = itertools.count(1)
+
+_DB_INDEXES: dict[str, list[IndexModel]] = {
+    _DB_COLLECTION_ISSUES: [
+        IndexModel("issue_id", unique=True),
+        IndexModel(
+            [
+                ("repo_owner", ASCENDING),
+                ("repo_name", ASCENDING),
+                ("issue_number", ASCENDING),
+            ]
+        ),
+        IndexModel(
+            [
+                ("repo_owner", ASCENDING),
+                ("repo_name", ASCENDING),
+                ("fetched_at", ASCENDING),
+            ]
+        ),
+        # stale issues across repositories, to refresh them.
+        IndexModel("fetched_at"),
+        # incremental exports.
+        IndexModel("instance.updated_at"),
+    ],
+    _DB_COLLECTION_COMMENTS: [
+        IndexModel("comment_id", unique=True),
+        # an issue's comments, paginated by id.
+        IndexModel([("issue_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel("by_login"),
+        # incremental exports, which include comments deleted since.
+        IndexModel("updated_at"),
+        IndexModel("deleted_at", sparse=True),
+    ],
+    _DB_COLLECTION_ISSUE_EVENTS: [
+        IndexModel([("issue_id", ASCENDING), ("created_at", ASCENDING)]),
+        # redeliveries of the same event must not be recorded twice
+        IndexModel(
+            [
+                ("issue_id", ASCENDING),
+                ("created_at", ASCENDING),
+                ("event", ASCENDING),
+                ("data", ASCENDING),
+            ],
+            unique=True,
+        ),
+    ],
+}
+
+
+def _issue_cache_key(repo_owner: str, repo_name: str, issue_number: int) -> str:
+    return f"/repos/{repo_owner}/{repo_name}/issues/{issue_number}"
+
+
+def _issue_entry(
+    repo_owner: str, repo_name: str, issue: ghk_rest_models.Issue
+) -> InstallationIssueEntry:
+    return InstallationIssueEntry(
+        issue_id=issue.node_id,
+        repo_owner=repo_owner,
+        repo_name=repo_name,
+        issue_number=issue.number,
+        fetched_at=dt.utcnow(),
+        labels=_issue_labels(issue),
+        milestone=issue.milestone,
+        state=issue.state,
+        instance=issue,
+    )
+
+
+def _issue_labels(issue: ghk_rest_models.Issue) -> list[str]:
+    labels: list[str] = []
+    for label in issue.labels:
+        if isinstance(label, str):
+            labels.append(label)
+            continue
+        name: str | None = exclude_unset(label.name)
+        if name is not None:
+            labels.append(name)
+    return labels
+
+
+def _issue_delta(
+    event: ghk_webhook_types.IssuesEvent, issue: ghk_rest_models.Issue
+) -> dict[str, Any] | None:
+    """Obtain the update applying an event to a stored issue, if it has one.
+
+    Events without a specific delta replace the whole entry.
+    """
+    instance = issue.model_dump(by_alias=True, exclude_unset=True)
+    fields: dict[str, Any]
+    match event.action:
+        case "labeled" | "unlabeled":
+            update: dict[str, Any] = {"$set": {"instance.labels": instance["labels"]}}
+            name: str | None = event.label.name if event.label else None
+            if name is not None:
+                op = "$addToSet" if event.action == "labeled" else "$pull"
+                update[op] = {"labels": name}
+            else:
+                update["$set"]["labels"] = _issue_labels(issue)
+        case "milestoned" | "demilestoned":
+            milestone = instance["milestone"]
+            update = {"$set": {"milestone": milestone, "instance.milestone": milestone}}
+        case "closed" | "reopened":
+            fields = {
+                f"instance.{k}": instance.get(k)
+                for k in ("state", "state_reason", "closed_at")
+            }
+            update = {"$set": {"state": issue.state, **fields}}
+        case "edited":
+            fields = {f"instance.{k}": instance.get(k) for k in ("title", "body")}
+            update = {"$set": fields}
+        case _:
+            return None
+
+    update["$set"]["instance.updated_at"] = issue.updated_at
+    update["$set"]["fetched_at"] = dt.utcnow()
+    return update
+
+
+def _upsert(
+    key: str,
+    entry: BaseModel,
+    version: str,
+    guard: dict[str, Any] | None = None,
+) -> UpdateOne:
+    """Upsert an entry, unless the stored one has a newer 'version' field.
+
+    A newer stored entry, or one not matching 'guard', makes the upsert fail
+    with a duplicate key.
+    """
+    doc = entry.model_dump(by_alias=True, exclude={"id"}, exclude_unset=True)
+    version_value = doc
+    for part in version.split("."):
+        version_value = version_value[part]
+    return UpdateOne(
+        {key: doc[key], version: {"$lte": version_value}, **(guard or {})},
+        {"$set": doc},
+        upsert=True,
+    )
+
+
+async def _bulk_upsert(
+    coll: motor.motor_asyncio.AsyncIOMotorCollection, ops: list[UpdateOne]
+) -> dict[int, Any]:
+    """Apply upserts, returning the ids of inserted entries by op index."""
+    try:
+        res = await coll.bulk_write(ops, ordered=False)
+        return res.upserted_ids or {}
+    except BulkWriteError as e:
+        # stale entries are expected to fail the version guard; anything else
+        # is an actual error.
+        errors: list[dict[str, Any]] = e.details.get("writeErrors", [])
+        if any(err.get("code") != _DUPLICATE_KEY for err in errors):
+            raise
+        logger.debug(f"skipped {len(errors)} entries with newer versions stored")
+        return {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
 
 
 class Installation:
@@ -30,6 +231,17 @@ class Installation:
     _db: motor.motor_asyncio.AsyncIOMotorDatabase
     _github: Github
     _eventdb: EventDB
+    _http_cache: ConditionalCache
+    _issue_fetches: SingleFlight[tuple[str, str, int], None]
+    _issue_nodes: Batcher[str, dict[str, Any]]
+    _storage: StorageConfigModel
+    _known_refs: OrderedDict[tuple[str, int], Any]
+    _writes: WritePipeline
+    _metrics: Metrics
+    _rollups: Rollups
+    _reads: InstallationReads
+    # bumped once ingested data is written, to invalidate cached reads.
+    _generation: int
 
     def __init__(
         self,
@@ -37,44 +249,447 @@ class Installation:
         github: Github,
         db: motor.motor_asyncio.AsyncIOMotorDatabase,
         eventdb: EventDB,
+        storage: StorageConfigModel,
+        writes: WritesConfigModel,
+        rollups: RollupsConfigModel,
     ) -> None:
         self._id = id
         self._db = db
         self._github = github
         self._eventdb = eventdb
+        self._storage = storage
+        self._known_refs = OrderedDict()
+        self._writes = WritePipeline(db, writes)
+        self._rollups = Rollups(db, self._writes, rollups)
+        self._metrics = Metrics(db, self._writes, self._rollups)
+        self._reads = InstallationReads(db)
+        self._generation = next(_generations)
+        self._http_cache = ConditionalCache(
+            db.get_collection(_DB_COLLECTION_HTTP_CACHE)
+        )
+        self._issue_fetches = SingleFlight()
+        self._issue_nodes = Batcher(
+            self._fetch_issue_nodes,
+            max_batch=github.config.graphql_batch_size,
+            max_delay=github.config.graphql_batch_delay,
+        )
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+    @property
+    def writes(self) -> WritePipeline:
+        return self._writes
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def rollups(self) -> Rollups:
+        return self._rollups
+
+    @property
+    def reads(self) -> InstallationReads:
+        return self._reads
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def db(self) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+        return self._db
 
     async def init(self) -> None:
-        await self._db.create_collection(_DB_COLLECTION_PROJECTS)
-        await self._db.create_collection(_DB_COLLECTION_ISSUES)
-        await self._db.create_collection(_DB_COLLECTION_COMMENTS)
+        existing = await self._db.list_collection_names()
+        for name in (
+            _DB_COLLECTION_PROJECTS,
+            _DB_COLLECTION_ISSUES,
+            _DB_COLLECTION_COMMENTS,
+            _DB_COLLECTION_ISSUE_EVENTS,
+        ):
+            if name not in existing:
+                await self._db.create_collection(name)
+
+        await self.ensure_indexes()
+
+    async def upgrade(self) -> None:
+        """Bring an existing installation's database up to date."""
+        await self.ensure_indexes()
+
+        # issue events used to be embedded in the issue, but were never
+        # populated, so there is nothing to move.
+        await self._get_issues_coll().update_many(
+            {"events": {"$exists": True}}, {"$unset": {"events": ""}}
+        )
+
+    async def ensure_indexes(self) -> None:
+        """Create this installation's indexes, if they don't exist yet."""
+        for name, indexes in _DB_INDEXES.items():
+            try:
+                await self._db.get_collection(name).create_indexes(indexes)
+            except OperationFailure as e:
+                # e.g., duplicate entries from before unique indexes existed.
+                logger.error(
+                    f"Unable to create indexes on '{name}' for "
+                    f"installation {self._id}: {str(e)}"
+                )
+        try:
+            await self._metrics.ensure_indexes()
+            await self._rollups.ensure_indexes()
+        except OperationFailure as e:
+            logger.error(
+                f"Unable to create metrics indexes for installation {self._id}: "
+                f"{str(e)}"
+            )
 
     async def handle_issue_comment(
         self, issue_id: str, event: ghk_webhook_types.IssueCommentEvent
     ) -> None:
-        entry = InstallationCommentEntry(
-            issue_id=event.issue.node_id,
-            comment_id=event.comment.node_id,
-            updated_at=event.comment.updated_at,
-            by_login=event.comment.user.login,
-            comment=event.comment,
-            repository=event.repository,
+        entry, repository, user = self._comment_entry(
+            event.issue.node_id, event.comment, event.repository
         )
+        await self._store_refs([repository], [user] if user is not None else [])
+
+        doc = entry.model_dump(by_alias=True, exclude={"id"}, exclude_unset=True)
+        comment_id = entry.comment_id
+
+        if event.action == "deleted":
+            # keep a tombstone, so late deliveries don't bring the comment back.
+            del doc["comment_id"]
+            for key in ("body", "comment"):
+                doc.pop(key, None)
+            try:
+                res = await self._write(
+                    _DB_COLLECTION_COMMENTS,
+                    UpdateOne(
+                        {"comment_id": comment_id, **_LIVE_COMMENT},
+                        {
+                            "$set": {**doc, "deleted_at": dt.utcnow()},
+                            "$unset": {"body": "", "comment": ""},
+                        },
+                        upsert=True,
+                    ),
+                )
+            except DuplicateKeyError:
+                logger.debug(f"Comment '{comment_id}' already deleted")
+                return
+
+            if res.upserted_id is None:
+                # only a comment we had stored was counted.
+                await self._metrics.count_comments({entry.by_login: -1})
+            self._changed()
+            logger.debug(f"Deleted comment '{comment_id}'")
+            return
+
+        # a deleted comment stays deleted, whatever is delivered after.
+        query: dict[str, Any] = {
+            "comment_id": comment_id,
+            "updated_at": {"$lte": entry.updated_at},
+            **_LIVE_COMMENT,
+        }
+        update: dict[str, Any] = {"$set": doc}
+
+        max_history = self._storage.comment_history
+        changes = getattr(event, "changes", None)
+        if event.action == "edited" and max_history > 0 and changes is not None:
+            body_change = exclude_unset(changes.body)
+            if body_change is not None:
+                previous: str = body_change.from_
+                edit = CommentEdit(
+                    edited_at=entry.updated_at,
+                    body_length=len(previous),
+                    body=previous if self._storage.keep_comment_body else None,
+                )
+                update["$push"] = {
+                    "history": {
+                        "$each": [edit.model_dump(exclude_none=True)],
+                        "$slice": -max_history,
+                    }
+                }
+                # a redelivered edit must not be recorded twice.
+                query["history.edited_at"] = {"$ne": entry.updated_at}
+
+        try:
+            res = await self._write(
+                _DB_COLLECTION_COMMENTS, UpdateOne(query, update, upsert=True)
+            )
+        except DuplicateKeyError:
+            logger.debug(f"Ignored stale '{event.action}' for comment '{comment_id}'")
+            return
 
-        coll = self._get_comments_coll()
-        new_entry = await coll.insert_one(
-            entry.model_dump(by_alias=True, exclude=set("id"), exclude_unset=True)
-        )
         logger.debug(
-            f"Inserted new entry for comment '{entry.comment_id},"
-            f" issue '{entry.issue_id}': {new_entry.inserted_id}"
+            f"Upserted entry for comment '{comment_id}',"
+            f" issue '{entry.issue_id}': {res.upserted_id}"
         )
 
+        if res.upserted_id is not None:
+            await asyncio.gather(
+                self._metrics.count_comments({entry.by_login: 1}),
+                self._rollups.record(
+                    event.repository.owner.login,
+                    event.repository.name,
+                    entry.created_at or entry.updated_at,
+                    {"comments": 1},
+                ),
+            )
+
         await self._maybe_add_issue(
             event.repository.owner.login,
             event.repository.name,
             event.issue.number,
             event.issue.node_id,
         )
+        if entry.created_at is not None:
+            await self._metrics.add_response(
+                entry.issue_id, entry.by_login, entry.created_at
+            )
+        self._changed()
+
+    async def handle_issue_event(self, event: ghk_webhook_types.IssuesEvent) -> None:
+        """Apply an issue event to the stored issue, without fetching it.
+
+        Updates only apply if the event is at least as recent as the stored
+        issue, so out of order deliveries never overwrite newer state.
+        """
+        repo_owner = event.repository.owner.login
+        repo_name = event.repository.name
+        issue_id = event.issue.node_id
+
+        if event.action in ("deleted", "transferred"):
+            # a transferred issue shows up as a new issue in its new repository.
+            await asyncio.gather(
+                self._write(_DB_COLLECTION_ISSUES, DeleteOne({"issue_id": issue_id})),
+                self._write(
+                    _DB_COLLECTION_ISSUE_EVENTS, DeleteMany({"issue_id": issue_id})
+                ),
+                self._metrics.remove_issue(issue_id),
+            )
+            self._changed()
+            logger.debug(f"removed issue '{issue_id}' ({event.action})")
+            return
+
+        try:
+            issue = ghk_rest_models.Issue.model_validate(
+                event.issue.model_dump(by_alias=True, exclude_unset=True)
+            )
+        except ValidationError as e:
+            logger.warning(f"Unable to apply event to issue '{issue_id}': {str(e)}")
+            await self._fetch_issue(repo_owner, repo_name, event.issue.number)
+            return
+
+        await self._apply_issue_event(repo_owner, repo_name, event, issue)
+        await asyncio.gather(
+            self._record_issue_event(event, issue),
+            self._update_issue_metrics(repo_owner, repo_name, issue),
+        )
+        self._changed()
+
+    async def _apply_issue_event(
+        self,
+        repo_owner: str,
+        repo_name: str,
+        event: ghk_webhook_types.IssuesEvent,
+        issue: ghk_rest_models.Issue,
+    ) -> None:
+        coll = self._get_issues_coll()
+        issue_id = issue.node_id
+        guard = {
+            "issue_id": issue_id,
+            "instance.updated_at": {"$lte": issue.updated_at},
+        }
+        delta = _issue_delta(event, issue)
+        if delta is not None:
+            res = await coll.update_one(guard, delta)
+            if res.matched_count > 0:
+                logger.debug(f"applied '{event.action}' to issue '{issue_id}'")
+                return
+
+        # either a full update, or the issue is not stored yet; the payload
+        # carries the whole issue either way.
+        entry = _issue_entry(repo_owner, repo_name, issue)
+        try:
+            await self._write(
+                _DB_COLLECTION_ISSUES,
+                UpdateOne(
+                    guard,
+                    {
+                        "$set": entry.model_dump(
+                            by_alias=True, exclude={"id"}, exclude_unset=True
+                        )
+                    },
+                    upsert=True,
+                ),
+            )
+        except DuplicateKeyError:
+            # the stored issue is more recent.
+            logger.debug(f"ignored stale '{event.action}' for issue '{issue_id}'")
+
+    async def _record_issue_event(
+        self, event: ghk_webhook_types.IssuesEvent, issue: ghk_rest_models.Issue
+    ) -> None:
+        """Add an event to the issue's timeline, and update its summary."""
+        data: dict[str, Any] = {}
+        label = getattr(event, "label", None)
+        if label is not None:
+            data["label"] = label.name
+        milestone = getattr(event, "milestone", None)
+        if milestone is not None:
+            data["milestone"] = milestone.title
+
+        entry = InstallationIssueEventEntry(
+            issue_id=issue.node_id,
+            event=event.action,
+            actor=event.sender.login,
+            created_at=issue.updated_at,
+            data=data,
+        )
+        doc = entry.model_dump(by_alias=True, exclude={"id"})
+        res = await self._write(
+            _DB_COLLECTION_ISSUE_EVENTS,
+            UpdateOne(
+                {k: doc[k] for k in ("issue_id", "created_at", "event", "data")},
+                {"$setOnInsert": doc},
+                upsert=True,
+            ),
+        )
+        if res.upserted_id is None:
+            # seen before, already counted.
+            return
+
+        await self._write(
+            _DB_COLLECTION_ISSUES,
+            UpdateOne(
+                {"issue_id": entry.issue_id},
+                {
+                    "$inc": {f"event_counts.{entry.event}": 1},
+                    "$max": {"last_event_at": entry.created_at},
+                },
+            ),
+        )
+
+    async def get_issue_timeline(
+        self, issue_id: str, *, cursor: str | None = None, limit: int = 50
+    ) -> tuple[list[InstallationIssueEventEntry], str | None]:
+        """Read a page of an issue's timeline, oldest first.
+
+        Returns the events, and the cursor to the next page, if any.
+        """
+        query: dict[str, Any] = {"issue_id": issue_id}
+        if cursor is not None:
+            keys = decode_cursor(cursor)
+            try:
+                created_at, last_id = dt.fromisoformat(keys[0]), ObjectId(keys[1])
+            except (IndexError, TypeError, ValueError, InvalidId):
+                raise InvalidCursorError()
+            query["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "_id": {"$gt": last_id}},
+            ]
+
+        docs = (
+            await self._get_issue_events_coll()
+            .find(query)
+            .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+            .limit(limit + 1)
+            .to_list(None)
+        )
+        events = [InstallationIssueEventEntry.model_validate(d) for d in docs[:limit]]
+
+        next_cursor: str | None = None
+        if len(docs) > limit:
+            last = docs[limit - 1]
+            next_cursor = encode_cursor(last["created_at"].isoformat(), last["_id"])
+        return events, next_cursor
+
+    def _comment_entry(
+        self,
+        issue_id: str,
+        comment: ghk_wh_models.IssueComment | ghk_rest_models.IssueComment,
+        repository: ghk_wh_models.Repository | ghk_rest_models.Repository,
+    ) -> tuple[InstallationCommentEntry, dict[str, Any], dict[str, Any] | None]:
+        """Build a comment's entry, returning it with its repository and author."""
+        comment_doc = comment.model_dump(by_alias=True, exclude_unset=True)
+        repository_doc = repository.model_dump(by_alias=True, exclude_unset=True)
+        fields = compact_comment(
+            comment_doc, repository_doc, keep_body=self._storage.keep_comment_body
+        )
+        if self._storage.comments == "full":
+            fields.update(comment=comment, repository=repository)
+
+        entry = InstallationCommentEntry(
+            issue_id=issue_id,
+            comment_id=comment.node_id,
+            updated_at=comment.updated_at,
+            by_login=comment.user.login if comment.user is not None else "ghost",
+            **fields,
+        )
+        return entry, repository_doc, comment_doc.get("user")
+
+    async def _store_refs(
+        self, repositories: list[dict[str, Any]], users: list[dict[str, Any]]
+    ) -> None:
+        """Store the repositories and users comments refer to, if changed."""
+        if self._storage.comments != "compact":
+            return
+
+        def _changed(
+            kind: str, docs: list[dict[str, Any]], version: str
+        ) -> list[dict[str, Any]]:
+            changed: list[dict[str, Any]] = []
+            for doc in docs:
+                key = (kind, doc["id"])
+                if key in self._known_refs and self._known_refs[key] == doc[version]:
+                    self._known_refs.move_to_end(key)
+                    continue
+                self._known_refs[key] = doc[version]
+                changed.append(doc)
+            return changed
+
+        repo_ops, user_ops = ref_updates(
+            _changed("repository", repositories, "updated_at"),
+            _changed("user", users, "login"),
+        )
+        while len(self._known_refs) > _MAX_KNOWN_REFS:
+            self._known_refs.popitem(last=False)
+
+        if len(repo_ops) > 0:
+            await self._db.get_collection(COLL_REPOSITORIES).bulk_write(
+                repo_ops, ordered=False
+            )
+        if len(user_ops) > 0:
+            await self._db.get_collection(COLL_USERS).bulk_write(
+                user_ops, ordered=False
+            )
+
+    async def _update_issue_metrics(
+        self, repo_owner: str, repo_name: str, issue: ghk_rest_models.Issue
+    ) -> None:
+        await self._metrics.update_issue(
+            repo_owner,
+            repo_name,
+            issue.node_id,
+            author=issue.user.login if issue.user is not None else None,
+            opened_at=issue.created_at,
+            updated_at=issue.updated_at,
+            closed_at=issue.closed_at,
+            state=issue.state,
+            labels=_issue_labels(issue),
+        )
+
+    def _changed(self) -> None:
+        # only once written, so reads racing the writes aren't cached as new.
+        self._generation = next(_generations)
+
+    async def _write(self, collection: str, op: WriteOp) -> WriteResult:
+        """Write through the pipeline, waiting for the write to complete."""
+        return await self._writes.write(collection, op)
+
+    async def close(self) -> None:
+        """Complete pending writes."""
+        await self._writes.close()
 
     def _get_comments_coll(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
         return self._db.get_collection(_DB_COLLECTION_COMMENTS)
@@ -82,6 +697,9 @@ class Installation:
     def _get_issues_coll(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
         return self._db.get_collection(_DB_COLLECTION_ISSUES)
 
+    def _get_issue_events_coll(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        return self._db.get_collection(_DB_COLLECTION_ISSUE_EVENTS)
+
     async def _maybe_add_issue(
         self,
         repo_owner: str,
@@ -91,50 +709,277 @@ class Installation:
     ) -> None:
         if issue_id is not None:
             coll = self._get_issues_coll()
-            entry: InstallationIssueEntry | None = cast(
-                Optional[InstallationIssueEntry],
-                await coll.find_one({"issue_id": issue_id}),
-            )
-            if entry is not None:
+            found = await coll.find_one({"issue_id": issue_id}, {"_id": 1})
+            if found is not None:
                 return
 
+            try:
+                if await self._fetch_issue_node(issue_id, priority=Priority.LIVE):
+                    return
+            except Exception as e:
+                logger.warning(
+                    f"Unable to fetch issue '{issue_id}' over GraphQL, "
+                    f"falling back to REST: {str(e)}"
+                )
+
         await self._fetch_issue(repo_owner, repo_name, issue_number)
 
+    async def refresh_stale_issues(self, fetched_before: dt, limit: int) -> int:
+        """Refresh up to 'limit' issues last fetched before 'fetched_before'.
+
+        Issues with stored validators are requested conditionally, at no cost
+        if unchanged. The others are batched into GraphQL queries, falling back
+        to REST for those not available there. Returns the number refreshed.
+        """
+        cursor = self._get_issues_coll().find(
+            {"fetched_at": {"$lt": fetched_before}},
+            {"issue_id": 1, "repo_owner": 1, "repo_name": 1, "issue_number": 1},
+            sort=[("fetched_at", ASCENDING)],
+            limit=limit,
+        )
+        stale: dict[str, tuple[str, str, int]] = {
+            doc["issue_id"]: (doc["repo_owner"], doc["repo_name"], doc["issue_number"])
+            async for doc in cursor
+        }
+        cached = await self._http_cache.find_cached(
+            [_issue_cache_key(*k) for k in stale.values()]
+        )
+
+        by_node = [i for i, k in stale.items() if _issue_cache_key(*k) not in cached]
+        missed = await self.refresh_issues(by_node)
+        by_rest = [
+            k for i, k in stale.items() if _issue_cache_key(*k) in cached or i in missed
+        ]
+
+        res = await asyncio.gather(
+            *[self._fetch_issue(*k, refresh=True) for k in by_rest],
+            return_exceptions=True,
+        )
+        for (repo_owner, repo_name, issue_number), r in zip(by_rest, res):
+            if isinstance(r, Exception):
+                logger.error(
+                    f"Unable to refresh issue {repo_owner}/{repo_name}#{issue_number}: "
+                    f"{str(r)}"
+                )
+
+        refreshed = len(by_node) - len(missed)
+        return refreshed + sum(1 for r in res if not isinstance(r, Exception))
+
+    async def refresh_issues(self, issue_ids: list[str]) -> set[str]:
+        """Refresh issues by id, batched into GraphQL queries.
+
+        Returns the ids of the issues not refreshed, unavailable or failed.
+        """
+        res = await asyncio.gather(
+            *[self._fetch_issue_node(i, priority=Priority.BACKFILL) for i in issue_ids],
+            return_exceptions=True,
+        )
+        for issue_id, r in zip(issue_ids, res):
+            if isinstance(r, Exception):
+                logger.error(f"Unable to refresh issue '{issue_id}': {str(r)}")
+        return {i for i, r in zip(issue_ids, res) if r is not True}
+
+    async def _fetch_issue_nodes(
+        self, issue_ids: list[str], priority: Priority
+    ) -> dict[str, dict[str, Any] | None]:
+        try:
+            data = await self._github.call(
+                self._id,
+                lambda gh: gh.async_graphql(ISSUE_NODES_QUERY, {"ids": issue_ids}),
+                priority=priority,
+            )
+        except GraphQLFailed as e:
+            # unknown or inaccessible ids fail on their own, keep the others.
+            if e.response.data is None:
+                raise
+            data = e.response.data
+
+        nodes: list[dict[str, Any] | None] = data.get("nodes") or []
+        return dict(zip(issue_ids, nodes))
+
+    async def _fetch_issue_node(self, issue_id: str, *, priority: Priority) -> bool:
+        """Fetch and store an issue by id, returning False if not available."""
+        node = await self._issue_nodes.get(issue_id, priority=priority)
+        res = issue_from_node(node) if node is not None else None
+        if res is None:
+            logger.debug(f"issue '{issue_id}' not available over GraphQL")
+            return False
+
+        repo_owner, repo_name, issue = res
+        entry = _issue_entry(repo_owner, repo_name, issue)
+        await self._write(
+            _DB_COLLECTION_ISSUES,
+            UpdateOne(
+                {"issue_id": entry.issue_id},
+                {
+                    "$set": entry.model_dump(
+                        by_alias=True, exclude={"id"}, exclude_unset=True
+                    )
+                },
+                upsert=True,
+            ),
+        )
+        await self._update_issue_metrics(repo_owner, repo_name, issue)
+        self._changed()
+        return True
+
     async def _fetch_issue(
-        self, repo_owner: str, repo_name: str, issue_number: int
+        self,
+        repo_owner: str,
+        repo_name: str,
+        issue_number: int,
+        *,
+        refresh: bool = False,
     ) -> None:
-        gh = self._github.get(self._id)
-        response = await gh.rest.issues.async_get(repo_owner, repo_name, issue_number)
+        # concurrent fetches of the same issue share a single request.
+        await self._issue_fetches.do(
+            (repo_owner, repo_name, issue_number),
+            lambda: self._do_fetch_issue(
+                repo_owner, repo_name, issue_number, refresh=refresh
+            ),
+        )
+
+    async def _do_fetch_issue(
+        self, repo_owner: str, repo_name: str, issue_number: int, *, refresh: bool
+    ) -> None:
+        # only a stored issue can be refreshed conditionally.
+        cache_key = _issue_cache_key(repo_owner, repo_name, issue_number)
+        headers = await self._http_cache.get_headers(cache_key) if refresh else {}
+
+        response = await self._github.call(
+            self._id,
+            lambda gh: gh.rest.issues.async_get(
+                repo_owner, repo_name, issue_number, headers=headers
+            ),
+            priority=Priority.BACKFILL if refresh else Priority.LIVE,
+        )
+        if response.status_code == 304:
+            await self._write(
+                _DB_COLLECTION_ISSUES,
+                UpdateOne(
+                    {
+                        "repo_owner": repo_owner,
+                        "repo_name": repo_name,
+                        "issue_number": issue_number,
+                    },
+                    {"$set": {"fetched_at": dt.utcnow()}},
+                ),
+            )
+            logger.debug(f"issue '{cache_key}' not modified")
+            return
+
         issue: ghk_rest_models.Issue = response.parsed_data
 
         await self._eventdb.rest(response, call_name="fetch_issue")
 
-        labels: list[str] = []
-        for label in issue.labels:
-            if isinstance(label, str):
-                labels.append(label)
+        entry = _issue_entry(repo_owner, repo_name, issue)
+
+        res = await self._write(
+            _DB_COLLECTION_ISSUES,
+            UpdateOne(
+                {"issue_id": entry.issue_id},
+                {
+                    "$set": entry.model_dump(
+                        by_alias=True, exclude={"id"}, exclude_unset=True
+                    )
+                },
+                upsert=True,
+            ),
+        )
+        logger.debug(f"upserted entry for issue '{entry.issue_id}': {res.upserted_id}")
+        await self._update_issue_metrics(repo_owner, repo_name, issue)
+
+        await self._http_cache.store(cache_key, response)
+        self._changed()
+
+    async def bulk_upsert_issues(
+        self, repo_owner: str, repo_name: str, issues: list[ghk_rest_models.Issue]
+    ) -> None:
+        if len(issues) == 0:
+            return
+
+        ops = [
+            _upsert(
+                "issue_id",
+                _issue_entry(repo_owner, repo_name, i),
+                "instance.updated_at",
+            )
+            for i in issues
+        ]
+        await _bulk_upsert(self._get_issues_coll(), ops)
+        await asyncio.gather(
+            *[self._update_issue_metrics(repo_owner, repo_name, i) for i in issues]
+        )
+        self._changed()
+
+    async def bulk_upsert_comments(
+        self,
+        repository: ghk_rest_models.Repository,
+        comments: list[ghk_rest_models.IssueComment],
+        issue_ids: dict[int, str],
+    ) -> None:
+        ops: list[UpdateOne] = []
+        entries: list[InstallationCommentEntry] = []
+        repository_doc: dict[str, Any] | None = None
+        users: list[dict[str, Any]] = []
+        for comment in comments:
+            issue_number = int(comment.issue_url.rsplit("/", 1)[-1])
+            issue_id = issue_ids.get(issue_number)
+            if issue_id is None:
+                logger.debug(f"No issue for comment '{comment.node_id}', skipping")
                 continue
-            name: str | None = exclude_unset(label.name)
-            if name is not None:
-                labels.append(name)
 
-        entry = InstallationIssueEntry(
-            issue_id=issue.node_id,
-            repo_owner=repo_owner,
-            repo_name=repo_name,
-            issue_number=issue.number,
-            fetched_at=dt.utcnow(),
-            events=[],
-            labels=labels,
-            milestone=issue.milestone,
-            state=issue.state,
-            instance=issue,
+            entry, repository_doc, user = self._comment_entry(
+                issue_id, comment, repository
+            )
+            if user is not None:
+                users.append(user)
+            ops.append(_upsert("comment_id", entry, "updated_at", _LIVE_COMMENT))
+            entries.append(entry)
+
+        if repository_doc is not None:
+            await self._store_refs([repository_doc], users)
+        if len(ops) == 0:
+            return
+
+        upserted = await _bulk_upsert(self._get_comments_coll(), ops)
+        counts: dict[str, int] = {}
+        activity: list[Awaitable[None]] = []
+        for i in upserted:
+            entry = entries[i]
+            counts[entry.by_login] = counts.get(entry.by_login, 0) + 1
+            activity.append(
+                self._rollups.record(
+                    repository.owner.login,
+                    repository.name,
+                    entry.created_at or entry.updated_at,
+                    {"comments": 1},
+                )
+            )
+        await asyncio.gather(
+            self._metrics.count_comments(counts),
+            *activity,
+            *[
+                self._metrics.add_response(e.issue_id, e.by_login, e.created_at)
+                for e in entries
+                if e.created_at is not None
+            ],
         )
+        self._changed()
 
-        coll = self._get_issues_coll()
-        new_entry = await coll.insert_one(
-            entry.model_dump(by_alias=True, exclude=set("id"), exclude_unset=True)
+    async def get_issue_ids(self, repo_owner: str, repo_name: str) -> dict[int, str]:
+        """Map a repository's issue numbers to their issue ids."""
+        cursor = self._get_issues_coll().find(
+            {"repo_owner": repo_owner, "repo_name": repo_name},
+            {"issue_number": 1, "issue_id": 1, "_id": 0},
         )
-        logger.debug(
-            f"inserted new entry for issue '{entry.issue_id}': {new_entry.inserted_id}"
+        return {doc["issue_number"]: doc["issue_id"] async for doc in cursor}
+
+    async def get_oldest_fetch(self, repo_owner: str, repo_name: str) -> dt | None:
+        """Obtain when a repository's least recently fetched issue was fetched."""
+        doc = await self._get_issues_coll().find_one(
+            {"repo_owner": repo_owner, "repo_name": repo_name},
+            {"fetched_at": 1, "_id": 0},
+            sort=[("fetched_at", ASCENDING)],
         )
+        return doc["fetched_at"] if doc is not None else None
@@ -0,0 +1,406 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from collections import Counter
+from datetime import datetime as dt
+from datetime import timedelta
+from typing import Any, Iterable
+
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
+from pymongo import (
+    ASCENDING,
+    DeleteOne,
+    IndexModel,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateOne,
+)
+from pymongo.errors import DuplicateKeyError
+
+from insights.engine.rollups import Rollups
+from insights.engine.writes import WritePipeline
+
+COLL_ISSUE_METRICS = "metrics.issues"
+COLL_LABEL_METRICS = "metrics.labels"
+COLL_AUTHOR_METRICS = "metrics.authors"
+
+_COLL_ISSUES = "issues"
+_COLL_COMMENTS = "comments"
+
+# issue states counted per label, and all counters of metrics entries.
+_STATES = ("open", "closed")
+_COUNTERS = (*_STATES, "comments")
+
+_INDEXES: dict[str, list[IndexModel]] = {
+    COLL_ISSUE_METRICS: [
+        IndexModel([("repo_owner", ASCENDING), ("repo_name", ASCENDING)]),
+    ],
+    COLL_LABEL_METRICS: [
+        IndexModel(
+            [
+                ("repo_owner", ASCENDING),
+                ("repo_name", ASCENDING),
+                ("label", ASCENDING),
+            ],
+            unique=True,
+        ),
+    ],
+}
+
+# (repo_owner, repo_name, label), with no label counting the whole repository.
+_LabelKey = tuple[str, str, str | None]
+
+
+class IssueMetricsEntry(BaseModel):
+    """An issue's state as counted in the label metrics, and its first response."""
+
+    id: str = Field(alias="_id")
+
+    repo_owner: str
+    repo_name: str
+    author: str | None
+    opened_at: dt
+    updated_at: dt
+    state: str
+    labels: list[str] = Field(default=[])
+    # earliest comment by someone other than the author
+    first_response_at: dt | None = Field(default=None)
+
+    @property
+    def time_to_first_response(self) -> timedelta | None:
+        if self.first_response_at is None:
+            return None
+        return self.first_response_at - self.opened_at
+
+
+class LabelMetricsEntry(BaseModel):
+    """Open and closed issues of a repository, with a label if set."""
+
+    repo_owner: str
+    repo_name: str
+    label: str | None
+    open: int = Field(default=0)
+    closed: int = Field(default=0)
+
+
+class AuthorMetricsEntry(BaseModel):
+    """Comments by an author, keyed by login; deleted comments are not counted."""
+
+    id: str = Field(alias="_id")
+    comments: int = Field(default=0)
+
+
+class MetricsReport(BaseModel):
+    database: str
+    issues: int
+    labels: int
+    authors: int
+    # materialized entries that differ from the recomputed ones.
+    mismatched: int
+
+
+def _label_counts(
+    entries: Iterable[dict[str, Any]], sign: int
+) -> Counter[tuple[_LabelKey, str]]:
+    counts: Counter[tuple[_LabelKey, str]] = Counter()
+    for entry in entries:
+        state = "open" if entry["state"] == "open" else "closed"
+        owner, name = entry["repo_owner"], entry["repo_name"]
+        counts[((owner, name, None), state)] += sign
+        for label in entry.get("labels", []):
+            counts[((owner, name, label), state)] += sign
+    return counts
+
+
+class Metrics:
+    """Insights for an installation, maintained as issues and comments change.
+
+    Each update costs a constant number of writes. Issue counts are kept by
+    diffing an issue's new state against the state last counted for it, so
+    redeliveries, refetches and out of order updates never count twice.
+    Issues opened and closed are also counted in the activity rollups.
+    'rebuild()' recomputes everything but the rollups from the stored issues
+    and comments.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _writes: WritePipeline
+    _rollups: Rollups
+
+    def __init__(
+        self,
+        db: motor.motor_asyncio.AsyncIOMotorDatabase,
+        writes: WritePipeline,
+        rollups: Rollups,
+    ) -> None:
+        self._db = db
+        self._writes = writes
+        self._rollups = rollups
+
+    async def ensure_indexes(self) -> None:
+        for name, indexes in _INDEXES.items():
+            await self._db.get_collection(name).create_indexes(indexes)
+
+    async def update_issue(
+        self,
+        repo_owner: str,
+        repo_name: str,
+        issue_id: str,
+        *,
+        author: str | None,
+        opened_at: dt,
+        updated_at: dt,
+        closed_at: dt | None,
+        state: str,
+        labels: list[str],
+    ) -> None:
+        """Count an issue's current state, unless a newer one was counted."""
+        entry = IssueMetricsEntry(
+            _id=issue_id,
+            repo_owner=repo_owner,
+            repo_name=repo_name,
+            author=author,
+            opened_at=opened_at,
+            updated_at=updated_at,
+            state=state,
+            labels=sorted(set(labels)),
+        )
+        # never null, a null first response would win over any '$min'.
+        doc = entry.model_dump(by_alias=True, exclude={"id"}, exclude_none=True)
+        coll = self._db.get_collection(COLL_ISSUE_METRICS)
+
+        async def update(upsert: bool) -> dict[str, Any] | None:
+            return await coll.find_one_and_update(
+                {"_id": issue_id, "updated_at": {"$not": {"$gt": updated_at}}},
+                {"$set": doc},
+                projection={"repo_owner": 1, "repo_name": 1, "state": 1, "labels": 1},
+                upsert=upsert,
+                return_document=ReturnDocument.BEFORE,
+            )
+
+        try:
+            before = await update(True)
+        except DuplicateKeyError:
+            # a concurrent first update may have inserted it, the stored one is
+            # only stale if it doesn't match without inserting either.
+            before = await update(False)
+            if before is None:
+                logger.debug(f"ignored stale metrics update for issue '{issue_id}'")
+                return
+
+        counts = _label_counts([doc], 1)
+        if before is not None:
+            counts.update(_label_counts([before], -1))
+
+        activity = [self._count_labels(counts)]
+        if before is None:
+            activity.append(
+                self._rollups.record(
+                    repo_owner, repo_name, opened_at, {"issues_opened": 1}
+                )
+            )
+        if state == "closed" and (before is None or before["state"] == "open"):
+            activity.append(
+                self._rollups.record(
+                    repo_owner,
+                    repo_name,
+                    closed_at or updated_at,
+                    {"issues_closed": 1},
+                )
+            )
+        await asyncio.gather(*activity)
+
+    async def remove_issue(self, issue_id: str) -> None:
+        """Stop counting an issue, e.g., when deleted or transferred."""
+        coll = self._db.get_collection(COLL_ISSUE_METRICS)
+        before: dict[str, Any] | None = await coll.find_one_and_delete(
+            {"_id": issue_id}
+        )
+        if before is not None:
+            await self._count_labels(_label_counts([before], -1))
+
+    async def add_response(self, issue_id: str, login: str, created_at: dt) -> None:
+        """Account for a comment as a response, if not by the issue's author."""
+        await self._writes.write(
+            COLL_ISSUE_METRICS,
+            UpdateOne(
+                {"_id": issue_id, "author": {"$ne": login}},
+                {"$min": {"first_response_at": created_at}},
+            ),
+        )
+
+    async def count_comments(self, counts: dict[str, int]) -> None:
+        """Add to the number of comments by each author."""
+        await asyncio.gather(
+            *[
+                self._writes.write(
+                    COLL_AUTHOR_METRICS,
+                    UpdateOne({"_id": login}, {"$inc": {"comments": n}}, upsert=True),
+                )
+                for login, n in counts.items()
+                if n != 0
+            ]
+        )
+
+    async def _count_labels(self, counts: Counter[tuple[_LabelKey, str]]) -> None:
+        by_key: dict[_LabelKey, dict[str, int]] = {}
+        for (key, state), n in counts.items():
+            if n != 0:
+                by_key.setdefault(key, {})[state] = n
+
+        def update(inc: dict[str, int]) -> dict[str, Any]:
+            # new entries have every state, as when rebuilt.
+            missing = {state: 0 for state in _STATES if state not in inc}
+            if len(missing) == 0:
+                return {"$inc": inc}
+            return {"$inc": inc, "$setOnInsert": missing}
+
+        await asyncio.gather(
+            *[
+                self._writes.write(
+                    COLL_LABEL_METRICS,
+                    UpdateOne(
+                        {"repo_owner": owner, "repo_name": name, "label": label},
+                        update(inc),
+                        upsert=True,
+                    ),
+                )
+                for (owner, name, label), inc in by_key.items()
+            ]
+        )
+
+    async def rebuild(self, *, dry_run: bool = False) -> MetricsReport:
+        """Recompute all metrics from the stored issues and comments.
+
+        Entries differing from the recomputed ones are reported, and replaced
+        unless 'dry_run' is set. Updates applied while rebuilding may be lost,
+        so this is best run with ingestion paused.
+        """
+        issues: dict[str, dict[str, Any]] = {}
+        async for doc in self._db.get_collection(_COLL_ISSUES).find(
+            {},
+            {
+                "issue_id": 1,
+                "repo_owner": 1,
+                "repo_name": 1,
+                "state": 1,
+                "labels": 1,
+                "instance.user.login": 1,
+                "instance.created_at": 1,
+                "instance.updated_at": 1,
+            },
+        ):
+            instance: dict[str, Any] = doc["instance"]
+            user: dict[str, Any] | None = instance.get("user")
+            entry = IssueMetricsEntry(
+                _id=doc["issue_id"],
+                repo_owner=doc["repo_owner"],
+                repo_name=doc["repo_name"],
+                author=user["login"] if user is not None else None,
+                opened_at=instance["created_at"],
+                updated_at=instance["updated_at"],
+                state=doc["state"],
+                labels=sorted(set(doc.get("labels", []))),
+            )
+            issues[entry.id] = entry.model_dump(by_alias=True, exclude_none=True)
+
+        authors: Counter[str] = Counter()
+        async for doc in self._db.get_collection(_COLL_COMMENTS).find(
+            {},
+            {
+                "issue_id": 1,
+                "by_login": 1,
+                "created_at": 1,
+                "comment.created_at": 1,
+                "deleted_at": 1,
+            },
+        ):
+            login: str = doc["by_login"]
+            if doc.get("deleted_at") is None:
+                authors[login] += 1
+
+            # comments stored before compaction only have their full model.
+            created_at: dt | None = doc.get("created_at") or doc.get("comment", {}).get(
+                "created_at"
+            )
+            issue = issues.get(doc["issue_id"])
+            if issue is None or created_at is None or issue.get("author") == login:
+                continue
+            first: dt | None = issue.get("first_response_at")
+            if first is None or created_at < first:
+                issue["first_response_at"] = created_at
+
+        labels: list[dict[str, Any]] = []
+        by_key: dict[_LabelKey, dict[str, Any]] = {}
+        for (key, state), n in _label_counts(issues.values(), 1).items():
+            if key not in by_key:
+                owner, name, label = key
+                by_key[key] = LabelMetricsEntry(
+                    repo_owner=owner, repo_name=name, label=label
+                ).model_dump()
+                labels.append(by_key[key])
+            by_key[key][state] = n
+
+        report = MetricsReport(
+            database=self._db.name,
+            issues=len(issues),
+            labels=len(labels),
+            authors=len(authors),
+            mismatched=0,
+        )
+        for coll, docs, key in (
+            (COLL_ISSUE_METRICS, list(issues.values()), ("_id",)),
+            (COLL_LABEL_METRICS, labels, ("repo_owner", "repo_name", "label")),
+            (
+                COLL_AUTHOR_METRICS,
+                [{"_id": k, "comments": v} for k, v in authors.items()],
+                ("_id",),
+            ),
+        ):
+            report.mismatched += await self._replace(coll, docs, key, dry_run)
+        return report
+
+    async def _replace(
+        self,
+        name: str,
+        docs: list[dict[str, Any]],
+        key: tuple[str, ...],
+        dry_run: bool,
+    ) -> int:
+        """Replace a collection's entries, returning how many differ."""
+        expected = {tuple(d[k] for k in key): d for d in docs}
+        ops: list[ReplaceOne[dict[str, Any]] | DeleteOne] = []
+
+        coll = self._db.get_collection(name)
+        async for doc in coll.find():
+            doc_id = doc.pop("_id")
+            doc_key = tuple(doc_id if k == "_id" else doc.get(k) for k in key)
+            want = expected.pop(doc_key, None)
+            if want is None:
+                # zero counts are left behind by incremental updates.
+                counts = [doc[k] for k in _COUNTERS if k in doc]
+                if len(counts) == 0 or any(counts):
+                    ops.append(DeleteOne({"_id": doc_id}))
+                continue
+            # entries written before every state was set on insert lack some.
+            doc.update({k: 0 for k in _COUNTERS if k in want and k not in doc})
+            if {k: v for k, v in want.items() if k != "_id"} != doc:
+                ops.append(ReplaceOne({"_id": doc_id}, want))
+        ops.extend(
+            ReplaceOne({k: d[k] for k in key}, d, upsert=True)
+            for d in expected.values()
+        )
+
+        if len(ops) > 0:
+            logger.info(f"{len(ops)} entries of '{name}' differ when rebuilt")
+            if not dry_run:
+                await coll.bulk_write(ops, ordered=False)
+        return len(ops)
@@ -0,0 +1,78 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from typing import AsyncGenerator, Awaitable, Callable, TypeVar
+
+import githubkit as ghk
+import githubkit.rest.models as ghk_rest_models
+
+from insights.engine.github import Github, InstallationGitHub
+from insights.engine.scheduler import Priority
+
+T = TypeVar("T")
+
+
+class InstallationPaginator:
+    """Stream paginated REST listings for an installation, one page at a time."""
+
+    _github: Github
+    _installation_id: int
+    _per_page: int
+    _priority: Priority
+
+    def __init__(
+        self,
+        github: Github,
+        installation_id: int,
+        *,
+        per_page: int,
+        priority: Priority = Priority.BACKFILL,
+    ) -> None:
+        self._github = github
+        self._installation_id = installation_id
+        self._per_page = per_page
+        self._priority = priority
+
+    @property
+    def per_page(self) -> int:
+        return self._per_page
+
+    async def call(self, fn: Callable[[InstallationGitHub], Awaitable[T]]) -> T:
+        return await self._github.call(
+            self._installation_id, fn, priority=self._priority
+        )
+
+    async def pages(
+        self,
+        fetch: Callable[[InstallationGitHub, int], Awaitable[ghk.Response[list[T]]]],
+        page: int = 1,
+    ) -> AsyncGenerator[tuple[int, list[T]], None]:
+        """Yield each page, with its number, until a short page is returned."""
+        while True:
+            response = await self.call(lambda gh: fetch(gh, page))
+            items = response.parsed_data
+            yield page, items
+            if len(items) < self._per_page:
+                return
+            page += 1
+
+    async def repositories(self) -> AsyncGenerator[ghk_rest_models.Repository, None]:
+        """Yield every repository accessible to the installation."""
+        page = 1
+        while True:
+            response = await self.call(
+                lambda gh: gh.rest.apps.async_list_repos_accessible_to_installation(
+                    per_page=self._per_page, page=page
+                )
+            )
+            repos = response.parsed_data.repositories
+            for repo in repos:
+                yield repo
+            if len(repos) < self._per_page:
+                return
+            page += 1
@@ -0,0 +1,62 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from insights.config import ApiConfigModel
+
+
+class CachedResponse:
+    etag: str
+    body: bytes
+    expires_at: float
+
+    def __init__(self, body: bytes, ttl: float) -> None:
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.expires_at = time.monotonic() + ttl
+
+
+class ReadCache:
+    """Encoded read responses, by key, for a limited time.
+
+    Keys are expected to include the generation of the data they were read
+    from, see 'Installation.generation', so a write makes earlier entries
+    unreachable; these are evicted as the least recently used.
+    """
+
+    _ttl: float
+    _max_entries: int
+    _entries: OrderedDict[Hashable, CachedResponse]
+
+    def __init__(self, config: ApiConfigModel) -> None:
+        self._ttl = config.cache_ttl
+        self._max_entries = config.cache_max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, body: bytes) -> CachedResponse:
+        entry = CachedResponse(body, self._ttl)
+        if self._ttl > 0:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return entry
@@ -0,0 +1,327 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from datetime import datetime as dt
+from typing import Any, Callable, Generic, TypeVar
+
+import motor.motor_asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING
+
+from insights.engine.cursor import InvalidCursorError, decode_cursor, encode_cursor
+from insights.engine.metrics import (
+    COLL_AUTHOR_METRICS,
+    COLL_ISSUE_METRICS,
+    COLL_LABEL_METRICS,
+)
+
+_COLL_ISSUES = "issues"
+_COLL_COMMENTS = "comments"
+
+_ISSUE_PROJECTION: dict[str, Any] = {
+    "_id": 0,
+    "issue_id": 1,
+    "repo_owner": 1,
+    "repo_name": 1,
+    "issue_number": 1,
+    "state": 1,
+    "labels": 1,
+    "event_counts": 1,
+    "last_event_at": 1,
+    "instance.title": 1,
+    "instance.user.login": 1,
+    "instance.created_at": 1,
+    "instance.updated_at": 1,
+    "instance.closed_at": 1,
+}
+
+# comments stored before compaction only have their full model.
+_COMMENT_PROJECTION: dict[str, Any] = {
+    "comment_id": 1,
+    "by_login": 1,
+    "updated_at": 1,
+    "created_at": 1,
+    "author_association": 1,
+    "body_length": 1,
+    "reactions": 1,
+    "body": 1,
+    "comment.created_at": 1,
+    "comment.author_association": 1,
+    "comment.body": 1,
+}
+
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None
+
+
+class InstallationSummary(BaseModel):
+    installation_id: int
+    updated_at: dt | None
+    probed_at: dt | None
+
+
+class RepositorySummary(BaseModel):
+    repo_owner: str
+    repo_name: str
+    open_issues: int
+    closed_issues: int
+
+
+class IssueSummary(BaseModel):
+    issue_id: str
+    repo_owner: str
+    repo_name: str
+    issue_number: int
+    title: str
+    author: str | None
+    state: str
+    labels: list[str]
+    created_at: dt
+    updated_at: dt
+    closed_at: dt | None
+    event_counts: dict[str, int]
+    last_event_at: dt | None
+
+
+class IssueDetails(IssueSummary):
+    first_response_at: dt | None = Field(default=None)
+    # in seconds
+    time_to_first_response: float | None = Field(default=None)
+
+
+class CommentSummary(BaseModel):
+    comment_id: str
+    by_login: str
+    created_at: dt | None
+    updated_at: dt
+    author_association: str | None
+    body_length: int | None
+    reactions: dict[str, int]
+    body: str | None
+
+
+class AuthorStats(BaseModel):
+    login: str
+    comments: int
+
+
+def _after(keys: list[str], values: list[Any]) -> dict[str, Any]:
+    """Match documents sorted after the given values of ascending sort keys."""
+    clauses: list[dict[str, Any]] = []
+    for i, key in enumerate(keys):
+        clause: dict[str, Any] = dict(zip(keys[:i], values[:i]))
+        clause[key] = {"$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def find_page(
+    coll: motor.motor_asyncio.AsyncIOMotorCollection,
+    query: dict[str, Any],
+    keys: list[str],
+    projection: dict[str, Any],
+    *,
+    cursor: str | None,
+    limit: int,
+    parse: Callable[[list[Any]], list[Any]] | None = None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """Read a page of documents by keyset, returning the cursor to the next."""
+    if cursor is not None:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise InvalidCursorError()
+        if parse is not None:
+            try:
+                values = parse(values)
+            except (TypeError, ValueError, InvalidId):
+                raise InvalidCursorError()
+        query = {"$and": [query, _after(keys, values)]}
+
+    # sort keys are needed to build the next cursor.
+    if projection.get("_id") == 0:
+        projection = {**projection, **{k: 1 for k in keys}}
+    docs: list[dict[str, Any]] = (
+        await coll.find(query, projection)
+        .sort([(k, ASCENDING) for k in keys])
+        .limit(limit + 1)
+        .to_list(None)
+    )
+
+    next_cursor: str | None = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(*[docs[-1][k] for k in keys])
+    return docs, next_cursor
+
+
+def _issue_summary(doc: dict[str, Any]) -> dict[str, Any]:
+    instance: dict[str, Any] = doc["instance"]
+    user: dict[str, Any] | None = instance.get("user")
+    return {
+        "issue_id": doc["issue_id"],
+        "repo_owner": doc["repo_owner"],
+        "repo_name": doc["repo_name"],
+        "issue_number": doc["issue_number"],
+        "title": instance["title"],
+        "author": user["login"] if user is not None else None,
+        "state": doc["state"],
+        "labels": doc.get("labels", []),
+        "created_at": instance["created_at"],
+        "updated_at": instance["updated_at"],
+        "closed_at": instance.get("closed_at"),
+        "event_counts": doc.get("event_counts", {}),
+        "last_event_at": doc.get("last_event_at"),
+    }
+
+
+def _comment_summary(doc: dict[str, Any]) -> CommentSummary:
+    comment: dict[str, Any] = doc.get("comment") or {}
+    body: str | None = doc.get("body", comment.get("body"))
+    body_length: int | None = doc.get("body_length")
+    return CommentSummary(
+        comment_id=doc["comment_id"],
+        by_login=doc["by_login"],
+        created_at=doc.get("created_at") or comment.get("created_at"),
+        updated_at=doc["updated_at"],
+        author_association=(
+            doc.get("author_association") or comment.get("author_association")
+        ),
+        body_length=body_length
+        if body_length is not None
+        else (len(body) if body is not None else None),
+        reactions=doc.get("reactions", {}),
+        body=body,
+    )
+
+
+class InstallationReads:
+    """Paginated reads of an installation's data, projected to what is returned.
+
+    Pages are sorted on indexed keys, and continue from a cursor holding the
+    last returned keys, so reading any page costs the same.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+
+    def __init__(self, db: motor.motor_asyncio.AsyncIOMotorDatabase) -> None:
+        self._db = db
+
+    async def repositories(
+        self, *, cursor: str | None = None, limit: int = 50
+    ) -> Page[RepositorySummary]:
+        docs, next_cursor = await find_page(
+            self._db.get_collection(COLL_LABEL_METRICS),
+            {"label": None},
+            ["repo_owner", "repo_name"],
+            {"_id": 0, "open": 1, "closed": 1},
+            cursor=cursor,
+            limit=limit,
+        )
+        return Page(
+            items=[
+                RepositorySummary(
+                    repo_owner=d["repo_owner"],
+                    repo_name=d["repo_name"],
+                    open_issues=d.get("open", 0),
+                    closed_issues=d.get("closed", 0),
+                )
+                for d in docs
+            ],
+            next_cursor=next_cursor,
+        )
+
+    async def issues(
+        self,
+        *,
+        repo_owner: str | None = None,
+        repo_name: str | None = None,
+        state: str | None = None,
+        label: str | None = None,
+        cursor: str | None = None,
+        limit: int = 50,
+    ) -> Page[IssueSummary]:
+        query: dict[str, Any] = {}
+        if repo_owner is not None:
+            query["repo_owner"] = repo_owner
+        if repo_name is not None:
+            query["repo_name"] = repo_name
+        if state is not None:
+            query["state"] = state
+        if label is not None:
+            query["labels"] = label
+
+        docs, next_cursor = await find_page(
+            self._db.get_collection(_COLL_ISSUES),
+            query,
+            ["repo_owner", "repo_name", "issue_number"],
+            _ISSUE_PROJECTION,
+            cursor=cursor,
+            limit=limit,
+        )
+        return Page(
+            items=[IssueSummary.model_validate(_issue_summary(d)) for d in docs],
+            next_cursor=next_cursor,
+        )
+
+    async def issue(self, issue_id: str) -> IssueDetails | None:
+        doc: dict[str, Any] | None = await self._db.get_collection(
+            _COLL_ISSUES
+        ).find_one({"issue_id": issue_id}, _ISSUE_PROJECTION)
+        if doc is None:
+            return None
+
+        details = IssueDetails.model_validate(_issue_summary(doc))
+        metrics: dict[str, Any] | None = await self._db.get_collection(
+            COLL_ISSUE_METRICS
+        ).find_one({"_id": issue_id}, {"first_response_at": 1})
+        first: dt | None = (metrics or {}).get("first_response_at")
+        if first is not None:
+            details.first_response_at = first
+            details.time_to_first_response = (
+                first - details.created_at.replace(tzinfo=None)
+            ).total_seconds()
+        return details
+
+    async def comments(
+        self, issue_id: str, *, cursor: str | None = None, limit: int = 50
+    ) -> Page[CommentSummary]:
+        """Read an issue's comments, as stored; deleted comments are skipped."""
+        docs, next_cursor = await find_page(
+            self._db.get_collection(_COLL_COMMENTS),
+            {"issue_id": issue_id, "deleted_at": {"$exists": False}},
+            ["_id"],
+            _COMMENT_PROJECTION,
+            cursor=cursor,
+            limit=limit,
+            parse=lambda v: [ObjectId(v[0])],
+        )
+        return Page(items=[_comment_summary(d) for d in docs], next_cursor=next_cursor)
+
+    async def comment_stats(
+        self, *, cursor: str | None = None, limit: int = 50
+    ) -> Page[AuthorStats]:
+        """Read the number of comments by each author, by login."""
+        docs, next_cursor = await find_page(
+            self._db.get_collection(COLL_AUTHOR_METRICS),
+            {"comments": {"$gt": 0}},
+            ["_id"],
+            {"comments": 1},
+            cursor=cursor,
+            limit=limit,
+        )
+        return Page(
+            items=[AuthorStats(login=d["_id"], comments=d["comments"]) for d in docs],
+            next_cursor=next_cursor,
+        )
@@ -0,0 +1,141 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from datetime import datetime as dt
+from datetime import timedelta, timezone
+
+import githubkit.rest.models as ghk_rest_models
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
+
+from insights.config import ResyncConfigModel
+from insights.engine.github import Github
+from insights.engine.installation import Installation
+from insights.engine.pagination import InstallationPaginator
+
+_DB_COLLECTION_SYNC = "sync"
+
+# tolerate some clock skew between us and GitHub when listing by 'since'.
+_CLOCK_SKEW = timedelta(minutes=1)
+
+
+class SyncWatermark(BaseModel):
+    """Time of the last successful sync of a repository, keyed by full name."""
+
+    id: str = Field(alias="_id")
+    synced_at: dt
+
+
+class Resync:
+    """Refresh an installation's issues updated since the last sync.
+
+    Each repository keeps a watermark, the time its last sync started. Only
+    issues updated since then are listed, most stale repositories first. A
+    repository without a watermark starts from its least recently fetched issue,
+    and one without any issues is left to the backfill. Issues not updated in a
+    while are then refreshed, least recently fetched first.
+    """
+
+    _config: ResyncConfigModel
+    _installation: Installation
+    _paginator: InstallationPaginator
+    _watermarks: motor.motor_asyncio.AsyncIOMotorCollection
+
+    def __init__(
+        self, config: ResyncConfigModel, github: Github, installation: Installation
+    ) -> None:
+        self._config = config
+        self._installation = installation
+        self._paginator = InstallationPaginator(
+            github, installation.id, per_page=config.per_page
+        )
+        self._watermarks = installation.db.get_collection(_DB_COLLECTION_SYNC)
+
+    async def run(self) -> int:
+        """Sync all repositories, returning the number of issues refreshed."""
+        watermarks: dict[str, dt] = {}
+        async for raw in self._watermarks.find():
+            mark = SyncWatermark.model_validate(raw)
+            watermarks[mark.id] = mark.synced_at
+
+        repos: list[tuple[dt, ghk_rest_models.Repository]] = []
+        async for repo in self._paginator.repositories():
+            since = watermarks.get(repo.full_name)
+            if since is None:
+                since = await self._installation.get_oldest_fetch(
+                    repo.owner.login, repo.name
+                )
+                if since is None:
+                    continue
+            repos.append((since, repo))
+
+        repos.sort(key=lambda r: r[0])
+
+        total = 0
+        for since, repo in repos:
+            try:
+                total += await self._sync_repo(repo, since)
+            except Exception as e:
+                logger.error(
+                    f"Unable to sync '{repo.full_name}' for installation "
+                    f"{self._installation.id}: {str(e)}"
+                )
+
+        if self._config.refresh_after > 0:
+            total += await self._refresh_stale()
+        return total
+
+    async def _refresh_stale(self) -> int:
+        fetched_before = dt.utcnow() - timedelta(seconds=self._config.refresh_after)
+        try:
+            count = await self._installation.refresh_stale_issues(
+                fetched_before, self._config.refresh_limit
+            )
+        except Exception as e:
+            logger.error(
+                f"Unable to refresh stale issues of installation "
+                f"{self._installation.id}: {str(e)}"
+            )
+            return 0
+
+        if count > 0:
+            logger.debug(f"Refreshed {count} stale issues")
+        return count
+
+    async def _sync_repo(self, repo: ghk_rest_models.Repository, since: dt) -> int:
+        started_at = dt.utcnow()
+        owner = repo.owner.login
+        name = repo.name
+        per_page = self._paginator.per_page
+        # stored times are naive UTC, GitHub needs to be told so.
+        since_utc = (since - _CLOCK_SKEW).replace(tzinfo=timezone.utc)
+
+        count = 0
+        async for _, issues in self._paginator.pages(
+            lambda gh, page: gh.rest.issues.async_list_for_repo(
+                owner,
+                name,
+                state="all",
+                sort="updated",
+                direction="asc",
+                since=since_utc,
+                per_page=per_page,
+                page=page,
+            )
+        ):
+            await self._installation.bulk_upsert_issues(owner, name, issues)
+            count += len(issues)
+
+        mark = SyncWatermark(_id=repo.full_name, synced_at=started_at)
+        await self._watermarks.replace_one(
+            {"_id": mark.id}, mark.model_dump(by_alias=True), upsert=True
+        )
+        if count > 0:
+            logger.debug(f"Synced {count} issues of '{repo.full_name}'")
+        return count
@@ -0,0 +1,245 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+from datetime import datetime as dt
+from datetime import timedelta, timezone
+from typing import Any, Literal
+
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from insights.config import RollupsConfigModel
+from insights.engine.writes import WritePipeline
+
+COLL_ROLLUPS = "rollups"
+
+_DUPLICATE_KEY = 11000
+
+Resolution = Literal["minute", "hour", "day"]
+
+# finest first
+RESOLUTIONS: list[Resolution] = ["minute", "hour", "day"]
+
+BUCKET_WIDTH: dict[Resolution, timedelta] = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+_INDEXES: list[IndexModel] = [
+    IndexModel(
+        [
+            ("repo_owner", ASCENDING),
+            ("repo_name", ASCENDING),
+            ("resolution", ASCENDING),
+            ("start", ASCENDING),
+        ],
+        unique=True,
+    ),
+    # installation wide queries, and downsampling
+    IndexModel([("resolution", ASCENDING), ("start", ASCENDING)]),
+]
+
+
+def naive_utc(at: dt) -> dt:
+    """Convert a time to naive UTC, as stored."""
+    if at.tzinfo is None:
+        return at
+    return at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(at: dt, resolution: Resolution) -> dt:
+    """Obtain the start of the bucket containing a time, as naive UTC."""
+    at = naive_utc(at)
+    match resolution:
+        case "minute":
+            return at.replace(second=0, microsecond=0)
+        case "hour":
+            return at.replace(minute=0, second=0, microsecond=0)
+        case "day":
+            return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RollupBucket(BaseModel):
+    """Activity counters over a bucket of time."""
+
+    start: dt
+    counts: dict[str, int] = Field(default={})
+
+
+class Rollups:
+    """Activity counters for an installation, bucketed by time per repository.
+
+    Activity is counted in minute buckets, which are downsampled into hour
+    buckets once older than 'minute_retention', and those into day buckets
+    once older than 'hour_retention'. Activity older than a resolution's
+    retention when recorded, e.g., when backfilling, goes straight to the
+    coarser buckets.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _writes: WritePipeline
+    _retention: dict[Resolution, timedelta | None]
+
+    def __init__(
+        self,
+        db: motor.motor_asyncio.AsyncIOMotorDatabase,
+        writes: WritePipeline,
+        config: RollupsConfigModel,
+    ) -> None:
+        self._db = db
+        self._writes = writes
+        self._retention = {
+            "minute": timedelta(seconds=config.minute_retention),
+            "hour": timedelta(seconds=config.hour_retention),
+            "day": (
+                timedelta(seconds=config.day_retention)
+                if config.day_retention is not None
+                else None
+            ),
+        }
+
+    async def ensure_indexes(self) -> None:
+        await self._get_coll().create_indexes(_INDEXES)
+
+    async def record(
+        self, repo_owner: str, repo_name: str, at: dt, counts: dict[str, int]
+    ) -> None:
+        """Count activity in a repository at a given time."""
+        resolution = self._resolution_for(bucket_start(at, "minute"))
+        if resolution is None:
+            return
+
+        await self._writes.write(
+            COLL_ROLLUPS,
+            UpdateOne(
+                {
+                    "repo_owner": repo_owner,
+                    "repo_name": repo_name,
+                    "resolution": resolution,
+                    "start": bucket_start(at, resolution),
+                },
+                {"$inc": {f"counts.{k}": n for k, n in counts.items()}},
+                upsert=True,
+            ),
+        )
+
+    async def query(
+        self,
+        resolution: Resolution,
+        start: dt,
+        end: dt,
+        *,
+        repo_owner: str | None = None,
+        repo_name: str | None = None,
+    ) -> list[RollupBucket]:
+        """Obtain the activity in '[start, end)', oldest first.
+
+        Buckets not downsampled yet are summed into the requested resolution.
+        Coarser buckets are not split, so a resolution past its retention
+        returns no activity.
+        """
+        finer = RESOLUTIONS[: RESOLUTIONS.index(resolution) + 1]
+        query: dict[str, Any] = {
+            "resolution": {"$in": finer},
+            "start": {
+                "$gte": bucket_start(start, resolution),
+                "$lt": naive_utc(end),
+            },
+        }
+        if repo_owner is not None:
+            query["repo_owner"] = repo_owner
+        if repo_name is not None:
+            query["repo_name"] = repo_name
+
+        buckets: dict[dt, dict[str, int]] = {}
+        async for doc in self._get_coll().find(query, {"start": 1, "counts": 1}):
+            counts = buckets.setdefault(bucket_start(doc["start"], resolution), {})
+            for k, n in doc.get("counts", {}).items():
+                counts[k] = counts.get(k, 0) + n
+
+        return [
+            RollupBucket(start=s, counts=c)
+            for s, c in sorted(buckets.items())
+            if any(n != 0 for n in c.values())
+        ]
+
+    async def downsample(self) -> int:
+        """Apply retention, returning the number of buckets downsampled."""
+        now = dt.utcnow()
+        total = 0
+        for finer, coarser in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+            retention = self._retention[finer]
+            assert retention is not None
+            # only whole coarse buckets, none of their finer ones are still live.
+            cutoff = bucket_start(now - retention, coarser)
+            total += await self._downsample(finer, coarser, cutoff)
+
+        retention = self._retention["day"]
+        if retention is not None:
+            res = await self._get_coll().delete_many(
+                {"resolution": "day", "start": {"$lt": now - retention}}
+            )
+            if res.deleted_count > 0:
+                logger.debug(f"Expired {res.deleted_count} day buckets")
+        return total
+
+    async def _downsample(
+        self, finer: Resolution, coarser: Resolution, cutoff: dt
+    ) -> int:
+        coll = self._get_coll()
+        docs: list[dict[str, Any]] = await coll.find(
+            {"resolution": finer, "start": {"$lt": cutoff}}
+        ).to_list(None)
+        if len(docs) == 0:
+            return 0
+
+        # coarse buckets track what was merged into them; merging a bucket
+        # twice fails on the unique index, and is skipped.
+        ops = [
+            UpdateOne(
+                {
+                    "repo_owner": d["repo_owner"],
+                    "repo_name": d["repo_name"],
+                    "resolution": coarser,
+                    "start": bucket_start(d["start"], coarser),
+                    "merged": {"$ne": d["start"]},
+                },
+                {
+                    "$inc": {f"counts.{k}": n for k, n in d.get("counts", {}).items()},
+                    "$push": {"merged": d["start"]},
+                },
+                upsert=True,
+            )
+            for d in docs
+        ]
+        try:
+            await coll.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            errors: list[dict[str, Any]] = e.details.get("writeErrors", [])
+            if any(err.get("code") != _DUPLICATE_KEY for err in errors):
+                raise
+
+        await coll.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        logger.debug(f"Downsampled {len(docs)} {finer} buckets of '{self._db.name}'")
+        return len(docs)
+
+    def _resolution_for(self, start: dt) -> Resolution | None:
+        """Obtain the finest resolution still kept for a bucket, if any."""
+        age = dt.utcnow() - start
+        for resolution in RESOLUTIONS:
+            retention = self._retention[resolution]
+            if retention is None or age < retention:
+                return resolution
+        return None
+
+    def _get_coll(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        return self._db.get_collection(COLL_ROLLUPS)
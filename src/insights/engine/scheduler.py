@@ -0,0 +1,213 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, TypeVar
+
+import githubkit as ghk
+import httpx
+from fastapi.logger import logger
+from githubkit.exception import RequestFailed
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+# fallback wait when GitHub throttles us without saying for how long.
+_DEFAULT_BACKOFF = 60.0
+
+
+class Priority(IntEnum):
+    LIVE = 0
+    BACKFILL = 1
+
+
+class _Budget:
+    remaining: int | None
+    reset_at: float | None
+    blocked_until: float
+
+    def __init__(self) -> None:
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+
+
+class SchedulerStats(BaseModel):
+    in_flight: int
+    queued: dict[str, int]
+    blocked_installations: int
+    throttled: int
+    retries: int
+    budgets: dict[int, int | None]
+
+
+class RequestScheduler:
+    """Schedule outbound GitHub requests within each installation's rate limit.
+
+    Requests run under a global concurrency cap, and are admitted by priority,
+    so live webhook follow-ups go ahead of backfill work. Each installation's
+    remaining budget is tracked from the 'X-RateLimit-*' response headers;
+    backfill work waits for the reset once the budget drops below a reserve
+    kept for live requests. Requests rejected with 403/429 are retried after
+    'Retry-After', or the rate limit reset, blocking the installation meanwhile.
+    """
+
+    _max_concurrency: int
+    _max_retries: int
+    _backfill_reserve: int
+    _in_flight: int
+    _waiters: list[tuple[int, int, asyncio.Future[None]]]
+    _seq: "itertools.count[int]"
+    _budgets: dict[int, _Budget]
+    _throttled: int
+    _retries: int
+
+    def __init__(
+        self, *, max_concurrency: int, max_retries: int, backfill_reserve: int
+    ) -> None:
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._backfill_reserve = backfill_reserve
+        self._in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._budgets = {}
+        self._throttled = 0
+        self._retries = 0
+
+    @property
+    def stats(self) -> SchedulerStats:
+        now = time.time()
+        queued = {p.name.lower(): 0 for p in Priority}
+        for prio, _, fut in self._waiters:
+            if not fut.done():
+                queued[Priority(prio).name.lower()] += 1
+
+        return SchedulerStats(
+            in_flight=self._in_flight,
+            queued=queued,
+            blocked_installations=sum(
+                1 for b in self._budgets.values() if b.blocked_until > now
+            ),
+            throttled=self._throttled,
+            retries=self._retries,
+            budgets={i: b.remaining for i, b in self._budgets.items()},
+        )
+
+    async def call(
+        self,
+        installation_id: int,
+        fn: Callable[[], Awaitable[T]],
+        *,
+        priority: Priority = Priority.LIVE,
+    ) -> T:
+        budget = self._budgets.setdefault(installation_id, _Budget())
+
+        attempt = 0
+        while True:
+            await self._wait_for_budget(budget, priority)
+            await self._acquire(priority)
+            try:
+                res = await fn()
+            except RequestFailed as e:
+                failed: ghk.Response[Any] = e.response
+                wait = self._update_budget(budget, failed.headers)
+                if (
+                    failed.status_code not in (403, 429)
+                    or wait is None
+                    or attempt >= self._max_retries
+                ):
+                    raise
+
+                self._throttled += 1
+                self._retries += 1
+                attempt += 1
+                budget.blocked_until = time.time() + wait
+                logger.warning(
+                    f"Installation {installation_id} rate limited, "
+                    f"retrying in {wait:.0f}s (attempt {attempt})"
+                )
+                continue
+            finally:
+                self._release()
+
+            headers: httpx.Headers | None = getattr(res, "headers", None)
+            if isinstance(headers, httpx.Headers):
+                self._update_budget(budget, headers)
+            return res
+
+    async def _wait_for_budget(self, budget: _Budget, priority: Priority) -> None:
+        now = time.time()
+        until = budget.blocked_until
+        if (
+            budget.remaining is not None
+            and budget.reset_at is not None
+            and budget.reset_at > now
+        ):
+            reserve = self._backfill_reserve if priority == Priority.BACKFILL else 0
+            if budget.remaining <= reserve:
+                until = max(until, budget.reset_at)
+
+        if until > now:
+            await asyncio.sleep(until - now)
+
+    def _update_budget(self, budget: _Budget, headers: httpx.Headers) -> float | None:
+        """Update the budget from response headers, returning the backoff if any."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            try:
+                budget.remaining = int(remaining)
+                budget.reset_at = float(reset)
+            except ValueError:
+                pass
+
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return _DEFAULT_BACKOFF
+
+        if budget.remaining == 0 and budget.reset_at is not None:
+            return max(0.0, budget.reset_at - time.time())
+
+        # secondary rate limits may come without any hints.
+        return _DEFAULT_BACKOFF if remaining is None else None
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self._in_flight < self._max_concurrency and len(self._waiters) == 0:
+            self._in_flight += 1
+            return
+
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        waiter = (int(priority), next(self._seq), fut)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # we were handed a slot, pass it on.
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self) -> None:
+        while len(self._waiters) > 0:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                # hand our slot over to the next waiter
+                fut.set_result(None)
+                return
+        self._in_flight -= 1
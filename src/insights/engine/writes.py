@@ -0,0 +1,230 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from typing import Any
+
+import motor.motor_asyncio
+from fastapi.logger import logger
+from pydantic import BaseModel
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    WriteConcernError,
+)
+from pymongo.write_concern import WriteConcern
+
+from insights.config import WritesConfigModel
+
+WriteOp = InsertOne[Any] | UpdateOne | UpdateMany | DeleteOne | DeleteMany
+
+_DUPLICATE_KEY = 11000
+
+
+class WriteResult:
+    upserted_id: Any
+
+    def __init__(self, upserted_id: Any = None) -> None:
+        self.upserted_id = upserted_id
+
+
+class WritePipelineStats(BaseModel):
+    pending: int
+    batches: int
+    writes: int
+    errors: int
+
+
+class _Pending:
+    ops: list[WriteOp]
+    futures: list[asyncio.Future[WriteResult]]
+    timer: asyncio.TimerHandle | None
+
+    def __init__(self) -> None:
+        self.ops = []
+        self.futures = []
+        self.timer = None
+
+
+class WritePipeline:
+    """Coalesce an installation's writes into ordered bulk writes.
+
+    Writes are queued per collection, and flushed as a single 'bulk_write'
+    once 'max_batch' are pending or 'max_delay' seconds after the first of
+    them. Each write has its own future, completed when its batch has been
+    acknowledged with the configured write concern; failures of individual
+    writes are raised from their own future only, and writes applied without
+    satisfying the write concern fail with a 'WriteConcernError'.
+
+    Writes to a collection are applied in the order queued, as not all of
+    them are guarded by a version, e.g., counter increments and tombstones:
+    batches are written in order, one at a time, and a failed write only
+    stops its batch until the writes after it are resubmitted.
+    """
+
+    _db: motor.motor_asyncio.AsyncIOMotorDatabase
+    _max_batch: int
+    _max_delay: float
+    _write_concern: WriteConcern
+    _pending: dict[str, _Pending]
+    _flushes: set[asyncio.Task[None]]
+    # the last batch flushed, by collection
+    _last_flush: dict[str, asyncio.Task[None]]
+
+    _batches: int
+    _writes: int
+    _errors: int
+
+    def __init__(
+        self, db: motor.motor_asyncio.AsyncIOMotorDatabase, config: WritesConfigModel
+    ) -> None:
+        self._db = db
+        self._max_batch = config.max_batch
+        self._max_delay = config.max_delay
+        self._write_concern = WriteConcern(w=config.w, j=config.journal)
+        self._pending = {}
+        self._flushes = set()
+        self._last_flush = {}
+        self._batches = 0
+        self._writes = 0
+        self._errors = 0
+
+    @property
+    def stats(self) -> WritePipelineStats:
+        return WritePipelineStats(
+            pending=sum(len(p.ops) for p in self._pending.values()),
+            batches=self._batches,
+            writes=self._writes,
+            errors=self._errors,
+        )
+
+    def write(self, collection: str, op: WriteOp) -> asyncio.Future[WriteResult]:
+        """Queue a write, returning a future completed once it is written."""
+        loop = asyncio.get_running_loop()
+        pending = self._pending.setdefault(collection, _Pending())
+        fut: asyncio.Future[WriteResult] = loop.create_future()
+        pending.ops.append(op)
+        pending.futures.append(fut)
+
+        if len(pending.ops) >= self._max_batch:
+            self._flush(collection)
+        elif pending.timer is None:
+            pending.timer = loop.call_later(self._max_delay, self._flush, collection)
+        return fut
+
+    async def close(self) -> None:
+        """Flush all pending writes, and wait for them to complete."""
+        for collection in list(self._pending.keys()):
+            self._flush(collection)
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush(self, collection: str) -> None:
+        pending = self._pending.pop(collection, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+
+        # keep a reference, so the task isn't collected while running.
+        task = asyncio.create_task(
+            self._write_batch(collection, pending, self._last_flush.get(collection))
+        )
+        self._flushes.add(task)
+        self._last_flush[collection] = task
+        task.add_done_callback(self._flushes.discard)
+        task.add_done_callback(lambda t: self._flush_done(collection, t))
+
+    def _flush_done(self, collection: str, task: asyncio.Task[None]) -> None:
+        if self._last_flush.get(collection) is task:
+            del self._last_flush[collection]
+
+    async def _write_batch(
+        self,
+        collection: str,
+        pending: _Pending,
+        previous: asyncio.Task[None] | None,
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        coll = self._db.get_collection(collection, write_concern=self._write_concern)
+        self._batches += 1
+        self._writes += len(pending.ops)
+
+        failed: dict[int, Exception] = {}
+        upserted: dict[int, Any] = {}
+        start = 0
+        while start < len(pending.ops):
+            try:
+                res = await coll.bulk_write(pending.ops[start:], ordered=True)
+                upserted.update(
+                    {start + i: id for i, id in (res.upserted_ids or {}).items()}
+                )
+                break
+            except BulkWriteError as e:
+                upserted.update(
+                    {
+                        start + u["index"]: u["_id"]
+                        for u in e.details.get("upserted", [])
+                    }
+                )
+                errors: list[dict[str, Any]] = e.details.get("writeErrors", [])
+                # an ordered write stops at its first error.
+                end = (
+                    start + errors[0]["index"] if len(errors) > 0 else len(pending.ops)
+                )
+
+                wc_errors: list[dict[str, Any]] = e.details.get(
+                    "writeConcernErrors", []
+                )
+                if len(wc_errors) > 0 and end > start:
+                    wc_err = wc_errors[0]
+                    logger.error(
+                        f"Write concern not satisfied for {end - start} ops to "
+                        f"'{collection}' of '{self._db.name}': "
+                        f"{wc_err.get('errmsg', '')}"
+                    )
+                    failed.update(
+                        {
+                            i: WriteConcernError(
+                                wc_err.get("errmsg", ""), wc_err.get("code"), wc_err
+                            )
+                            for i in range(start, end)
+                        }
+                    )
+
+                if len(errors) == 0:
+                    break
+                err = errors[0]
+                code: int | None = err.get("code")
+                exc_type = (
+                    DuplicateKeyError if code == _DUPLICATE_KEY else OperationFailure
+                )
+                failed[end] = exc_type(err.get("errmsg", ""), code, err)
+                start = end + 1
+            except Exception as e:
+                logger.error(
+                    f"Unable to write {len(pending.ops) - start} ops to "
+                    f"'{collection}' of '{self._db.name}': {str(e)}"
+                )
+                failed.update({i: e for i in range(start, len(pending.ops))})
+                break
+
+        self._errors += len(failed)
+        for i, fut in enumerate(pending.futures):
+            if fut.done():
+                continue
+            exc = failed.get(i)
+            if exc is not None:
+                fut.set_exception(exc)
+                # avoid warnings about an unretrieved exception if nobody waited.
+                fut.exception()
+            else:
+                fut.set_result(WriteResult(upserted.get(i)))
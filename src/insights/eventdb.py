@@ -9,14 +9,16 @@
 import json
 from datetime import datetime as dt
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Iterator, Literal
 
 import githubkit as ghk
-from fastapi import Request
 from fastapi.logger import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 
 from insights.config import Config, EventDBConfigModel
+from insights.logwriter import LogWriter, LogWriterStats, RawJSON
+from insights.segmentlog import SegmentLog, list_segments, read_segment
+from insights.webhook import WebhookEnvelope
 
 
 class _LogEntry(BaseModel):
@@ -25,12 +27,32 @@ class _LogEntry(BaseModel):
 
 
 _EventType = Literal["webhook", "rest"]
+_LogType = Literal["event", "error"]
+
+
+class EventRecord(BaseModel):
+    """A single event, as stored in the event database."""
+
+    ts: dt | None = Field(default=None)
+    event_name: str
+    event: dict[str, Any]
+    msg: str | None = Field(default=None)
+
+
+def _is_json(data: bytes) -> bool:
+    try:
+        json.loads(data)
+    except ValueError:
+        return False
+    return True
 
 
 class EventDB:
     _config: EventDBConfigModel | None
     _path: Path | None
     _event_type: dict[_EventType, _LogEntry]
+    _logs: dict[tuple[_EventType, _LogType], SegmentLog]
+    _writer: LogWriter | None
 
     def __init__(self, config: Config) -> None:
         self._config = config.eventdb
@@ -45,6 +67,15 @@ class EventDB:
                 error=self._log_rest_errors,
             ),
         }
+        self._logs = {}
+        self._writer = None
+        if self._config is not None:
+            self._writer = LogWriter(
+                durability=self._config.durability,
+                flush_batch=self._config.flush_batch,
+                flush_interval=self._config.flush_interval,
+                max_queue_size=self._config.max_queue_size,
+            )
 
     @property
     def _log_webhook(self) -> bool:
@@ -62,7 +93,7 @@ class EventDB:
     def _log_rest_errors(self) -> bool:
         return self._config is not None and self._config.log_rest_errors
 
-    def _get_event_path(self, event_type: _EventType, is_error: bool) -> Path | None:
+    def _get_log(self, event_type: _EventType, is_error: bool) -> SegmentLog | None:
         if self._config is None:
             return None
 
@@ -76,51 +107,70 @@ class EventDB:
         ):
             return None
 
-        log_type = "error" if is_error else "event"
+        log_type: _LogType = "error" if is_error else "event"
+
+        log = self._logs.get((event_type, log_type))
+        if log is None:
+            log = SegmentLog(
+                self._config.path.joinpath(event_type, log_type),
+                f"{event_type}-{log_type}",
+                max_bytes=self._config.segment_max_bytes,
+                compression=self._config.compression,
+            )
+            self._logs[(event_type, log_type)] = log
+
+        return log
+
+    @property
+    def stats(self) -> LogWriterStats | None:
+        return self._writer.stats if self._writer is not None else None
 
-        path = self._config.path.joinpath(event_type, log_type)
-        if not path.exists():
-            path.mkdir(parents=True)
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.stop()
+        for log in self._logs.values():
+            log.close()
 
-        event_dt = dt.utcnow().isoformat()
-        filename = f"{event_type}-{log_type}-{event_dt}.json"
-        return path.joinpath(filename)
+    def _write(self, log: SegmentLog, entry: dict[str, Any]) -> bool:
+        assert self._writer is not None
+        return self._writer.put(log, entry)
 
     async def _log_webhook_event(
         self,
-        request: Request,
+        envelope: WebhookEnvelope,
         *,
         is_error: bool,
         msg: str | None = None,
     ) -> None:
-        event_file = self._get_event_path("webhook", is_error)
-        if event_file is None:
+        log = self._get_log("webhook", is_error)
+        if log is None:
             return
 
-        event_name: str | None = request.headers.get("X-GitHub-Event")
-        if event_name is None:
-            logger.error("Can't log non-event")
-            return
+        payload: Any = RawJSON(envelope.body)
+        if is_error and not _is_json(envelope.body):
+            # keep whatever we got, without breaking the record
+            payload = envelope.body.decode("utf-8", errors="replace")
 
-        event_body = await request.json()
-        headers_lst = request.headers.items()
         event_entry: dict[str, Any] = {
-            "event_name": event_name,
-            "event": {"headers": headers_lst, "payload": event_body},
+            "ts": dt.utcnow().isoformat(),
+            "event_name": envelope.event_name,
+            "event": {"headers": envelope.headers, "payload": payload},
             "msg": msg,
         }
 
-        with event_file.open("+w") as fp:
-            json.dump(event_entry, fp, indent=2)
-
-        error_event = "error " if is_error else ""
-        logger.debug(f"Wrote {error_event}event type '{event_name}' to eventdb")
+        if self._write(log, event_entry):
+            error_event = "error " if is_error else ""
+            logger.debug(
+                f"Queued {error_event}event type '{envelope.event_name}' to eventdb"
+            )
 
-    async def webhook(self, request: Request) -> None:
-        await self._log_webhook_event(request, is_error=False, msg=None)
+    async def webhook(self, envelope: WebhookEnvelope) -> None:
+        await self._log_webhook_event(envelope, is_error=False, msg=None)
 
-    async def webhook_error(self, request: Request, msg: str | None = None) -> None:
-        await self._log_webhook_event(request, is_error=True, msg=msg)
+    async def webhook_error(
+        self, envelope: WebhookEnvelope, msg: str | None = None
+    ) -> None:
+        await self._log_webhook_event(envelope, is_error=True, msg=msg)
 
     async def _log_rest_event(
         self,
@@ -130,23 +180,22 @@ class EventDB:
         is_error: bool,
         msg: str | None = None,
     ) -> None:
-        event_file = self._get_event_path("rest", is_error)
-        if event_file is None:
+        log = self._get_log("rest", is_error)
+        if log is None:
             return
 
         event_body = response.json()
         headers_lst = list(response.headers.items())
         event_entry: dict[str, Any] = {
+            "ts": dt.utcnow().isoformat(),
             "event_name": call_name,
             "event": {"headers": headers_lst, "payload": event_body},
             "msg": msg,
         }
 
-        with event_file.open("+w") as fp:
-            json.dump(event_entry, fp, indent=2)
-
-        error_event = "error " if is_error else ""
-        logger.debug(f"Wrote {error_event}event type '{call_name}' to eventdb")
+        if self._write(log, event_entry):
+            error_event = "error " if is_error else ""
+            logger.debug(f"Queued {error_event}event type '{call_name}' to eventdb")
 
     async def rest(self, response: Any, *, call_name: str) -> None:
         await self._log_rest_event(
@@ -159,3 +208,45 @@ class EventDB:
         await self._log_rest_event(
             response, call_name=call_name, is_error=True, msg=msg
         )
+
+
+def _read_legacy_events(path: Path, prefix: str) -> Iterator[EventRecord]:
+    """Read events stored in the former one-file-per-event format."""
+    for event_file in sorted(path.glob(f"{prefix}-*.json")):
+        try:
+            with event_file.open() as fp:
+                record = EventRecord.model_validate(json.load(fp))
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"Unable to read event file '{event_file}': {str(e)}")
+            continue
+
+        if record.ts is None:
+            # legacy file names carry the event timestamp
+            ts_str = event_file.stem.removeprefix(f"{prefix}-")
+            try:
+                record.ts = dt.fromisoformat(ts_str)
+            except ValueError:
+                pass
+        yield record
+
+
+def read_events(
+    path: Path, event_type: _EventType, *, is_error: bool = False
+) -> Iterator[EventRecord]:
+    """Stream events from an event database, oldest first.
+
+    Events in the former one-file-per-event format are read before those in
+    segments, so existing databases can be read back and migrated.
+    """
+    log_type: _LogType = "error" if is_error else "event"
+    prefix = f"{event_type}-{log_type}"
+    log_path = path.joinpath(event_type, log_type)
+
+    yield from _read_legacy_events(log_path, prefix)
+
+    for _, segment in list_segments(log_path, prefix):
+        for line in read_segment(segment):
+            try:
+                yield EventRecord.model_validate_json(line)
+            except ValidationError as e:
+                logger.error(f"Bad record in segment '{segment}': {str(e)}")
@@ -0,0 +1,208 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import json
+import queue
+import threading
+import time
+from typing import Any, Literal
+
+from fastapi.logger import logger
+from pydantic import BaseModel
+
+from insights.segmentlog import SegmentLog
+
+Durability = Literal["none", "batch", "record"]
+
+_QueueItem = tuple[SegmentLog, dict[str, Any]] | None
+
+
+class LogWriterStats(BaseModel):
+    queue_depth: int
+    written: int
+    dropped: int
+    errors: int
+    write_latency_avg_ms: float
+    write_latency_max_ms: float
+
+
+class RawJSON(bytes):
+    """Already encoded JSON, to be written verbatim into a record."""
+
+    pass
+
+
+_RAW_MARKER = "\x00raw\x00"
+_RAW_MARKER_JSON = json.dumps(_RAW_MARKER).encode("utf-8")
+
+
+def encode_record(record: dict[str, Any]) -> bytes:
+    raw_values: list[bytes] = []
+
+    def _default(obj: Any) -> Any:
+        if isinstance(obj, RawJSON):
+            # JSON whitespace may contain newlines, which a record can't hold;
+            # newlines within JSON strings are always escaped.
+            raw_values.append(obj.replace(b"\n", b" "))
+            return _RAW_MARKER
+        return str(obj)
+
+    encoded = json.dumps(record, separators=(",", ":"), default=_default)
+    data = encoded.encode("utf-8")
+    if len(raw_values) == 0:
+        return data
+
+    parts = data.split(_RAW_MARKER_JSON)
+    assert len(parts) == len(raw_values) + 1
+    out = [parts[0]]
+    for raw, part in zip(raw_values, parts[1:]):
+        out += [raw, part]
+    return b"".join(out)
+
+
+class LogWriter:
+    """Writes records to segment logs from a dedicated thread.
+
+    Records are queued by callers and serialized and written off the event loop.
+    Depending on durability, the writer fsyncs after every record ('record'),
+    after each batch ('batch'), or leaves syncing to the OS ('none'). Batches are
+    bounded by 'flush_batch' records and 'flush_interval' seconds.
+    """
+
+    _durability: Durability
+    _flush_batch: int
+    _flush_interval: float
+    _queue: queue.Queue[_QueueItem]
+    _thread: threading.Thread
+    _dirty: set[SegmentLog]
+    _pending: int
+    _last_flush: float
+
+    _written: int
+    _dropped: int
+    _errors: int
+    _latency_total: float
+    _latency_max: float
+
+    def __init__(
+        self,
+        *,
+        durability: Durability,
+        flush_batch: int,
+        flush_interval: float,
+        max_queue_size: int,
+    ) -> None:
+        self._durability = durability
+        self._flush_batch = flush_batch
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="eventdb-writer", daemon=True
+        )
+        self._dirty = set()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+        self._written = 0
+        self._dropped = 0
+        self._errors = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+        self._thread.start()
+
+    @property
+    def stats(self) -> LogWriterStats:
+        avg = 0.0 if self._written == 0 else self._latency_total / self._written
+        return LogWriterStats(
+            queue_depth=self._queue.qsize(),
+            written=self._written,
+            dropped=self._dropped,
+            errors=self._errors,
+            write_latency_avg_ms=avg * 1000,
+            write_latency_max_ms=self._latency_max * 1000,
+        )
+
+    def put(self, log: SegmentLog, record: dict[str, Any]) -> bool:
+        """Queue a record for writing, returning False if it had to be dropped."""
+        if not self._thread.is_alive():
+            self._dropped += 1
+            return False
+
+        try:
+            self._queue.put_nowait((log, record))
+        except queue.Full:
+            self._dropped += 1
+            logger.warning(f"EventDB writer queue full, dropped {self._dropped}")
+            return False
+        return True
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Write out all queued records and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            timeout = max(
+                0.0, self._last_flush + self._flush_interval - time.monotonic()
+            )
+            try:
+                item = self._queue.get(timeout=timeout if self._pending > 0 else None)
+            except queue.Empty:
+                self._flush()
+                continue
+
+            if item is None:
+                self._flush()
+                return
+
+            log, record = item
+            self._write(log, record)
+
+            if (
+                self._pending >= self._flush_batch
+                or time.monotonic() - self._last_flush >= self._flush_interval
+            ):
+                self._flush()
+
+    def _write(self, log: SegmentLog, record: dict[str, Any]) -> None:
+        start = time.monotonic()
+        try:
+            log.append(encode_record(record))
+            if self._durability == "record":
+                log.sync()
+            else:
+                self._dirty.add(log)
+                self._pending += 1
+        except Exception as e:
+            self._errors += 1
+            logger.error(f"Unable to write record to '{log.path}': {str(e)}")
+            return
+
+        latency = time.monotonic() - start
+        self._written += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+
+    def _flush(self) -> None:
+        for log in self._dirty:
+            try:
+                if self._durability == "batch":
+                    log.sync()
+                else:
+                    log.flush()
+            except OSError as e:
+                self._errors += 1
+                logger.error(f"Unable to flush '{log.path}': {str(e)}")
+
+        self._dirty.clear()
+        self._pending = 0
+        self._last_flush = time.monotonic()
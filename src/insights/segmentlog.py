@@ -0,0 +1,216 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import gzip
+import io
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import IO, Any, Iterator, Literal
+
+from fastapi.logger import logger
+
+from insights.error import InsightsError
+
+Compression = Literal["none", "gzip", "zstd"]
+
+_SEGMENT_SUFFIX = ".jsonl"
+_COMPRESSED_SUFFIX: dict[Compression, str] = {"gzip": ".gz", "zstd": ".zst"}
+# read backwards when looking for a partially written record.
+_TAIL_CHUNK = 64 * 1024
+
+
+class SegmentLogError(InsightsError):
+    def __init__(self, msg: str | None = None) -> None:
+        super().__init__(f"Segment Log Error: {msg}")
+
+
+def _zstd() -> Any:
+    try:
+        import zstandard  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        raise SegmentLogError("zstd compression requires the 'zstandard' package")
+    return zstandard  # pyright: ignore[reportUnknownVariableType]
+
+
+def _segment_re(prefix: str) -> re.Pattern[str]:
+    return re.compile(rf"^{re.escape(prefix)}-(\d+)\.jsonl(\.gz|\.zst)?$")
+
+
+def _segment_name(prefix: str, seq: int) -> str:
+    return f"{prefix}-{seq:010d}{_SEGMENT_SUFFIX}"
+
+
+def list_segments(path: Path, prefix: str) -> list[tuple[int, Path]]:
+    """Obtain the segments for a given prefix, sorted by sequence number."""
+    if not path.is_dir():
+        return []
+
+    segment_re = _segment_re(prefix)
+    segments: list[tuple[int, Path]] = []
+    for entry in path.iterdir():
+        m = segment_re.match(entry.name)
+        if m is not None:
+            segments.append((int(m.group(1)), entry))
+
+    return sorted(segments)
+
+
+def _open_segment(segment: Path) -> io.BufferedIOBase:
+    if segment.suffix == ".gz":
+        return gzip.open(segment, "rb")
+    elif segment.suffix == ".zst":
+        fp = segment.open("rb")
+        return io.BufferedReader(_zstd().ZstdDecompressor().stream_reader(fp))
+    return segment.open("rb")
+
+
+def _complete_size(fp: IO[bytes]) -> int:
+    """Obtain the size of a segment's records, up to its last newline."""
+    end = fp.seek(0, os.SEEK_END)
+    pos = end
+    while pos > 0:
+        start = max(0, pos - _TAIL_CHUNK)
+        fp.seek(start)
+        chunk = fp.read(pos - start)
+        nl = chunk.rfind(b"\n")
+        if nl >= 0:
+            return start + nl + 1
+        pos = start
+    return 0
+
+
+def read_segment(segment: Path) -> Iterator[bytes]:
+    """Stream the records in a segment, as raw JSON lines."""
+    with _open_segment(segment) as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                # partially written record at the tail of an active segment.
+                break
+            yield line.rstrip(b"\n")
+
+
+class SegmentLog:
+    """Append-only log of JSON lines, split into size-bounded segments.
+
+    Records are appended to the active segment until it reaches 'max_bytes', at
+    which point it is sealed, and optionally compressed, and a new segment with
+    the next sequence number is started.
+    """
+
+    _path: Path
+    _prefix: str
+    _max_bytes: int
+    _compression: Compression
+    _seq: int
+    _size: int
+    _fp: IO[bytes] | None
+
+    def __init__(
+        self,
+        path: Path,
+        prefix: str,
+        *,
+        max_bytes: int,
+        compression: Compression = "none",
+    ) -> None:
+        if compression == "zstd":
+            _zstd()  # fail early if unavailable
+
+        self._path = path
+        self._prefix = prefix
+        self._max_bytes = max_bytes
+        self._compression = compression
+        self._seq = 0
+        self._size = 0
+        self._fp = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _open(self) -> IO[bytes]:
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        segments = list_segments(self._path, self._prefix)
+        if len(segments) > 0:
+            seq, last = segments[-1]
+            if last.suffix == _SEGMENT_SUFFIX and last.stat().st_size < self._max_bytes:
+                # continue the previous active segment
+                self._seq = seq
+            else:
+                self._seq = seq + 1
+
+        segment = self._path.joinpath(_segment_name(self._prefix, self._seq))
+        fp = segment.open("a+b")
+        # drop a record partially written before a crash, lest the next one be
+        # appended to it.
+        size = _complete_size(fp)
+        if size < fp.seek(0, os.SEEK_END):
+            logger.warning(f"Dropping partially written record in '{segment}'")
+            fp.truncate(size)
+        self._size = size
+        return fp
+
+    def append(self, record: bytes) -> None:
+        """Append a single JSON record, which must not contain newlines."""
+        if self._fp is None:
+            self._fp = self._open()
+
+        self._fp.write(record + b"\n")
+        self._size += len(record) + 1
+
+        if self._size >= self._max_bytes:
+            self._rotate()
+
+    def flush(self) -> None:
+        if self._fp is not None:
+            self._fp.flush()
+
+    def sync(self) -> None:
+        """Flush the active segment and make it durable on disk."""
+        if self._fp is not None:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _rotate(self) -> None:
+        assert self._fp is not None
+        self.sync()
+        self._fp.close()
+        self._fp = None
+
+        sealed = self._path.joinpath(_segment_name(self._prefix, self._seq))
+        self._seal(sealed)
+
+        self._seq += 1
+        self._size = 0
+
+    def _seal(self, segment: Path) -> None:
+        if self._compression == "none":
+            return
+
+        target = segment.with_name(segment.name + _COMPRESSED_SUFFIX[self._compression])
+        tmp = target.with_name(target.name + ".tmp")
+        try:
+            with segment.open("rb") as src, tmp.open("wb") as dst:
+                if self._compression == "gzip":
+                    with gzip.GzipFile(fileobj=dst, mode="wb") as gz:
+                        shutil.copyfileobj(src, gz)
+                else:
+                    _zstd().ZstdCompressor().copy_stream(src, dst)
+            tmp.rename(target)
+            segment.unlink()
+        except OSError as e:
+            logger.error(f"Unable to compress segment '{segment}': {str(e)}")
+            tmp.unlink(missing_ok=True)
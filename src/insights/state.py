@@ -14,8 +14,10 @@ from insights.config import Config, ConfigError
 from insights.engine.db_client import DBClient
 from insights.engine.db_types import DBError
 from insights.engine.github import Github, InvalidPrivateKeyError
+from insights.engine.ingest import IngestQueue
 from insights.engine.insights import Insights
 from insights.error import InsightsError
+from insights.webhook import WebhookVerifier
 
 
 class GlobalState:
@@ -23,6 +25,8 @@ class GlobalState:
     github: Github | None
     dbc: DBClient | None
     insights: Insights | None
+    ingest: IngestQueue | None
+    verifier: WebhookVerifier | None
 
     inited: bool
 
@@ -31,6 +35,8 @@ class GlobalState:
         self.github = None
         self.dbc = None
         self.insights = None
+        self.ingest = None
+        self.verifier = None
         self.inited = False
 
     async def init(self) -> None:
@@ -71,8 +77,28 @@ class GlobalState:
             raise InsightsError("Unable to setup insights core")
             # sys.exit(signal.SIGILL)
 
+        ingest: IngestQueue | None = None
+        if cfg.ingest.mode == "queue":
+            ingest = IngestQueue(cfg.ingest, insights)
+            ingest.start()
+
         self.config = cfg
         self.github = gh
         self.dbc = dbc
         self.insights = insights
+        self.ingest = ingest
+        self.verifier = WebhookVerifier(
+            cfg.github.webhook_secret, cfg.github.webhook_secret_previous
+        )
         self.inited = True
+
+    async def shutdown(self) -> None:
+        if self.ingest is not None:
+            await self.ingest.drain()
+            self.ingest = None
+
+        if self.insights is not None:
+            await self.insights.shutdown()
+
+        if self.github is not None:
+            await self.github.close()
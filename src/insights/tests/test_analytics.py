@@ -0,0 +1,204 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import math
+from typing import Any
+
+from insights.engine.analytics import _match  # pyright: ignore[reportPrivateUsage]
+from insights.engine.analytics import (
+    distributions,
+    first_response_seconds,
+    label_dwell_seconds,
+    load_numpy,
+)
+
+np = load_numpy()
+
+_NAT = "NaT"
+
+
+def _strs(*values: str) -> Any:
+    return np.array(values, dtype=str)
+
+
+def _times(*seconds: float | str) -> Any:
+    """Times at an offset in seconds, or NaT."""
+    base = np.datetime64("2024-01-01T00:00:00", "ms")
+    return np.array(
+        [
+            np.datetime64(_NAT, "ms")
+            if s == _NAT
+            else base + np.timedelta64(int(s), "s")
+            for s in seconds
+        ],
+        dtype="datetime64[ms]",
+    )
+
+
+def _list(values: Any) -> list[float | None]:
+    return [None if math.isnan(v) else float(v) for v in values]
+
+
+def test_match() -> None:
+    ids = _strs("c", "a", "b")
+    idx, found = _match(np, ids, _strs("a", "b", "c", "c"))
+    assert found.tolist() == [True, True, True, True]
+    assert ids[idx].tolist() == ["a", "b", "c", "c"]
+
+
+def test_match_unmatched() -> None:
+    ids = _strs("b", "d")
+    idx, found = _match(np, ids, _strs("a", "c", "e", "d"))
+    assert found.tolist() == [False, False, False, True]
+    # indexes of keys not found still index 'ids'.
+    assert all(0 <= i < len(ids) for i in idx)
+    assert ids[idx[3]] == "d"
+
+
+def test_match_empty() -> None:
+    idx, found = _match(np, _strs(), _strs("a", "b"))
+    assert idx.tolist() == [0, 0]
+    assert found.tolist() == [False, False]
+
+    idx, found = _match(np, _strs("a"), _strs())
+    assert len(idx) == 0 and len(found) == 0
+
+
+def test_first_response() -> None:
+    values = first_response_seconds(
+        np,
+        _strs("i1", "i2", "i3"),
+        _times(0, 100, 0),
+        _strs("alice", "bob", "carol"),
+        _strs("i1", "i1", "i1", "i2", "i2"),
+        _times(1, 30, 20, 160, 130),
+        _strs("alice", "dave", "erin", "bob", "dave"),
+    )
+    # the author's own comments don't count, i3 had no comments.
+    assert _list(values) == [20.0, 30.0, None]
+
+
+def test_first_response_empty() -> None:
+    values = first_response_seconds(
+        np, _strs(), _times(), _strs(), _strs("i1"), _times(1), _strs("bob")
+    )
+    assert len(values) == 0
+
+    values = first_response_seconds(
+        np, _strs("i1"), _times(0), _strs("alice"), _strs(), _times(), _strs()
+    )
+    assert _list(values) == [None]
+
+
+def test_first_response_nat() -> None:
+    values = first_response_seconds(
+        np,
+        _strs("i1", "i2"),
+        _times(0, _NAT),
+        _strs("alice", "alice"),
+        _strs("i1", "i1", "i2"),
+        _times(_NAT, 50, 10),
+        _strs("bob", "bob", "bob"),
+    )
+    # comments without a time are skipped, as are issues without one.
+    assert _list(values) == [50.0, None]
+
+
+def test_first_response_unmatched() -> None:
+    values = first_response_seconds(
+        np,
+        _strs("i2", "i4"),
+        _times(0, 0),
+        _strs("alice", "alice"),
+        _strs("i1", "i3", "i5", "i4"),
+        _times(1, 2, 3, 40),
+        _strs("bob", "bob", "bob", "bob"),
+    )
+    assert _list(values) == [None, 40.0]
+
+
+def test_label_dwell() -> None:
+    values, labels, issue_ids = label_dwell_seconds(
+        np,
+        _strs("i1", "i1", "i2", "i1", "i2", "i1", "i2"),
+        _strs("bug", "bug", "bug", "ui", "bug", "bug", "ui"),
+        _strs(
+            "labeled",
+            "unlabeled",
+            "labeled",
+            "labeled",
+            "unlabeled",
+            "labeled",
+            "unlabeled",
+        ),
+        _times(0, 10, 0, 5, 25, 60, 1),
+    )
+    # 'ui' is still on i1, and was removed from i2 without having been added.
+    assert _list(values) == [10.0, 25.0]
+    assert labels.tolist() == ["bug", "bug"]
+    assert issue_ids.tolist() == ["i1", "i2"]
+
+
+def test_label_dwell_empty() -> None:
+    values, labels, issue_ids = label_dwell_seconds(
+        np, _strs(), _strs(), _strs(), _times()
+    )
+    assert len(values) == 0 and len(labels) == 0 and len(issue_ids) == 0
+
+
+def test_label_dwell_nat() -> None:
+    values, labels, _ = label_dwell_seconds(
+        np,
+        _strs("i1", "i1"),
+        _strs("bug", "bug"),
+        _strs("labeled", "unlabeled"),
+        _times(0, _NAT),
+    )
+    assert _list(values) == [None]
+    assert labels.tolist() == ["bug"]
+
+
+def test_distributions() -> None:
+    res = distributions(
+        np,
+        np.array([30.0, 10.0, 20.0, 40.0]),
+        percentiles=[50],
+        edges=[0, 15, 35],
+    )
+    assert list(res.keys()) == ["all"]
+    d = res["all"]
+    assert d.count == 4
+    assert d.mean == 25.0
+    assert (d.min, d.max) == (10.0, 40.0)
+    assert d.percentiles == {"p50": 25.0}
+    assert d.histogram.edges == [0.0, 15.0, 35.0]
+    assert d.histogram.counts == [1, 2]
+    assert d.histogram.over == 1
+
+
+def test_distributions_grouped() -> None:
+    res = distributions(
+        np,
+        np.array([5.0, 1.0, math.nan, 3.0, math.nan, 2.0]),
+        _strs("b", "a", "c", "b", "a", "a"),
+        percentiles=[50, 99.9],
+        edges=[0],
+    )
+    # 'c' only had a NaN value.
+    assert sorted(res.keys()) == ["a", "b"]
+    assert (res["a"].count, res["a"].min, res["a"].max) == (2, 1.0, 2.0)
+    assert (res["b"].count, res["b"].min, res["b"].max) == (2, 3.0, 5.0)
+    assert list(res["a"].percentiles.keys()) == ["p50", "p99_9"]
+    assert res["b"].percentiles["p50"] == 4.0
+
+
+def test_distributions_empty() -> None:
+    assert distributions(np, np.zeros(0)) == {}
+    assert distributions(np, np.zeros(0), _strs()) == {}
+    assert distributions(np, np.array([math.nan])) == {}
+    assert distributions(np, np.array([math.nan]), _strs("a")) == {}
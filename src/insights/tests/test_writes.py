@@ -0,0 +1,152 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import asyncio
+from typing import Any
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError
+
+from insights.config import WritesConfigModel
+from insights.engine.writes import WritePipeline, WriteResult
+
+
+class FakeBulkWriteResult:
+    upserted_ids: dict[int, Any]
+
+    def __init__(self, upserted_ids: dict[int, Any]) -> None:
+        self.upserted_ids = upserted_ids
+
+
+class FakeCollection:
+    """Records bulk writes, failing them with the queued errors in turn."""
+
+    calls: list[list[UpdateOne]]
+    errors: list[dict[str, Any]]
+    delay: float
+    active: int
+
+    def __init__(self) -> None:
+        self.calls = []
+        self.errors = []
+        self.delay = 0.0
+        self.active = 0
+
+    async def bulk_write(self, ops: list[UpdateOne], ordered: bool) -> Any:
+        assert ordered
+        assert self.active == 0, "batches of a collection must not overlap"
+        self.active += 1
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+
+        self.calls.append(list(ops))
+        if len(self.errors) > 0:
+            raise BulkWriteError(self.errors.pop(0))
+        return FakeBulkWriteResult({0: "new"})
+
+
+class FakeDatabase:
+    name = "fake"
+    coll: FakeCollection
+
+    def __init__(self) -> None:
+        self.coll = FakeCollection()
+
+    def get_collection(self, name: str, write_concern: Any = None) -> FakeCollection:
+        return self.coll
+
+
+def _op(n: int) -> UpdateOne:
+    return UpdateOne({"_id": n}, {"$set": {"n": n}}, upsert=True)
+
+
+def _ops(*ns: int) -> list[UpdateOne]:
+    return [_op(n) for n in ns]
+
+
+def _run(
+    db: FakeDatabase, count: int, max_batch: int = 100
+) -> tuple[WritePipeline, list[WriteResult | BaseException]]:
+    async def run() -> tuple[WritePipeline, list[WriteResult | BaseException]]:
+        pipeline = WritePipeline(
+            db,  # type: ignore
+            WritesConfigModel(max_batch=max_batch, max_delay=0),
+        )
+        futures = [pipeline.write("things", _op(n)) for n in range(count)]
+        await pipeline.close()
+        return pipeline, await asyncio.gather(*futures, return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+def test_batches_written_in_order() -> None:
+    db = FakeDatabase()
+    db.coll.delay = 0.01
+
+    pipeline, res = _run(db, 5, max_batch=2)
+
+    assert db.coll.calls == [_ops(0, 1), _ops(2, 3), _ops(4)]
+    assert all(isinstance(r, WriteResult) for r in res)
+    assert pipeline.stats.batches == 3
+    assert pipeline.stats.writes == 5
+    assert pipeline.stats.errors == 0
+
+
+def test_failed_write_resubmits_the_rest() -> None:
+    db = FakeDatabase()
+    db.coll.errors = [
+        {
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate"}],
+            "upserted": [{"index": 0, "_id": "first"}],
+        }
+    ]
+
+    pipeline, res = _run(db, 4)
+
+    assert db.coll.calls == [_ops(0, 1, 2, 3), _ops(2, 3)]
+    assert isinstance(res[0], WriteResult) and res[0].upserted_id == "first"
+    assert isinstance(res[1], DuplicateKeyError)
+    assert isinstance(res[2], WriteResult) and res[2].upserted_id == "new"
+    assert isinstance(res[3], WriteResult) and res[3].upserted_id is None
+    assert pipeline.stats.errors == 1
+
+
+def test_write_concern_failure_fails_writes() -> None:
+    db = FakeDatabase()
+    db.coll.errors = [
+        {"writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication"}]}
+    ]
+
+    pipeline, res = _run(db, 3)
+
+    assert db.coll.calls == [_ops(0, 1, 2)]
+    assert all(isinstance(r, WriteConcernError) for r in res)
+    assert pipeline.stats.errors == 3
+
+
+@pytest.mark.parametrize("index", [0, 2])
+def test_write_concern_failure_with_write_error(index: int) -> None:
+    db = FakeDatabase()
+    db.coll.errors = [
+        {
+            "writeErrors": [{"index": index, "code": 2, "errmsg": "bad value"}],
+            "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication"}],
+        }
+    ]
+
+    _, res = _run(db, 4)
+
+    # writes applied before the failed one weren't acknowledged, those after it
+    # were resubmitted.
+    assert all(isinstance(r, WriteConcernError) for r in res[:index])
+    assert not isinstance(res[index], WriteConcernError)
+    assert isinstance(res[index], Exception)
+    assert all(isinstance(r, WriteResult) for r in res[index + 1 :])
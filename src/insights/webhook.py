@@ -0,0 +1,151 @@
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import hashlib
+import hmac
+
+from fastapi import Request
+from fastapi.logger import logger
+from githubkit.webhooks import parse
+from githubkit.webhooks.types import WebhookEvent
+from pydantic import BaseModel, Field
+
+
+class _InstallationRef(BaseModel):
+    id: int
+
+
+class WebhookSummary(BaseModel):
+    """The few fields needed to route any webhook, ignoring everything else."""
+
+    action: str | None = Field(default=None)
+    installation: _InstallationRef | None = Field(default=None)
+
+    @property
+    def installation_id(self) -> int | None:
+        return self.installation.id if self.installation is not None else None
+
+
+class WebhookEnvelope:
+    """A webhook request, with its body read exactly once.
+
+    The raw body is kept as received, and shared by signature verification,
+    parsing and the event database, none of which need to read the request
+    again.
+    """
+
+    body: bytes
+    headers: list[tuple[str, str]]
+    event_name: str
+    delivery_id: str | None
+    signature: str | None
+    event: WebhookEvent | None
+    _summary: WebhookSummary | None
+
+    def __init__(
+        self,
+        body: bytes,
+        headers: list[tuple[str, str]],
+        event_name: str,
+        delivery_id: str | None,
+        signature: str | None = None,
+    ) -> None:
+        self.body = body
+        self.headers = headers
+        self.event_name = event_name
+        self.delivery_id = delivery_id
+        self.signature = signature
+        self.event = None
+        self._summary = None
+
+    @classmethod
+    async def from_request(cls, request: Request) -> "WebhookEnvelope | None":
+        """Read a webhook request, or None if this is not a GitHub event."""
+        event_name: str | None = request.headers.get("X-GitHub-Event")
+        if event_name is None:
+            return None
+
+        return cls(
+            await request.body(),
+            request.headers.items(),
+            event_name,
+            request.headers.get("X-GitHub-Delivery"),
+            request.headers.get("X-Hub-Signature-256"),
+        )
+
+    def parse(self) -> WebhookEvent:
+        """Validate the body into its event model, caching the result."""
+        if self.event is None:
+            self.event = parse(self.event_name, self.body)
+        return self.event
+
+    def summary(self) -> WebhookSummary:
+        """Partially decode the body, without validating the full event."""
+        if self._summary is None:
+            self._summary = WebhookSummary.model_validate_json(self.body)
+        return self._summary
+
+
+class WebhookVerifierStats(BaseModel):
+    accepted: int
+    rejected_missing: int
+    rejected_invalid: int
+
+
+class WebhookVerifier:
+    """Verify 'X-Hub-Signature-256' webhook signatures.
+
+    Keyed HMAC objects are computed once per secret and copied for each request,
+    and digests are compared in constant time. A second, previous, secret may be
+    provided so that deliveries signed with either are accepted during rotation.
+    """
+
+    _keyed: list[hmac.HMAC]
+    _accepted: int
+    _rejected_missing: int
+    _rejected_invalid: int
+
+    def __init__(self, secret: str, previous: str | None = None) -> None:
+        secrets = [s for s in (secret, previous) if s is not None and len(s) > 0]
+        self._keyed = [
+            hmac.new(s.encode("utf-8"), digestmod=hashlib.sha256) for s in secrets
+        ]
+        if len(self._keyed) == 0:
+            logger.warning("No webhook secret configured, not verifying signatures")
+
+        self._accepted = 0
+        self._rejected_missing = 0
+        self._rejected_invalid = 0
+
+    @property
+    def stats(self) -> WebhookVerifierStats:
+        return WebhookVerifierStats(
+            accepted=self._accepted,
+            rejected_missing=self._rejected_missing,
+            rejected_invalid=self._rejected_invalid,
+        )
+
+    def verify(self, envelope: WebhookEnvelope) -> bool:
+        if len(self._keyed) == 0:
+            return True
+
+        signature = envelope.signature
+        if signature is None or not signature.startswith("sha256="):
+            self._rejected_missing += 1
+            return False
+
+        expected = signature[len("sha256=") :].encode("ascii", errors="replace")
+        for keyed in self._keyed:
+            mac = keyed.copy()
+            mac.update(envelope.body)
+            if hmac.compare_digest(mac.hexdigest().encode("ascii"), expected):
+                self._accepted += 1
+                return True
+
+        self._rejected_invalid += 1
+        return False
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import argparse
+import asyncio
+import errno
+import sys
+
+from insights.config import Config, ConfigError
+from insights.engine.db_client import DBClient
+from insights.engine.metrics import Metrics, MetricsReport
+from insights.engine.rollups import Rollups
+from insights.engine.writes import WritePipeline
+
+_DB_INSTALLATION_PREFIX = "installation-"
+
+
+def print_report(report: MetricsReport) -> None:
+    print(
+        f"{report.database}: {report.issues} issues, {report.labels} label counts, "
+        f"{report.authors} authors; {report.mismatched} entries differ"
+    )
+
+
+async def rebuild(
+    config: Config, installation_id: int | None, dry_run: bool
+) -> list[MetricsReport]:
+    client = DBClient(config.db).client
+
+    if installation_id is not None:
+        names = [f"{_DB_INSTALLATION_PREFIX}{installation_id}"]
+    else:
+        names = [
+            n
+            for n in await client.list_database_names()
+            if n.startswith(_DB_INSTALLATION_PREFIX)
+        ]
+
+    reports: list[MetricsReport] = []
+    for name in names:
+        db = client[name]
+        writes = WritePipeline(db, config.writes)
+        metrics = Metrics(db, writes, Rollups(db, writes, config.rollups))
+        report = await metrics.rebuild(dry_run=dry_run)
+        print_report(report)
+        reports.append(report)
+
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Recompute the materialized metrics from stored issues and "
+        "comments."
+    )
+    parser.add_argument("config", help="path to the insights config file")
+    parser.add_argument(
+        "-i", "--installation", type=int, help="only rebuild this installation"
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        "--verify",
+        action="store_true",
+        help="report entries that differ without replacing them",
+    )
+    args = parser.parse_args()
+
+    try:
+        config = Config(args.config)
+    except ConfigError as e:
+        print(f"Unable to obtain config: {str(e)}")
+        sys.exit(errno.EINVAL)
+
+    reports = asyncio.run(rebuild(config, args.installation, args.dry_run))
+
+    # verifying fails if anything had drifted.
+    if args.dry_run and any(r.mismatched > 0 for r in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
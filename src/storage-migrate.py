@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# One Second Project Insights
+# Copyright 2023 1e3ms contributors <code@1e3ms.io>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import argparse
+import asyncio
+import errno
+import sys
+
+from insights.config import Config, ConfigError
+from insights.engine.compact import CommentCompactor, CompactionReport
+from insights.engine.db_client import DBClient
+
+_DB_INSTALLATION_PREFIX = "installation-"
+
+
+def print_report(report: CompactionReport) -> None:
+    print(
+        f"{report.database}: compacted {report.compacted} of {report.comments} "
+        f"comments, {report.repositories} repositories, {report.users} users"
+    )
+    print(
+        f"  {report.bytes_before} -> {report.bytes_after} bytes "
+        f"({report.reduction * 100:.1f}% smaller)"
+    )
+
+
+async def migrate(
+    config: Config, installation_id: int | None, dry_run: bool
+) -> list[CompactionReport]:
+    client = DBClient(config.db).client
+
+    if installation_id is not None:
+        names = [f"{_DB_INSTALLATION_PREFIX}{installation_id}"]
+    else:
+        names = [
+            n
+            for n in await client.list_database_names()
+            if n.startswith(_DB_INSTALLATION_PREFIX)
+        ]
+
+    reports: list[CompactionReport] = []
+    for name in names:
+        compactor = CommentCompactor(
+            client[name], keep_body=config.storage.keep_comment_body
+        )
+        report = await compactor.migrate(dry_run=dry_run)
+        print_report(report)
+        reports.append(report)
+
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Migrate stored comments to the compact storage schema."
+    )
+    parser.add_argument("config", help="path to the insights config file")
+    parser.add_argument(
+        "-i", "--installation", type=int, help="only migrate this installation"
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="report the size reduction without migrating",
+    )
+    args = parser.parse_args()
+
+    try:
+        config = Config(args.config)
+    except ConfigError as e:
+        print(f"Unable to obtain config: {str(e)}")
+        sys.exit(errno.EINVAL)
+
+    if config.storage.comments != "compact":
+        print("warning: 'storage.comments' is not 'compact', new comments are full")
+
+    reports = asyncio.run(migrate(config, args.installation, args.dry_run))
+
+    before = sum(r.bytes_before for r in reports)
+    after = sum(r.bytes_after for r in reports)
+    if len(reports) > 1 and before > 0:
+        print(f"total: {before} -> {after} bytes ({(1 - after / before) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()